@@ -1,11 +1,19 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass
 from enum import Enum
 from functools import wraps
-from typing import Callable, Optional
-from app.common.patterns.retry import ExponentialBackoff
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+from app.common.patterns.retry import ExponentialBackoff, RetryPolicy, is_retryable
+from app.common.patterns.shared_state import SharedState, get_shared_state
 import asyncio
 import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 
 class CircuitBreakerStatus(Enum):
@@ -14,13 +22,25 @@ class CircuitBreakerStatus(Enum):
     HALF_OPEN = "HALF_OPEN"
 
 
+class CircuitBreakerOpenError(Exception):
+    """Chamada recusada sem tentativa porque o circuito está aberto"""
+
+
 @dataclass
 class CircuitBreakerConfig:
-    failure_threshold: int = 5  # Number of failures to open the circuit
+    failure_threshold: int = 5  # Minimum failures inside the window to open the circuit
     # Time to attempt to close the circuit again (timedelta or seconds as int/float)
     reset_timeout: timedelta = timedelta(minutes=1)
     # Time to wait before retrying a failed operation (timedelta or seconds as int/float)
     retry_timeout: timedelta = timedelta(seconds=10)
+    # Rolling window used to compute the failure rate
+    window: timedelta = timedelta(seconds=60)
+    # Failure rate (0-1) inside the window that, with failure_threshold, opens the circuit
+    failure_rate_threshold: float = 0.5
+    # Probe calls allowed while HALF_OPEN
+    half_open_max_calls: int = 1
+    # Most recent error messages kept for introspection
+    max_error_messages: int = 20
 
     def __post_init__(self):
         # Normalize numeric timeouts to timedelta for convenience
@@ -28,74 +48,247 @@ class CircuitBreakerConfig:
             self.reset_timeout = timedelta(seconds=self.reset_timeout)
         if isinstance(self.retry_timeout, (int, float)):
             self.retry_timeout = timedelta(seconds=self.retry_timeout)
+        if isinstance(self.window, (int, float)):
+            self.window = timedelta(seconds=self.window)
+
+
+# Quantidade de buckets em que a janela é dividida
+_WINDOW_BUCKETS = 10
+
+# Estado do breaker em um vetor de floats, que cabe em um slot de SharedState:
+# [estado, aberto_em, testes_half_open, última_falha, (bucket, chamadas, falhas) * N]
+_STATES = [CircuitBreakerStatus.CLOSED, CircuitBreakerStatus.OPEN, CircuitBreakerStatus.HALF_OPEN]
+_STATE, _OPENED_AT, _HALF_OPEN_CALLS, _LAST_FAILURE, _BUCKETS = range(5)
+_STATE_SIZE = _BUCKETS + 3 * _WINDOW_BUCKETS
 
 
 class CircuitBreaker:
-    def __init__(self, config: CircuitBreakerConfig):
+    """Circuit breaker com taxa de falhas em janela móvel.
+
+    Com `shared_state`, o estado fica em um slot do arquivo compartilhado e
+    vale para todos os processos do host; o histórico de mensagens de erro
+    continua local ao processo.
+    """
+
+    def __init__(self, config: CircuitBreakerConfig, name: str = "default", shared_state=None):
+        self.name = name
         self.config = config
-        self.failure_count = 0
-        # Possible states: CLOSED, OPEN, HALF-OPEN
-        self.state = CircuitBreakerStatus.CLOSED
-        self.error_messages = []
-        self.last_failure_time = None
+        self.error_messages = deque(maxlen=config.max_error_messages)
+        self.shared_state = shared_state
+        self._values = [0.0] * _STATE_SIZE
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[List[float]]:
+        if self.shared_state is not None:
+            with self.shared_state.slot(f"cb:{self.name}") as values:
+                yield values
+        else:
+            with self._lock:
+                yield self._values
+
+    @property
+    def state(self) -> CircuitBreakerStatus:
+        with self._transaction() as v:
+            return _STATES[int(v[_STATE])]
+
+    @property
+    def failure_count(self) -> int:
+        with self._transaction() as v:
+            return self._window_counts(v, time.monotonic())[1]
+
+    @property
+    def last_failure_time(self) -> Optional[float]:
+        """Instante (time.monotonic) da última falha"""
+        with self._transaction() as v:
+            return v[_LAST_FAILURE] or None
 
     def has_passed_reset_time(self) -> bool:
-        if self.last_failure_time is None:
-            return False
-        return datetime.now() - self.last_failure_time > self.config.reset_timeout
+        with self._transaction() as v:
+            return self._passed_reset_time(v, time.monotonic())
 
     def can_retry(self) -> bool:
-        if self.state == CircuitBreakerStatus.CLOSED:
-            return True
+        with self._transaction() as v:
+            now = time.monotonic()
+            state = _STATES[int(v[_STATE])]
 
-        if self.state == CircuitBreakerStatus.OPEN:
-            if self.has_passed_reset_time():
-                self.state = CircuitBreakerStatus.HALF_OPEN
+            if state == CircuitBreakerStatus.CLOSED:
                 return True
-            return False
 
-        if self.state == CircuitBreakerStatus.HALF_OPEN:
+            if state == CircuitBreakerStatus.OPEN:
+                if not self._passed_reset_time(v, now):
+                    return False
+                v[_STATE] = _STATES.index(CircuitBreakerStatus.HALF_OPEN)
+                v[_HALF_OPEN_CALLS] = 0
+                v[_OPENED_AT] = now
+
+            # HALF_OPEN: só algumas chamadas de teste; as demais falham rápido.
+            # Testes que nunca registraram resultado (ex.: cancelados) liberam
+            # a vaga depois de outro reset_timeout
+            if v[_HALF_OPEN_CALLS] >= self.config.half_open_max_calls:
+                if not self._passed_reset_time(v, now):
+                    return False
+                v[_HALF_OPEN_CALLS] = 0
+                v[_OPENED_AT] = now
+            v[_HALF_OPEN_CALLS] += 1
             return True
 
-        return False
-
     def record_failure(self, error_message: str = None):
-        self.failure_count += 1
         if error_message:
             self.error_messages.append(
                 f"{datetime.now().isoformat()}: {error_message}")
         else:
             self.error_messages.append(
                 f"Failure at {datetime.now().isoformat()}")
-        self.last_failure_time = datetime.now()
 
-        if self.state == CircuitBreakerStatus.HALF_OPEN:
-            self.state = CircuitBreakerStatus.OPEN
-            return
+        with self._transaction() as v:
+            now = time.monotonic()
+            self._count(v, now, failed=True)
+            v[_LAST_FAILURE] = now
 
-        if self.failure_count >= self.config.failure_threshold:
-            self.state = CircuitBreakerStatus.OPEN
+            if _STATES[int(v[_STATE])] == CircuitBreakerStatus.HALF_OPEN:
+                self._open(v, now)
+                return
+
+            calls, failures = self._window_counts(v, now)
+            if failures >= self.config.failure_threshold and \
+               failures / calls >= self.config.failure_rate_threshold:
+                self._open(v, now)
 
     def record_success(self):
-        if self.state == CircuitBreakerStatus.HALF_OPEN:
-            self.state = CircuitBreakerStatus.CLOSED
+        with self._transaction() as v:
+            self._count(v, time.monotonic(), failed=False)
+
+            if _STATES[int(v[_STATE])] == CircuitBreakerStatus.HALF_OPEN:
+                v[:] = [0.0] * _STATE_SIZE
+                self.error_messages.clear()
+
+    def reset(self) -> None:
+        with self._transaction() as v:
+            v[:] = [0.0] * _STATE_SIZE
+        self.error_messages.clear()
+
+    def status(self) -> Dict[str, Any]:
+        """Estado atual para introspecção (endpoint de status, logs)"""
+        with self._transaction() as v:
+            now = time.monotonic()
+            state = _STATES[int(v[_STATE])]
+            calls, failures = self._window_counts(v, now)
+            opened_at = None
+            if state != CircuitBreakerStatus.CLOSED:
+                opened_at = datetime.now(timezone.utc) - timedelta(seconds=now - v[_OPENED_AT])
+
+        return {
+            "name": self.name,
+            "state": state.value,
+            "calls": calls,
+            "failures": failures,
+            "failure_rate": failures / calls if calls else 0.0,
+            "opened_at": opened_at.isoformat() if opened_at else None,
+            "last_errors": list(self.error_messages),
+            "shared": self.shared_state is not None,
+        }
+
+    def _passed_reset_time(self, v: List[float], now: float) -> bool:
+        if _STATES[int(v[_STATE])] == CircuitBreakerStatus.CLOSED:
+            return False
+        return now - v[_OPENED_AT] > self.config.reset_timeout.total_seconds()
+
+    def _open(self, v: List[float], now: float) -> None:
+        v[_STATE] = _STATES.index(CircuitBreakerStatus.OPEN)
+        v[_OPENED_AT] = now
+
+    def _bucket_size(self) -> float:
+        return self.config.window.total_seconds() / _WINDOW_BUCKETS
+
+    def _count(self, v: List[float], now: float, failed: bool) -> None:
+        # Buckets em anel indexados pelo número do intervalo; o número fica
+        # guardado para saber se o bucket ainda pertence à janela atual
+        bucket = int(now // self._bucket_size()) + 1
+        i = _BUCKETS + 3 * (bucket % _WINDOW_BUCKETS)
+        if v[i] != bucket:
+            v[i:i + 3] = [bucket, 0, 0]
+        v[i + 1] += 1
+        if failed:
+            v[i + 2] += 1
+
+    def _window_counts(self, v: List[float], now: float):
+        current = int(now // self._bucket_size()) + 1
+        calls = failures = 0
+        for i in range(_BUCKETS, _STATE_SIZE, 3):
+            if v[i] and current - v[i] < _WINDOW_BUCKETS:
+                calls += int(v[i + 1])
+                failures += int(v[i + 2])
+        return calls, failures
+
+
+class CircuitBreakerRegistry:
+    """Breakers nomeados compartilhados pelo processo.
+
+    Todos os chamadores de uma mesma dependência (ex.: `sefaz:SP`,
+    `webhook:cliente.com`, `supabase:nfe`) usam o mesmo breaker, então uma
+    falha detectada por um workflow passa a valer para todos.
+    """
+
+    def __init__(self, default_config: Optional[CircuitBreakerConfig] = None,
+                 shared_state: Optional[SharedState] = None):
+        self.default_config = default_config or CircuitBreakerConfig()
+        # Com SharedState, todos os processos do host enxergam os mesmos estados
+        self.shared_state = shared_state
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, config: Optional[CircuitBreakerConfig] = None) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = CircuitBreaker(
+                        config or self.default_config, name=name, shared_state=self.shared_state)
+                    self._breakers[name] = breaker
+        return breaker
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [breaker.status() for breaker in list(self._breakers.values())]
+
+    def reset(self, name: str) -> bool:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            return False
+        breaker.reset()
+        return True
+
 
-        self.failure_count = 0
-        self.error_messages = []
-        self.last_failure_time = None
+circuit_breakers = CircuitBreakerRegistry(shared_state=get_shared_state())
 
 
 async def retry_with_circuit_breaker(
     operation: callable,
     circuit_breaker: CircuitBreaker,
-    backoff: ExponentialBackoff
+    backoff: Union[ExponentialBackoff, RetryPolicy]
 ):
-    """Retry an operation using circuit breaker and exponential backoff."""
+    """Retry an operation using circuit breaker and exponential backoff.
+
+    Com um `RetryPolicy`, cada chamada usa o próprio backoff e os retries
+    consomem o orçamento da dependência (nome do circuit breaker). Erros não
+    transitórios (`is_retryable`) são repassados na hora e não contam como
+    falha da dependência.
+    """
+    classify = is_retryable
+    budget = None
+    if isinstance(backoff, RetryPolicy):
+        classify = backoff.is_retryable
+        budget = backoff.budget(circuit_breaker.name)
+        backoff = backoff.new_backoff()
+
+    if budget is not None:
+        budget.record_call()
 
     while True:
         if not circuit_breaker.can_retry():
-            raise Exception(
-                f"Circuit breaker is open. \n Failures: {circuit_breaker.error_messages}")
+            raise CircuitBreakerOpenError(
+                f"Circuit breaker {circuit_breaker.name} is open. \n Failures: {list(circuit_breaker.error_messages)}")
 
         try:
             if inspect.iscoroutinefunction(operation):
@@ -109,14 +302,22 @@ async def retry_with_circuit_breaker(
 
             return result
         except Exception as e:
+            if not classify(e):
+                # A dependência respondeu; o problema está na requisição
+                circuit_breaker.record_success()
+                raise
+
             circuit_breaker.record_failure(error_message=str(e))
             delay = backoff.next_delay()
             if delay is None:
                 raise e
+            if budget is not None and not budget.try_acquire_retry():
+                logger.warning("Orçamento de retries esgotado para %s", circuit_breaker.name)
+                raise e
             await asyncio.sleep(delay)
 
-# Instância global do circuit breaker (compartilhada entre rotas)
-_default_circuit_breaker = CircuitBreaker(CircuitBreakerConfig())
+# Breaker padrão do decorator (compartilhado entre rotas)
+_default_circuit_breaker = circuit_breakers.get("api")
 
 
 def with_retry_and_circuit_breaker(
@@ -141,35 +342,27 @@ def with_retry_and_circuit_breaker(
             ...
     """
     cb = circuit_breaker or _default_circuit_breaker
+    policy = RetryPolicy(
+        initial_delay=initial_delay,
+        max_delay=max_delay,
+        max_attempts=max_attempts,
+        jitter=jitter,
+    )
 
     def decorator(func: Callable):
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            backoff = ExponentialBackoff(
-                initial_delay=initial_delay,
-                max_delay=max_delay,
-                max_attemps=max_attempts,
-                jitter=jitter,
-            )
-
             async def operation():
                 return await func(*args, **kwargs)
 
-            return await retry_with_circuit_breaker(operation, cb, backoff)
+            return await retry_with_circuit_breaker(operation, cb, policy)
 
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            backoff = ExponentialBackoff(
-                initial_delay=initial_delay,
-                max_delay=max_delay,
-                max_attemps=max_attempts,
-                jitter=jitter,
-            )
-
             async def operation():
                 return func(*args, **kwargs)
 
-            return asyncio.run(retry_with_circuit_breaker(operation, cb, backoff))
+            return asyncio.run(retry_with_circuit_breaker(operation, cb, policy))
 
         if inspect.iscoroutinefunction(func):
             return async_wrapper
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Cache LRU thread-safe com tamanho máximo e TTL opcional.
+
+    `on_evict(key, value)` é chamado para entradas removidas por tamanho,
+    expiração ou `pop`/`clear`, fora do lock interno.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, V], Any]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        expired = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                expired = value
+            else:
+                self._data.move_to_end(key)
+                return value
+
+        self._evicted(key, expired)
+        return default
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        evicted = []
+
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None and previous[0] is not value:
+                evicted.append((key, previous[0]))
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value))
+
+        for old_key, old_value in evicted:
+            self._evicted(old_key, old_value)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        self._evicted(key, entry[0])
+        return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            entries, self._data = self._data, OrderedDict()
+        for key, (value, _) in entries.items():
+            self._evicted(key, value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evicted(self, key: Hashable, value: V) -> None:
+        if self.on_evict is not None:
+            self.on_evict(key, value)
@@ -1,14 +1,175 @@
-from fastapi import Request
+import hashlib
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Protocol
+
+from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
-from starlette.responses import Response
-from datetime import datetime, timezone, timedelta
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.common.patterns.lru_cache import LRUCache
+from app.common.patterns.shared_state import SharedState, get_shared_state
+from app.infra.resp_client import RespClient, RespError
+
+logger = logging.getLogger(__name__)
+
+# Limites no formato "<requisições>/<segundos>"; o padrão mantém 10 req a cada 5 s
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "10/5")
+# Limites por rota: "/nfe/json-para-xml=10/5,/emitir-nfe=100/1"
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "")
+# Limites por API key (header X-API-Key): "<chave>=1000/60,..."
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "")
+# "redis://host:6379/0" compartilha entre hosts; sem ele, SHARED_STATE_PATH
+# compartilha entre os workers do host e, sem nenhum dos dois, vale por processo
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+# Quantidade máxima de clientes acompanhados pelo backend em memória
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+API_KEY_HEADER = "X-API-Key"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Token bucket: até `capacidade` requisições de uma vez, repostas à taxa `por_segundo`"""
+    capacidade: int
+    por_segundo: float
+
+    @classmethod
+    def parse(cls, valor: str) -> "RateLimit":
+        requisicoes, segundos = valor.strip().split("/")
+        return cls(capacidade=int(requisicoes), por_segundo=int(requisicoes) / float(segundos))
+
+    @property
+    def tempo_para_encher(self) -> float:
+        return self.capacidade / self.por_segundo
+
+
+@dataclass
+class RateLimitResult:
+    permitido: bool
+    restantes: float
+    retry_after: float
+
+
+def _parse_limites(valor: str) -> Dict[str, RateLimit]:
+    limites = {}
+    for item in filter(None, (parte.strip() for parte in valor.split(","))):
+        chave, limite = item.rsplit("=", 1)
+        limites[chave.strip()] = RateLimit.parse(limite)
+    return limites
+
+
+def _resultado(tokens: float, permitido: bool, limite: RateLimit) -> RateLimitResult:
+    retry_after = 0.0 if permitido else (1 - tokens) / limite.por_segundo
+    return RateLimitResult(permitido=permitido, restantes=tokens, retry_after=retry_after)
+
+
+class RateLimitBackend(Protocol):
+    async def consumir(self, chave: str, limite: RateLimit) -> RateLimitResult:
+        ...
+
+
+class InMemoryRateLimitBackend:
+    """Buckets no próprio processo, em um LRU limitado a `max_keys` clientes.
+
+    Um bucket que ficou parado tempo suficiente para encher equivale a um
+    bucket novo, então a entrada expira nesse momento e a memória não cresce
+    com clientes que não voltam.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self._buckets: LRUCache[tuple] = LRUCache(max_keys)
+
+    async def consumir(self, chave: str, limite: RateLimit) -> RateLimitResult:
+        agora = time.monotonic()
+        tokens, atualizado_em = self._buckets.get(chave) or (limite.capacidade, agora)
+
+        tokens = min(limite.capacidade, tokens + (agora - atualizado_em) * limite.por_segundo)
+        permitido = tokens >= 1
+        if permitido:
+            tokens -= 1
+
+        # Sem await entre a leitura e a escrita: atômico dentro do event loop
+        self._buckets.set(chave, (tokens, agora), ttl=limite.tempo_para_encher)
+        return _resultado(tokens, permitido, limite)
+
+
+class SharedMemoryRateLimitBackend:
+    """Buckets em um `SharedState`: todos os workers do host dividem o mesmo limite.
+
+    O arquivo tem tamanho fixo; clientes inativos perdem o slot para os novos.
+    """
 
-WINDOW_SECONDS = 5         # janela de 5 segundos
-MAX_REQUESTS = 10          # no máximo 10 req por janela
+    def __init__(self, shared_state: SharedState):
+        self.shared_state = shared_state
 
-# Armazenamento em memória para rate limit por IP
-# Substituir por redis
-_rate_limit_store: dict[str, dict] = {}
+    async def consumir(self, chave: str, limite: RateLimit) -> RateLimitResult:
+        # CLOCK_MONOTONIC é comum a todos os processos do host
+        agora = time.monotonic()
+        with self.shared_state.slot(f"rl:{chave}") as valores:
+            tokens, atualizado_em, existe = valores[0], valores[1], valores[2]
+            if not existe:
+                tokens, atualizado_em = limite.capacidade, agora
+
+            tokens = min(limite.capacidade, tokens + max(0.0, agora - atualizado_em) * limite.por_segundo)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            valores[0:3] = [tokens, agora, 1.0]
+
+        return _resultado(tokens, permitido, limite)
+
+
+# Token bucket atômico no servidor; usa o relógio do Redis para que todos
+# os processos compartilhem a mesma referência de tempo
+_TOKEN_BUCKET_LUA = """
+local capacidade = tonumber(ARGV[1])
+local por_segundo = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacidade
+local ts = tonumber(bucket[2]) or agora
+tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * por_segundo)
+local permitido = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  permitido = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(agora))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacidade / por_segundo * 1000))
+return {permitido, tostring(tokens)}
+"""
+_TOKEN_BUCKET_SHA = hashlib.sha1(_TOKEN_BUCKET_LUA.encode()).hexdigest()
+
+
+class RedisRateLimitBackend:
+    """Buckets compartilhados entre processos em um servidor compatível com Redis.
+
+    As chaves expiram quando o bucket enche novamente, então o servidor
+    também não acumula clientes inativos.
+    """
+
+    def __init__(self, client: RespClient, prefixo: str = "ratelimit:"):
+        self.client = client
+        self.prefixo = prefixo
+
+    async def consumir(self, chave: str, limite: RateLimit) -> RateLimitResult:
+        args = (1, self.prefixo + chave, limite.capacidade, limite.por_segundo)
+        try:
+            permitido, tokens = await self.client.execute("EVALSHA", _TOKEN_BUCKET_SHA, *args)
+        except RespError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            permitido, tokens = await self.client.execute("EVAL", _TOKEN_BUCKET_LUA, *args)
+
+        return _resultado(float(tokens), permitido == 1, limite)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
 
 
 def get_client_ip(request: Request) -> str:
@@ -20,34 +181,94 @@ def get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-async def check_rate_limit(request: Request) -> Response | None:
-    """Verifica rate limit baseado no IP do cliente."""
-    client_ip = get_client_ip(request)
-    now = datetime.now(timezone.utc)
-
-    if client_ip not in _rate_limit_store:
-        _rate_limit_store[client_ip] = {
-            "window_start": now,
-            "count": 1
-        }
-        return None
-
-    entry = _rate_limit_store[client_ip]
-    window_start = entry["window_start"]
-    count = entry["count"]
-
-    if now - window_start > timedelta(seconds=WINDOW_SECONDS):
-        _rate_limit_store[client_ip] = {
-            "window_start": now,
-            "count": 1
-        }
-        return None
-
-    if count >= MAX_REQUESTS:
-        return JSONResponse(
-            status_code=429,
-            content={"detail": f"Rate limit excedido para o IP {client_ip}"}
-        )
-
-    _rate_limit_store[client_ip]["count"] = count + 1
-    return None
+class RateLimiter:
+    """Aplica os limites por rota e por cliente (API key ou IP).
+
+    Requisições com uma API key configurada usam o limite da chave; as demais
+    usam o limite da rota (ou o padrão) contado por IP. Falhas do backend não
+    bloqueiam a API: a requisição segue e o erro é registrado.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        limite_padrao: RateLimit,
+        limites_rota: Optional[Dict[str, RateLimit]] = None,
+        limites_api_key: Optional[Dict[str, RateLimit]] = None,
+    ):
+        self.backend = backend
+        self.limite_padrao = limite_padrao
+        self.limites_rota = limites_rota or {}
+        self.limites_api_key = limites_api_key or {}
+
+    async def verificar(self, request: Request, rota: Optional[str] = None) -> RateLimitResult:
+        rota = rota or request.url.path
+        api_key = request.headers.get(API_KEY_HEADER)
+
+        if api_key and api_key in self.limites_api_key:
+            limite = self.limites_api_key[api_key]
+            # A chave não vai em claro para o backend
+            cliente = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        else:
+            limite = self.limites_rota.get(rota, self.limite_padrao)
+            cliente = "ip:" + get_client_ip(request)
+
+        try:
+            return await self.backend.consumir(f"{rota}|{cliente}", limite)
+        except Exception as e:
+            logger.warning("Falha no backend de rate limit: %s", e)
+            return RateLimitResult(permitido=True, restantes=0, retry_after=0)
+
+    async def aclose(self) -> None:
+        aclose = getattr(self.backend, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    async def __call__(self, request: Request) -> None:
+        """Dependência FastAPI: `Depends(rate_limiter)` na rota ou no router"""
+        route = request.scope.get("route")
+        resultado = await self.verificar(request, getattr(route, "path", None))
+        if not resultado.permitido:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit excedido para {get_client_ip(request)}",
+                headers={"Retry-After": str(math.ceil(resultado.retry_after))},
+            )
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """Aplica o `RateLimiter` a todas as requisições, usando o path como rota"""
+
+    def __init__(self, app, limiter: "RateLimiter"):
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request: Request, call_next):
+        resultado = await self.limiter.verificar(request)
+        if not resultado.permitido:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"Rate limit excedido para {get_client_ip(request)}"},
+                headers={"Retry-After": str(math.ceil(resultado.retry_after))},
+            )
+        return await call_next(request)
+
+
+def criar_rate_limiter() -> RateLimiter:
+    """Monta o limiter a partir das variáveis de ambiente RATE_LIMIT_*"""
+    if RATE_LIMIT_REDIS_URL:
+        backend = RedisRateLimitBackend(RespClient(RATE_LIMIT_REDIS_URL))
+    elif get_shared_state() is not None:
+        backend = SharedMemoryRateLimitBackend(get_shared_state())
+    else:
+        backend = InMemoryRateLimitBackend()
+
+    return RateLimiter(
+        backend,
+        RateLimit.parse(RATE_LIMIT_DEFAULT),
+        _parse_limites(RATE_LIMIT_ROUTES),
+        _parse_limites(RATE_LIMIT_API_KEYS),
+    )
+
+
+rate_limiter = criar_rate_limiter()
@@ -1,7 +1,19 @@
 import random
-from typing import Callable
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
 import asyncio
 
+import httpx
+import requests
+
+# Retries permitidos por dependência, como fração das chamadas na janela
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+# Mínimo de retries por segundo, para dependências com pouco tráfego
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", "10"))
+
 
 class ExponentialBackoff:
     def __init__(
@@ -44,3 +56,154 @@ async def retry_operation(operation: Callable, backoff: ExponentialBackoff):
             await asyncio.sleep(delay)
 
     raise last_exception
+
+
+class RetryableError(Exception):
+    """Falha transitória da dependência: pode ser tentada novamente"""
+
+
+class NonRetryableError(Exception):
+    """Falha que se repetiria em outra tentativa (dados inválidos, rejeição)"""
+
+
+# Status HTTP que indicam indisponibilidade temporária
+_RETRYABLE_STATUS = {408, 425, 429}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        # HTTPException do FastAPI/Starlette
+        status = getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Classificação padrão: timeouts, falhas de conexão, 5xx e 429 são transitórios;
+    erros de validação e demais 4xx não"""
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, NonRetryableError):
+        return False
+
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError,
+                          httpx.TimeoutException, httpx.TransportError,
+                          requests.Timeout, requests.ConnectionError)):
+        return True
+
+    status = _status_code(error)
+    if status is not None:
+        return status >= 500 or status in _RETRYABLE_STATUS
+
+    if isinstance(error, (ValueError, TypeError, KeyError)):
+        return False
+
+    # Erros do Postgres/PostgREST de dados (22xxx), restrição (23xxx) ou sintaxe (42xxx)
+    code = getattr(error, "code", None)
+    if isinstance(code, str) and code[:2] in ("22", "23", "42"):
+        return False
+
+    return True
+
+
+class RetryBudget:
+    """Limita os retries de uma dependência a uma fração das chamadas recentes.
+
+    Durante uma indisponibilidade, as novas tentativas ficam limitadas a
+    `ratio` do tráfego normal (mais `min_per_second`), em vez de multiplicar
+    a carga pelo número de tentativas de cada chamada.
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        window: float = RETRY_BUDGET_WINDOW,
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        # Buckets de 1 s: {segundo: [chamadas, retries]}
+        self._buckets: Dict[int, list] = {}
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._bucket()[0] += 1
+
+    def try_acquire_retry(self) -> bool:
+        """Reserva um retry se ainda houver orçamento na janela"""
+        with self._lock:
+            calls, retries = self._totals()
+            if retries >= self.ratio * calls + self.min_per_second * self.window:
+                return False
+            self._bucket()[1] += 1
+            return True
+
+    def _bucket(self) -> list:
+        now = int(time.monotonic())
+        bucket = self._buckets.get(now)
+        if bucket is None:
+            bucket = self._buckets[now] = [0, 0]
+            for second in [s for s in self._buckets if s <= now - self.window]:
+                del self._buckets[second]
+        return bucket
+
+    def _totals(self):
+        limit = time.monotonic() - self.window
+        calls = retries = 0
+        for second, (c, r) in self._buckets.items():
+            if second > limit:
+                calls += c
+                retries += r
+        return calls, retries
+
+
+_retry_budgets: Dict[str, RetryBudget] = {}
+_retry_budgets_lock = threading.Lock()
+
+
+def get_retry_budget(name: str) -> RetryBudget:
+    """Orçamento de retries da dependência `name` (mesmo nome do circuit breaker)"""
+    budget = _retry_budgets.get(name)
+    if budget is None:
+        with _retry_budgets_lock:
+            budget = _retry_budgets.setdefault(name, RetryBudget())
+    return budget
+
+
+class RetryPolicy:
+    """Como tentar novamente as chamadas de uma dependência.
+
+    Cada chamada recebe o próprio `ExponentialBackoff` (`new_backoff`), então
+    chamadas concorrentes não compartilham contadores de tentativa.
+    """
+
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        max_delay: float = 60.0,
+        max_attempts: int = 5,
+        jitter: bool = True,
+        is_retryable: Callable[[Exception], bool] = is_retryable,
+        use_budget: bool = True,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+        self.is_retryable = is_retryable
+        self.use_budget = use_budget
+
+    def new_backoff(self) -> ExponentialBackoff:
+        return ExponentialBackoff(
+            initial_delay=self.initial_delay,
+            max_delay=self.max_delay,
+            max_attemps=self.max_attempts,
+            jitter=self.jitter,
+        )
+
+    def budget(self, name: str) -> Optional[RetryBudget]:
+        return get_retry_budget(name) if self.use_budget else None
+
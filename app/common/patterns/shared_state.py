@@ -0,0 +1,96 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, List, Optional
+
+# Arquivo compartilhado pelos workers do host (ex.: /dev/shm/nfe-state);
+# vazio mantém o estado em memória de cada processo
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")
+SHARED_STATE_SLOTS = int(os.getenv("SHARED_STATE_SLOTS", "8192"))
+
+# Valores (float64) disponíveis em cada slot
+SLOT_VALUES = 34
+# Slots examinados a partir da posição de uma chave antes de substituir o mais antigo
+_PROBE = 8
+
+# chave (digest de 16 bytes) + último uso + valores
+_SLOT = struct.Struct(f"16sd{SLOT_VALUES}d")
+_EMPTY_KEY = bytes(16)
+
+
+class SharedState:
+    """Tabela hash de tamanho fixo em um arquivo mapeado em memória.
+
+    Todos os processos que abrem o mesmo arquivo enxergam os mesmos slots.
+    Cada chave ocupa um slot com `SLOT_VALUES` floats; a atualização trava
+    (fcntl) apenas a faixa de slots onde a chave pode estar, então processos
+    que mexem em chaves diferentes raramente disputam o mesmo lock. Quando a
+    faixa está cheia, o slot usado há mais tempo é reaproveitado, o que
+    mantém o arquivo com tamanho constante.
+    """
+
+    def __init__(self, path: str, slots: int = SHARED_STATE_SLOTS):
+        self.path = path
+        self.slots = slots
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Slots extras no fim evitam que a faixa de busca dê a volta no arquivo
+        size = _SLOT.size * (slots + _PROBE)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        # Locks fcntl são por processo; threads do mesmo processo usam este
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, key: str) -> Iterator[List[float]]:
+        """Valores da chave (zeros se nova); alterações na lista são gravadas na saída"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        home = int.from_bytes(digest[:8], "little") % self.slots
+        start, length = home * _SLOT.size, _PROBE * _SLOT.size
+
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start, os.SEEK_SET)
+            try:
+                index = self._find(home, digest)
+                stored, _, *values = _SLOT.unpack_from(self._mmap, index * _SLOT.size)
+                if stored != digest:
+                    values = [0.0] * SLOT_VALUES
+
+                yield values
+
+                _SLOT.pack_into(self._mmap, index * _SLOT.size, digest, time.monotonic(), *values)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start, os.SEEK_SET)
+
+    def _find(self, home: int, digest: bytes) -> int:
+        oldest, oldest_used = home, None
+        for index in range(home, home + _PROBE):
+            key, used = struct.unpack_from("16sd", self._mmap, index * _SLOT.size)
+            if key == digest or key == _EMPTY_KEY:
+                return index
+            if oldest_used is None or used < oldest_used:
+                oldest, oldest_used = index, used
+        return oldest
+
+    def close(self) -> None:
+        self._mmap.close()
+        os.close(self._fd)
+
+
+@lru_cache(maxsize=1)
+def get_shared_state() -> Optional[SharedState]:
+    """Estado compartilhado configurado por SHARED_STATE_PATH, ou None"""
+    if not SHARED_STATE_PATH:
+        return None
+    return SharedState(SHARED_STATE_PATH)
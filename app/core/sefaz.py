@@ -1,51 +1,322 @@
 import logging
+import os
+import re
+from typing import List, Optional, Tuple
 from lxml import etree
 
-from app.services.sefaz.sefaz_soap_client import SEFAZSoapClient
+from app.common.patterns.retry import RetryableError
+from app.services.sefaz.soap_client_registry import CertPair, SoapClientRegistry, default_soap_client_registry
 from app.services.xml_signer.xml_signer import XMLSigner
 
 logger = logging.getLogger(__name__)
 
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+# Ambiente informado nas consultas (1 = produção, 2 = homologação)
+SEFAZ_TP_AMB = os.getenv("SEFAZ_TP_AMB", "1")
+
+# cStat do lote: recebido para processamento assíncrono / processado / em processamento
+CSTAT_LOTE_RECEBIDO = '103'
+CSTAT_LOTE_PROCESSADO = '104'
+CSTAT_LOTE_EM_PROCESSAMENTO = '105'
+# Serviço paralisado momentaneamente / sem previsão: o lote não foi processado
+CSTAT_SERVICO_PARALISADO = {'108', '109'}
+# Rejeição por duplicidade: a chave já foi usada (em geral, já autorizada)
+CSTAT_DUPLICIDADE = '204'
+# Consulta protocolo: NF-e não consta na base de dados da SEFAZ
+CSTAT_NFE_INEXISTENTE = '217'
+
+_XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+_CHAVE_NFE = re.compile(r'<infNFe[^>]*\bId="NFe(\d{44})"')
+# Id provisório do XML gerado sem chave de acesso (build_nfe_xml)
+_CHAVE_PROVISORIA = '0' * 44
+
+
+def chave_do_xml(xml: str) -> Optional[str]:
+    """Chave de acesso do `infNFe`; None se ausente ou provisória"""
+    match = _CHAVE_NFE.search(xml)
+    if not match or match.group(1) == _CHAVE_PROVISORIA:
+        return None
+    return match.group(1)
+
+
+class ProtocoloAusenteError(RetryableError):
+    """Lote processado sem protocolo identificável para a NF-e; o resultado é desconhecido"""
+
+
+class SefazIndisponivelError(RetryableError):
+    """Autorizador respondeu que o serviço está paralisado (cStat 108/109)"""
+
+    def __init__(self, codigo: str, mensagem: Optional[str]):
+        super().__init__(f"SEFAZ indisponível ({codigo}): {mensagem}")
+        self.codigo = codigo
+        self.mensagem = mensagem
+
+
 class SefazAPI:
-    def __init__(self, signer: XMLSigner, wsdl_provider):
+    def __init__(self, signer: XMLSigner, wsdl_provider, client_registry: SoapClientRegistry = None,
+                 certificate_registry=None):
         self.signer = signer
         self.wsdl_provider = wsdl_provider
+        self.client_registry = client_registry or default_soap_client_registry
+        # Com um CertificateRegistry, cada emitente assina e conecta com o próprio A1
+        self.certificate_registry = certificate_registry
 
-    def _parse_response(self, response: str) -> dict:
-       # Ensure response is a string and strip whitespace that might cause parsing errors
-        if not isinstance(response, str):
-            response = str(response)
+    def _credenciais(self, cnpj: Optional[str]) -> Tuple[XMLSigner, Optional[CertPair]]:
+        if cnpj and self.certificate_registry is not None:
+            certificado = self.certificate_registry.get(cnpj)
+            return certificado.signer, certificado.cert_pair
+        return self.signer, None
 
-        response = response.strip()
+    async def _credenciais_async(self, cnpj: Optional[str]) -> Tuple[XMLSigner, Optional[CertPair]]:
+        if cnpj and self.certificate_registry is not None:
+            certificado = await self.certificate_registry.get_async(cnpj)
+            return certificado.signer, certificado.cert_pair
+        return self.signer, None
 
-        root = etree.fromstring(response.encode())
-        ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+    def _parse_prot(self, prot) -> dict:
+        """Converte um <protNFe> no resultado de uma NF-e"""
+        ns = {'nfe': NFE_NS}
 
-        cstat = root.find('.//nfe:cStat', ns)
-        xmotivo = root.find('.//nfe:xMotivo', ns)
+        cstat = prot.find('.//nfe:cStat', ns)
+        xmotivo = prot.find('.//nfe:xMotivo', ns)
+        chave = prot.find('.//nfe:chNFe', ns)
 
         if cstat is not None and cstat.text == '100':
             return {
                 'status': 'AUTORIZADA',
-                'protocolo': root.find('.//nfe:nProt', ns).text,
-                'chave_nfe': root.find('.//nfe:chNFe', ns).text,
-                'autorizado_em': root.find('.//nfe:dhRecbto', ns).text if root.find('.//nfe:dhRecbto', ns) is not None else None,
+                'protocolo': prot.find('.//nfe:nProt', ns).text,
+                'chave_nfe': chave.text if chave is not None else None,
+                'autorizado_em': prot.find('.//nfe:dhRecbto', ns).text if prot.find('.//nfe:dhRecbto', ns) is not None else None,
+                # Protocolo original, usado para montar o nfeProc
+                'prot_nfe': etree.tostring(prot, encoding='unicode', with_tail=False),
             }
 
         return {
             'status': 'REJEITADA',
-            'codigo': cstat.text if cstat else None,
-            'mensagem': xmotivo.text if xmotivo else None,
+            'codigo': cstat.text if cstat is not None else None,
+            'mensagem': xmotivo.text if xmotivo is not None else None,
+            'chave_nfe': chave.text if chave is not None else None,
         }
 
-    def send_nfe(self, xml: str, uf: str) -> dict:
+    def _parse_lote(self, response: str) -> dict:
+        """Interpreta um retEnviNFe/retConsReciNFe.
+
+        Retorna o cStat do lote, o recibo (quando o processamento é
+        assíncrono) e o resultado de cada <protNFe> na ordem da resposta.
+        Serviço paralisado levanta `SefazIndisponivelError`, que pode ser
+        tentado novamente, em vez de rejeitar as NF-e.
+        """
+        # Ensure response is a string and strip whitespace that might cause parsing errors
+        if not isinstance(response, str):
+            response = str(response)
+
+        root = etree.fromstring(response.strip().encode())
+        ns = {'nfe': NFE_NS}
+
+        protocolos = [self._parse_prot(prot) for prot in root.iter(f'{{{NFE_NS}}}protNFe')]
+
+        # cStat/xMotivo do lote são filhos diretos do retorno, fora do protNFe
+        cstat = root.find('nfe:cStat', ns)
+        xmotivo = root.find('nfe:xMotivo', ns)
+        recibo = root.find('.//nfe:nRec', ns)
+        tempo_medio = root.find('.//nfe:tMed', ns)
+
+        if cstat is not None and cstat.text in CSTAT_SERVICO_PARALISADO:
+            raise SefazIndisponivelError(cstat.text, xmotivo.text if xmotivo is not None else None)
+
+        return {
+            'codigo': cstat.text if cstat is not None else None,
+            'mensagem': xmotivo.text if xmotivo is not None else None,
+            'recibo': recibo.text if recibo is not None else None,
+            'tempo_medio': int(tempo_medio.text) if tempo_medio is not None and tempo_medio.text else None,
+            'protocolos': protocolos,
+        }
+
+    def _parse_response(self, response: str) -> dict:
+        lote = self._parse_lote(response)
+
+        if lote['protocolos']:
+            return lote['protocolos'][0]
+
+        return {
+            'status': 'REJEITADA',
+            'codigo': lote['codigo'],
+            'mensagem': lote['mensagem'],
+        }
+
+    def mapear_protocolos(self, chaves: List[Optional[str]], protocolos: List[dict]) -> List[Optional[dict]]:
+        """Associa os protocolos de um lote às NF-e enviadas pela chave de acesso.
+
+        A ordem dos protNFe no retorno não é garantida, então uma NF-e sem
+        chave, com chave repetida no lote ou sem protNFe correspondente
+        recebe None. Só um lote de uma NF-e com um único protocolo dispensa
+        a chave.
+        """
+        if len(chaves) == 1 and len(protocolos) == 1:
+            chave = protocolos[0].get('chave_nfe')
+            return [protocolos[0] if not chaves[0] or not chave or chave == chaves[0] else None]
+
+        por_chave = {prot.get('chave_nfe'): prot for prot in protocolos if prot.get('chave_nfe')}
+        repetidas = {chave for chave in chaves if chaves.count(chave) > 1}
+        return [
+            por_chave.get(chave) if chave and chave not in repetidas else None
+            for chave in chaves
+        ]
+
+    def _montar_envi_nfe(self, xmls_assinados: List[str], id_lote: str) -> str:
+        # Processamento síncrono só é aceito pela SEFAZ para lotes de uma NF-e
+        ind_sinc = '1' if len(xmls_assinados) == 1 else '0'
+        documentos = ''.join(_XML_DECLARATION.sub('', xml) for xml in xmls_assinados)
+        return (
+            f'<enviNFe xmlns="{NFE_NS}" versao="4.00">'
+            f'<idLote>{id_lote}</idLote><indSinc>{ind_sinc}</indSinc>'
+            f'{documentos}</enviNFe>'
+        )
+
+    def send_nfe(self, xml: str, uf: str, cnpj: Optional[str] = None) -> dict:
         wsdl = self.wsdl_provider.get(uf)
         if not wsdl:
             raise ValueError("UF não suportada")
 
-        xml_signed = self.signer.sign(xml)
+        signer, cert = self._credenciais(cnpj)
+        xml_signed = signer.sign(xml)
 
-        client = SEFAZSoapClient(wsdl)
+        client = self.client_registry.get(wsdl, cert)
         response = client.autorizar(xml_signed)
 
         return self._parse_response(response)
+
+    async def send_nfe_async(self, xml: str, uf: str, cnpj: Optional[str] = None) -> dict:
+        """Versão assíncrona de `send_nfe`: não bloqueia o event loop durante o envio"""
+        wsdl = self.wsdl_provider.get(uf)
+        if not wsdl:
+            raise ValueError("UF não suportada")
+
+        signer, cert = await self._credenciais_async(cnpj)
+        xml_signed = await signer.sign_async(xml)
+
+        client = await self.client_registry.get_async(wsdl, cert)
+        response = await client.autorizar(xml_signed)
+
+        return self._parse_response(response)
+
+    async def assinar_async(self, xml: str, cnpj: Optional[str] = None) -> str:
+        """Assina o XML com o certificado do emitente `cnpj`"""
+        signer, _ = await self._credenciais_async(cnpj)
+        return await signer.sign_async(xml)
+
+    async def send_lote_async(self, xmls: List[str], uf: str, id_lote: str,
+                              cnpj: Optional[str] = None, assinados: bool = False) -> List[Optional[dict]]:
+        """Envia várias NF-e em um único enviNFe e devolve um resultado por NF-e.
+
+        Todas as NF-e do lote são do emitente `cnpj`; com `assinados=True`
+        os XML já vêm assinados e são enviados como estão. Se a SEFAZ receber
+        o lote para processamento assíncrono, cada NF-e recebe
+        `status=PROCESSANDO` com o recibo a ser consultado. NF-e sem
+        protocolo correspondente no retorno recebem None.
+        """
+        wsdl = self.wsdl_provider.get(uf)
+        if not wsdl:
+            raise ValueError("UF não suportada")
+
+        signer, cert = await self._credenciais_async(cnpj)
+        xmls_assinados = list(xmls) if assinados else await signer.sign_many_async(xmls)
+        chaves = [chave_do_xml(xml) for xml in xmls_assinados]
+
+        client = await self.client_registry.get_async(wsdl, cert)
+        response = await client.autorizar(self._montar_envi_nfe(xmls_assinados, id_lote))
+        lote = self._parse_lote(response)
+
+        if lote['codigo'] == CSTAT_LOTE_RECEBIDO and lote['recibo']:
+            return [
+                {
+                    'status': 'PROCESSANDO',
+                    'recibo': lote['recibo'],
+                    'tempo_medio': lote['tempo_medio'],
+                    'uf': uf,
+                    'cnpj': cnpj,
+                    'chave_nfe': chave,
+                    'posicao': posicao,
+                }
+                for posicao, chave in enumerate(chaves)
+            ]
+
+        return self._resultados_lote(lote, chaves)
+
+    async def consultar_recibo_async(self, recibo: str, uf: str, chaves: List[Optional[str]],
+                                     cnpj: Optional[str] = None) -> Optional[List[Optional[dict]]]:
+        """Consulta o resultado de um lote assíncrono (NFeRetAutorizacao4).
+
+        Retorna `None` enquanto o lote ainda estiver em processamento.
+        """
+        wsdl = self.wsdl_provider.get_ret_autorizacao(uf)
+        if not wsdl:
+            raise ValueError("UF não suportada")
+
+        cons_reci = (
+            f'<consReciNFe xmlns="{NFE_NS}" versao="4.00">'
+            f'<tpAmb>{SEFAZ_TP_AMB}</tpAmb><nRec>{recibo}</nRec></consReciNFe>'
+        )
+
+        _, cert = await self._credenciais_async(cnpj)
+        client = await self.client_registry.get_async(wsdl, cert)
+        response = await client.consultar_recibo(cons_reci)
+        lote = self._parse_lote(response)
+
+        if lote['codigo'] == CSTAT_LOTE_EM_PROCESSAMENTO:
+            return None
+
+        return self._resultados_lote(lote, chaves)
+
+    async def consultar_protocolo_async(self, chave: str, uf: str,
+                                        cnpj: Optional[str] = None) -> Optional[dict]:
+        """Consulta a situação de uma NF-e pela chave de acesso (NFeConsultaProtocolo4).
+
+        Retorna o resultado do <protNFe> da NF-e, ou `None` se a SEFAZ não a
+        conhece (cStat 217), ou seja, ela ainda não foi recebida.
+        """
+        wsdl = self.wsdl_provider.get_consulta_protocolo(uf)
+        if not wsdl:
+            raise ValueError("UF não suportada")
+
+        cons_sit = (
+            f'<consSitNFe xmlns="{NFE_NS}" versao="4.00">'
+            f'<tpAmb>{SEFAZ_TP_AMB}</tpAmb><xServ>CONSULTAR</xServ>'
+            f'<chNFe>{chave}</chNFe></consSitNFe>'
+        )
+
+        _, cert = await self._credenciais_async(cnpj)
+        client = await self.client_registry.get_async(wsdl, cert)
+        response = await client.consultar_protocolo(cons_sit)
+
+        root = etree.fromstring(str(response).strip().encode())
+        ns = {'nfe': NFE_NS}
+        cstat = root.find('nfe:cStat', ns)
+        xmotivo = root.find('nfe:xMotivo', ns)
+        codigo = cstat.text if cstat is not None else None
+        mensagem = xmotivo.text if xmotivo is not None else None
+
+        if codigo in CSTAT_SERVICO_PARALISADO:
+            raise SefazIndisponivelError(codigo, mensagem)
+
+        prot = root.find('.//nfe:protNFe', ns)
+        if prot is not None:
+            return self._parse_prot(prot)
+        if codigo == CSTAT_NFE_INEXISTENTE:
+            return None
+
+        raise Exception(f"Falha ao consultar protocolo da NF-e {chave}: {codigo} {mensagem}")
+
+    def _resultados_lote(self, lote: dict, chaves: List[Optional[str]]) -> List[Optional[dict]]:
+        """Resultado de cada NF-e; None quando o lote não trouxe o protocolo dela"""
+        rejeicao_lote = {
+            'status': 'REJEITADA',
+            'codigo': lote['codigo'],
+            'mensagem': lote['mensagem'],
+        }
+
+        if not lote['protocolos']:
+            # Lote inteiro rejeitado (ex.: erro de schema): todas as NF-e recebem o motivo
+            return [dict(rejeicao_lote) for _ in chaves]
+
+        return self.mapear_protocolos(chaves, lote['protocolos'])
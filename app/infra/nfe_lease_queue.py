@@ -0,0 +1,69 @@
+import os
+import socket
+import time
+from typing import List, Optional
+from uuid import uuid4
+
+from app.infra.work_queue import NFE_QUEUE_MAX_TENTATIVAS, Job
+
+# Lease mantido por um registro que ficou aguardando recibo de lote; deve
+# cobrir o tempo máximo de consulta do ReciboPollingScheduler
+NFE_LEASE_RECIBO = float(os.getenv("NFE_LEASE_RECIBO", "3600"))
+
+
+def lease_owner_padrao() -> str:
+    """Identificador do worker gravado em `nfe.lease_owner`"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+class SupabaseLeaseQueue:
+    """Fila sobre a própria tabela `nfe`, com a interface do `SQLiteWorkQueue`.
+
+    `claim` reivindica registros CRIADA com um lease em um único statement
+    (FOR UPDATE SKIP LOCKED), então vários workers, em vários hosts,
+    consomem a mesma tabela sem pegar o mesmo registro. `extend` renova de
+    uma vez todos os leases do worker; `ack`/`nack` liberam o registro. Os
+    leases vencidos de workers que caíram são recuperados pelo `LeaseSweeper`.
+    """
+
+    def __init__(
+        self,
+        nfe_service,
+        owner: Optional[str] = None,
+        max_tentativas: int = NFE_QUEUE_MAX_TENTATIVAS,
+        lease_recibo: float = NFE_LEASE_RECIBO,
+    ):
+        self.nfe_service = nfe_service
+        self.owner = owner or lease_owner_padrao()
+        self.max_tentativas = max_tentativas
+        self.lease_recibo = lease_recibo
+        self._ultima_renovacao = 0.0
+
+    async def claim(self, limit: int, visibility_timeout: float) -> List[Job]:
+        rows = await self.nfe_service.claim_batch(
+            self.owner, limit, visibility_timeout, self.max_tentativas)
+        return [
+            Job(id=row["id"], record_id=row["id"], tentativas=row.get("tentativas", 1))
+            for row in rows
+        ]
+
+    async def ack(self, job_id: str) -> None:
+        await self.nfe_service.release_lease(job_id, self.owner, 0.0, self.lease_recibo)
+
+    async def nack(self, job_id: str, erro: Optional[str] = None, delay: float = 0.0) -> None:
+        # O registro volta para CRIADA e é reivindicado de novo como retomada
+        # (tentativas > 1), que consulta o protocolo antes de reenviar
+        await self.nfe_service.release_lease(
+            job_id, self.owner, delay, self.lease_recibo, devolver=True)
+
+    async def extend(self, job_id: str, visibility_timeout: float) -> None:
+        # Cada job em execução pede renovação a cada visibility_timeout/3; uma
+        # chamada por intervalo renova os leases de todos eles
+        agora = time.monotonic()
+        if agora - self._ultima_renovacao < visibility_timeout / 6:
+            return
+        self._ultima_renovacao = agora
+        await self.nfe_service.renew_leases(self.owner, visibility_timeout)
+
+    def close(self) -> None:
+        pass
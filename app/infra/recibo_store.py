@@ -0,0 +1,165 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional
+
+NFE_RECIBOS_PATH = os.getenv("NFE_RECIBOS_PATH", "data/nfe_recibos.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recibos (
+    recibo TEXT PRIMARY KEY,
+    uf TEXT NOT NULL,
+    cnpj TEXT,
+    tempo_medio REAL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_consulta REAL NOT NULL,
+    criado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recibos_proxima_consulta ON recibos(proxima_consulta);
+CREATE TABLE IF NOT EXISTS recibo_itens (
+    recibo TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    posicao INTEGER NOT NULL,
+    chave_nfe TEXT,
+    xml_assinado TEXT,
+    PRIMARY KEY (recibo, record_id)
+);
+"""
+
+
+@dataclass
+class ReciboItem:
+    record_id: str
+    posicao: int
+    chave_nfe: Optional[str]
+    # Guardado para montar o nfeProc sem reler o registro quando o protocolo chegar
+    xml_assinado: Optional[str] = None
+
+
+@dataclass
+class ReciboPendente:
+    recibo: str
+    uf: str
+    tempo_medio: Optional[float]
+    tentativas: int
+    cnpj: Optional[str] = None
+    itens: List[ReciboItem] = field(default_factory=list)
+
+
+class SQLiteReciboStore:
+    """Recibos (nRec) de lotes assíncronos aguardando consulta na SEFAZ.
+
+    Cada recibo guarda as NF-e do lote com a posição e a chave de acesso,
+    usadas para associar os protocolos da consulta a cada registro.
+    """
+
+    def __init__(self, path: str = NFE_RECIBOS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # Bancos criados antes do certificado por emitente não têm a coluna cnpj
+        colunas = {row[1] for row in self._conn.execute("PRAGMA table_info(recibos)")}
+        if "cnpj" not in colunas:
+            self._conn.execute("ALTER TABLE recibos ADD COLUMN cnpj TEXT")
+        colunas = {row[1] for row in self._conn.execute("PRAGMA table_info(recibo_itens)")}
+        if "xml_assinado" not in colunas:
+            self._conn.execute("ALTER TABLE recibo_itens ADD COLUMN xml_assinado TEXT")
+
+    async def adicionar(self, recibo: str, uf: str, item: ReciboItem,
+                        tempo_medio: Optional[float], proxima_consulta: float,
+                        cnpj: Optional[str] = None) -> None:
+        await asyncio.to_thread(self._adicionar, recibo, uf, item, tempo_medio, proxima_consulta, cnpj)
+
+    async def vencidos(self, limite: int) -> List[ReciboPendente]:
+        return await asyncio.to_thread(self._vencidos, limite)
+
+    async def reagendar(self, recibo: str, proxima_consulta: float) -> None:
+        await asyncio.to_thread(self._reagendar, recibo, proxima_consulta)
+
+    async def remover(self, recibo: str) -> None:
+        await asyncio.to_thread(self._remover, recibo)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _adicionar(self, recibo, uf, item, tempo_medio, proxima_consulta, cnpj) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Cada NF-e do lote registra o mesmo recibo; só a primeira cria a linha
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO recibos (recibo, uf, cnpj, tempo_medio, proxima_consulta, criado_em) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (recibo, uf, cnpj, tempo_medio, proxima_consulta, time.time()),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO recibo_itens (recibo, record_id, posicao, chave_nfe, xml_assinado) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (recibo, item.record_id, item.posicao, item.chave_nfe, item.xml_assinado),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _vencidos(self, limite: int) -> List[ReciboPendente]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT recibo, uf, tempo_medio, tentativas, cnpj FROM recibos "
+                "WHERE proxima_consulta <= ? ORDER BY proxima_consulta LIMIT ?",
+                (time.time(), limite),
+            ).fetchall()
+
+            pendentes = []
+            for recibo, uf, tempo_medio, tentativas, cnpj in rows:
+                itens = self._conn.execute(
+                    "SELECT record_id, posicao, chave_nfe, xml_assinado FROM recibo_itens "
+                    "WHERE recibo = ? ORDER BY posicao",
+                    (recibo,),
+                ).fetchall()
+                pendentes.append(ReciboPendente(
+                    recibo=recibo,
+                    uf=uf,
+                    tempo_medio=tempo_medio,
+                    tentativas=tentativas,
+                    cnpj=cnpj,
+                    itens=[ReciboItem(*item) for item in itens],
+                ))
+            return pendentes
+
+    def _reagendar(self, recibo: str, proxima_consulta: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE recibos SET tentativas = tentativas + 1, proxima_consulta = ? WHERE recibo = ?",
+                (proxima_consulta, recibo),
+            )
+
+    def _remover(self, recibo: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM recibo_itens WHERE recibo = ?", (recibo,))
+                self._conn.execute("DELETE FROM recibos WHERE recibo = ?", (recibo,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+@lru_cache(maxsize=1)
+def get_recibo_store() -> SQLiteReciboStore:
+    return SQLiteReciboStore()
@@ -0,0 +1,108 @@
+import asyncio
+from typing import List, Union
+from urllib.parse import urlsplit
+
+RespValue = Union[None, int, bytes, List["RespValue"]]
+
+
+class RespError(Exception):
+    """Erro devolvido pelo servidor (resposta `-ERR ...`)"""
+
+
+class _Conexao:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def executar(self, args) -> RespValue:
+        self.writer.write(_codificar(args))
+        await self.writer.drain()
+        return await self._ler()
+
+    async def _ler(self) -> RespValue:
+        linha = await self.reader.readline()
+        if not linha:
+            raise ConnectionError("Conexão encerrada pelo servidor")
+
+        tipo, conteudo = linha[:1], linha[1:-2]
+        if tipo == b"+":
+            return conteudo
+        if tipo == b"-":
+            raise RespError(conteudo.decode())
+        if tipo == b":":
+            return int(conteudo)
+        if tipo == b"$":
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            dados = await self.reader.readexactly(tamanho + 2)
+            return dados[:-2]
+        if tipo == b"*":
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            return [await self._ler() for _ in range(tamanho)]
+        raise ConnectionError(f"Resposta RESP inválida: {linha!r}")
+
+    def fechar(self) -> None:
+        self.writer.close()
+
+
+def _codificar(args) -> bytes:
+    partes = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            dado = arg
+        else:
+            dado = str(arg).encode()
+        partes.append(b"$%d\r\n%s\r\n" % (len(dado), dado))
+    return b"".join(partes)
+
+
+class RespClient:
+    """Client mínimo do protocolo do Redis (RESP2) sobre asyncio.
+
+    Mantém até `pool_size` conexões abertas; cada comando usa uma conexão
+    exclusiva até receber a resposta. Atende Redis, Valkey, KeyDB e
+    servidores compatíveis. URL no formato `redis://[:senha@]host:porta/db`.
+    """
+
+    def __init__(self, url: str, pool_size: int = 10, timeout: float = 1.0):
+        partes = urlsplit(url)
+        self.host = partes.hostname or "localhost"
+        self.port = partes.port or 6379
+        self.password = partes.password
+        self.db = int(partes.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._livres: List[_Conexao] = []
+        self._vagas = asyncio.Semaphore(pool_size)
+
+    async def execute(self, *args) -> RespValue:
+        async with self._vagas:
+            conexao = self._livres.pop() if self._livres else await self._conectar()
+            try:
+                resposta = await asyncio.wait_for(conexao.executar(args), self.timeout)
+            except RespError:
+                self._livres.append(conexao)
+                raise
+            except BaseException:
+                # Estado da conexão desconhecido (timeout/cancelamento): descarta
+                conexao.fechar()
+                raise
+            self._livres.append(conexao)
+            return resposta
+
+    async def _conectar(self) -> _Conexao:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        conexao = _Conexao(reader, writer)
+        if self.password:
+            await conexao.executar(("AUTH", self.password))
+        if self.db:
+            await conexao.executar(("SELECT", self.db))
+        return conexao
+
+    async def aclose(self) -> None:
+        livres, self._livres = self._livres, []
+        for conexao in livres:
+            conexao.fechar()
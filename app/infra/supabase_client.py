@@ -1,4 +1,9 @@
-from supabase import ClientOptions, create_client
+import threading
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, ClientOptions, create_client
 import os
 from dotenv import load_dotenv
 
@@ -10,10 +15,62 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables are required. Please set them in a .env file.")
 
+# Pool do client assíncrono, compartilhado por todas as consultas do processo
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "100"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+
 options = ClientOptions(
     function_client_timeout=30.0,
 )
 
+_async_client: Optional[AsyncClient] = None
+_async_client_lock = threading.Lock()
+
 
+@lru_cache(maxsize=1)
 def get_supabase_client() -> create_client:
     return create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+
+
+def get_async_supabase_client() -> AsyncClient:
+    """Client assíncrono único do processo.
+
+    As consultas rodam no event loop sobre um pool httpx com keep-alive,
+    sem passar pelo thread pool. O client é criado no primeiro uso e
+    fechado por `close_async_supabase_client` (lifespan da API e
+    encerramento do worker).
+    """
+    global _async_client
+    with _async_client_lock:
+        if _async_client is None:
+            _async_client = _criar_async_client()
+    return _async_client
+
+
+def _criar_async_client() -> AsyncClient:
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+        timeout=SUPABASE_TIMEOUT,
+        follow_redirects=True,
+        http2=True,
+    )
+    # O construtor já envia a chave como apikey/Authorization; sem
+    # `acreate_client` o client pode ser obtido fora de código assíncrono
+    return AsyncClient(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        AsyncClientOptions(httpx_client=http_client, function_client_timeout=30),
+    )
+
+
+async def close_async_supabase_client() -> None:
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.options.httpx_client.aclose()
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from app.enums.nfe_status import StatusNFe
+
+WEBHOOK_OUTBOX_PATH = os.getenv("WEBHOOK_OUTBOX_PATH", "data/webhook_outbox.db")
+# Entregas tentadas antes do evento ir para a dead-letter
+WEBHOOK_OUTBOX_MAX_TENTATIVAS = int(os.getenv("WEBHOOK_OUTBOX_MAX_TENTATIVAS", "8"))
+
+# Um status final nunca é substituído por um status intermediário atrasado
+STATUS_FINAIS = (StatusNFe.AUTORIZADA.value, StatusNFe.REJEITADA.value, StatusNFe.ERRO.value)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    lote INTEGER NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'PENDENTE',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    disponivel_em REAL NOT NULL,
+    lease_expira_em REAL,
+    ultimo_erro TEXT,
+    criado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS eventos_disponiveis ON eventos(estado, disponivel_em);
+CREATE INDEX IF NOT EXISTS eventos_registro ON eventos(record_id, url);
+"""
+
+
+@dataclass
+class WebhookEvento:
+    id: int
+    record_id: str
+    url: str
+    status: str
+    payload: dict
+    lote: bool
+    tentativas: int
+    ultimo_erro: Optional[str] = None
+
+
+class SQLiteWebhookOutbox:
+    """Eventos de webhook aguardando entrega, gravados em um arquivo SQLite (WAL).
+
+    Cada mudança de status vira um evento (registro, URL); um evento novo
+    substitui os pendentes do mesmo registro para a mesma URL, então o
+    cliente recebe só o estado mais recente. Eventos retirados com `claim`
+    ficam em ENVIANDO até `lease_expira_em`; após `max_tentativas` falhas
+    (ou uma falha definitiva) vão para MORTO, a dead-letter, de onde podem
+    ser reenviados com `reprocessar`.
+    """
+
+    def __init__(self, path: str = WEBHOOK_OUTBOX_PATH, max_tentativas: int = WEBHOOK_OUTBOX_MAX_TENTATIVAS):
+        self.path = path
+        self.max_tentativas = max_tentativas
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # ==========================
+    # API assíncrona
+    # ==========================
+    async def adicionar(self, record_id: str, url: str, status: str, payload: dict, lote: bool = False) -> bool:
+        """Registra o evento; False quando um evento pendente mais relevante já existe"""
+        return await asyncio.to_thread(self._adicionar, record_id, url, status, payload, lote)
+
+    async def claim(self, por_endpoint: int, tamanho_lote: int, visibility_timeout: float,
+                    ignorar_urls: Iterable[str] = ()) -> List[WebhookEvento]:
+        return await asyncio.to_thread(
+            self._claim, por_endpoint, tamanho_lote, visibility_timeout, list(ignorar_urls))
+
+    async def ack(self, ids: List[int]) -> None:
+        await asyncio.to_thread(self._ack, ids)
+
+    async def nack(self, ids: List[int], erro: Optional[str], delay: float = 0.0,
+                   definitivo: bool = False) -> None:
+        await asyncio.to_thread(self._nack, ids, erro, delay, definitivo)
+
+    async def adiar(self, ids: List[int], delay: float) -> None:
+        """Devolve os eventos sem contar tentativa (ex.: circuit breaker aberto)"""
+        await asyncio.to_thread(self._adiar, ids, delay)
+
+    async def mortos(self, limite: int = 100) -> List[WebhookEvento]:
+        return await asyncio.to_thread(self._mortos, limite)
+
+    async def reprocessar(self, ids: Optional[List[int]] = None) -> int:
+        """Devolve eventos da dead-letter para a fila (todos, se `ids` for None)"""
+        return await asyncio.to_thread(self._reprocessar, ids)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ==========================
+    # Implementação síncrona
+    # ==========================
+    def _adicionar(self, record_id, url, status, payload, lote) -> bool:
+        agora = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                anteriores = self._conn.execute(
+                    "SELECT id, status FROM eventos "
+                    "WHERE record_id = ? AND url = ? AND estado IN ('PENDENTE', 'MORTO')",
+                    (record_id, url),
+                ).fetchall()
+
+                if status not in STATUS_FINAIS and any(s in STATUS_FINAIS for _, s in anteriores):
+                    # Ex.: PROCESSANDO chegando com AUTORIZADA ainda por entregar
+                    self._conn.execute("COMMIT")
+                    return False
+
+                self._conn.executemany(
+                    "DELETE FROM eventos WHERE id = ?", [(id_,) for id_, _ in anteriores])
+                self._conn.execute(
+                    "INSERT INTO eventos (record_id, url, status, payload, lote, disponivel_em, criado_em) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (record_id, url, status, json.dumps(payload, ensure_ascii=False), int(lote), agora, agora),
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _claim(self, por_endpoint, tamanho_lote, visibility_timeout, ignorar_urls) -> List[WebhookEvento]:
+        agora = time.time()
+        filtro_urls = ""
+        if ignorar_urls:
+            filtro_urls = f"AND url NOT IN ({','.join('?' * len(ignorar_urls))}) "
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Lease vencido na última tentativa: o evento vai para a dead-letter
+                self._conn.execute(
+                    "UPDATE eventos SET estado = 'MORTO', ultimo_erro = COALESCE(ultimo_erro, 'lease expirado') "
+                    "WHERE estado = 'ENVIANDO' AND lease_expira_em <= ? AND tentativas >= ?",
+                    (agora, self.max_tentativas),
+                )
+                # Até `por_endpoint` requisições por URL (cada uma com até `tamanho_lote`
+                # eventos se o receptor aceita lotes). Um registro com entrega em
+                # andamento espera, para o cliente não receber os status fora de ordem.
+                rows = self._conn.execute(
+                    "SELECT id, record_id, url, status, payload, lote, tentativas, ultimo_erro FROM ("
+                    "  SELECT e.*, ROW_NUMBER() OVER (PARTITION BY url ORDER BY id) AS ordem FROM eventos e "
+                    "  WHERE ((estado = 'PENDENTE' AND disponivel_em <= ?) "
+                    "         OR (estado = 'ENVIANDO' AND lease_expira_em <= ?)) "
+                    f"   {filtro_urls}"
+                    "    AND NOT EXISTS (SELECT 1 FROM eventos o WHERE o.record_id = e.record_id "
+                    "        AND o.url = e.url AND o.id <> e.id "
+                    "        AND o.estado = 'ENVIANDO' AND o.lease_expira_em > ?)"
+                    ") WHERE ordem <= CASE WHEN lote THEN ? * ? ELSE ? END "
+                    "ORDER BY id",
+                    (agora, agora, *ignorar_urls, agora, por_endpoint, tamanho_lote, por_endpoint),
+                ).fetchall()
+
+                self._conn.executemany(
+                    "UPDATE eventos SET estado = 'ENVIANDO', tentativas = tentativas + 1, "
+                    "lease_expira_em = ? WHERE id = ?",
+                    [(agora + visibility_timeout, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return [
+            WebhookEvento(id=row[0], record_id=row[1], url=row[2], status=row[3],
+                          payload=json.loads(row[4]), lote=bool(row[5]),
+                          tentativas=row[6] + 1, ultimo_erro=row[7])
+            for row in rows
+        ]
+
+    def _ack(self, ids: List[int]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM eventos WHERE id = ?", [(id_,) for id_ in ids])
+
+    def _nack(self, ids: List[int], erro: Optional[str], delay: float, definitivo: bool) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE eventos SET "
+                "estado = CASE WHEN ? OR tentativas >= ? THEN 'MORTO' ELSE 'PENDENTE' END, "
+                "disponivel_em = ?, lease_expira_em = NULL, ultimo_erro = ? "
+                "WHERE id = ? AND estado = 'ENVIANDO'",
+                [(int(definitivo), self.max_tentativas, time.time() + delay, erro, id_) for id_ in ids],
+            )
+
+    def _adiar(self, ids: List[int], delay: float) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE eventos SET estado = 'PENDENTE', tentativas = tentativas - 1, "
+                "disponivel_em = ?, lease_expira_em = NULL WHERE id = ? AND estado = 'ENVIANDO'",
+                [(time.time() + delay, id_) for id_ in ids],
+            )
+
+    def _mortos(self, limite: int) -> List[WebhookEvento]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, record_id, url, status, payload, lote, tentativas, ultimo_erro FROM eventos "
+                "WHERE estado = 'MORTO' ORDER BY id LIMIT ?",
+                (limite,),
+            ).fetchall()
+
+        return [
+            WebhookEvento(id=row[0], record_id=row[1], url=row[2], status=row[3],
+                          payload=json.loads(row[4]), lote=bool(row[5]),
+                          tentativas=row[6], ultimo_erro=row[7])
+            for row in rows
+        ]
+
+    def _reprocessar(self, ids: Optional[List[int]]) -> int:
+        sql = ("UPDATE eventos SET estado = 'PENDENTE', tentativas = 0, disponivel_em = ?, "
+               "lease_expira_em = NULL WHERE estado = 'MORTO'")
+        with self._lock:
+            if ids is None:
+                return self._conn.execute(sql, (time.time(),)).rowcount
+            return sum(
+                self._conn.execute(sql + " AND id = ?", (time.time(), id_)).rowcount for id_ in ids)
+
+
+@lru_cache(maxsize=1)
+def get_webhook_outbox() -> SQLiteWebhookOutbox:
+    return SQLiteWebhookOutbox()
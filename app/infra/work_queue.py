@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+NFE_QUEUE_PATH = os.getenv("NFE_QUEUE_PATH", "data/nfe_queue.db")
+NFE_QUEUE_MAX_TENTATIVAS = int(os.getenv("NFE_QUEUE_MAX_TENTATIVAS", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDENTE',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    disponivel_em REAL NOT NULL,
+    lease_expira_em REAL,
+    ultimo_erro TEXT,
+    criado_em REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_record_ativo
+    ON jobs(record_id) WHERE status IN ('PENDENTE', 'EM_EXECUCAO');
+CREATE INDEX IF NOT EXISTS jobs_disponiveis
+    ON jobs(status, disponivel_em);
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    record_id: str
+    tentativas: int
+
+
+class SQLiteWorkQueue:
+    """Fila persistente de NF-e a processar, gravada em um arquivo SQLite (WAL).
+
+    Um job retirado com `claim` fica invisível até `lease_expira_em`; se o
+    worker não confirmar (`ack`) nem devolver (`nack`) antes disso, o job é
+    entregue novamente. Após `max_tentativas` entregas o job é marcado como
+    FALHOU e deixa de ser entregue.
+    """
+
+    def __init__(self, path: str = NFE_QUEUE_PATH, max_tentativas: int = NFE_QUEUE_MAX_TENTATIVAS):
+        self.path = path
+        self.max_tentativas = max_tentativas
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # ==========================
+    # API assíncrona
+    # ==========================
+    async def enqueue(self, record_id: str, delay: float = 0.0) -> None:
+        await asyncio.to_thread(self._enqueue_many, [record_id], delay)
+
+    async def enqueue_many(self, record_ids: Iterable[str], delay: float = 0.0) -> None:
+        await asyncio.to_thread(self._enqueue_many, list(record_ids), delay)
+
+    async def claim(self, limit: int, visibility_timeout: float) -> List[Job]:
+        return await asyncio.to_thread(self._claim, limit, visibility_timeout)
+
+    async def ack(self, job_id: int) -> None:
+        await asyncio.to_thread(self._ack, job_id)
+
+    async def nack(self, job_id: int, erro: Optional[str] = None, delay: float = 0.0) -> None:
+        await asyncio.to_thread(self._nack, job_id, erro, delay)
+
+    async def extend(self, job_id: int, visibility_timeout: float) -> None:
+        await asyncio.to_thread(self._extend, job_id, visibility_timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ==========================
+    # Implementação síncrona
+    # ==========================
+    def _enqueue_many(self, record_ids: List[str], delay: float) -> None:
+        agora = time.time()
+        rows = [(record_id, agora + delay, agora) for record_id in record_ids]
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Registros que já têm job ativo são ignorados pelo índice parcial
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (record_id, disponivel_em, criado_em) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _claim(self, limit: int, visibility_timeout: float) -> List[Job]:
+        agora = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs em execução com lease vencido são redistribuídos
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'FALHOU', ultimo_erro = COALESCE(ultimo_erro, 'lease expirado') "
+                    "WHERE status = 'EM_EXECUCAO' AND lease_expira_em <= ? AND tentativas >= ?",
+                    (agora, self.max_tentativas),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, record_id, tentativas FROM jobs "
+                    "WHERE (status = 'PENDENTE' AND disponivel_em <= ?) "
+                    "   OR (status = 'EM_EXECUCAO' AND lease_expira_em <= ?) "
+                    "ORDER BY id LIMIT ?",
+                    (agora, agora, limit),
+                ).fetchall()
+
+                self._conn.executemany(
+                    "UPDATE jobs SET status = 'EM_EXECUCAO', tentativas = tentativas + 1, "
+                    "lease_expira_em = ? WHERE id = ?",
+                    [(agora + visibility_timeout, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return [Job(id=row[0], record_id=row[1], tentativas=row[2] + 1) for row in rows]
+
+    def _ack(self, job_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _nack(self, job_id: int, erro: Optional[str], delay: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET "
+                "status = CASE WHEN tentativas >= ? THEN 'FALHOU' ELSE 'PENDENTE' END, "
+                "disponivel_em = ?, lease_expira_em = NULL, ultimo_erro = ? "
+                "WHERE id = ?",
+                (self.max_tentativas, time.time() + delay, erro, job_id),
+            )
+
+    def _extend(self, job_id: int, visibility_timeout: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_expira_em = ? WHERE id = ? AND status = 'EM_EXECUCAO'",
+                (time.time() + visibility_timeout, job_id),
+            )
+
+
+@lru_cache(maxsize=1)
+def get_work_queue() -> SQLiteWorkQueue:
+    return SQLiteWorkQueue()
@@ -0,0 +1,167 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Protocol
+
+from app.infra.supabase_client import get_async_supabase_client
+
+# "local" (sistema de arquivos) ou "supabase" (Supabase Storage)
+XML_STORAGE_BACKEND = os.getenv("XML_STORAGE_BACKEND", "local")
+XML_STORAGE_DIR = os.getenv("XML_STORAGE_DIR", "data/xml")
+XML_STORAGE_BUCKET = os.getenv("XML_STORAGE_BUCKET", "nfe-xml")
+XML_STORAGE_GZIP_LEVEL = int(os.getenv("XML_STORAGE_GZIP_LEVEL", "6"))
+# Validade das URLs assinadas de download do Supabase Storage
+XML_STORAGE_SIGNED_URL_TTL = int(os.getenv("XML_STORAGE_SIGNED_URL_TTL", "300"))
+
+_CHAVE = re.compile(r"([0-9a-f]{2}/[0-9a-f]{64}\.xml\.gz)$")
+
+
+def chave_do_conteudo(dados: bytes) -> str:
+    """Chave do documento: sha256 do XML (não comprimido), em subdiretórios de 2 caracteres"""
+    digest = hashlib.sha256(dados).hexdigest()
+    return f"{digest[:2]}/{digest}.xml.gz"
+
+
+def chave_da_url(url: str) -> str:
+    """Recupera a chave a partir do `xml_url` gravado, de qualquer backend"""
+    match = _CHAVE.search(url or "")
+    if not match:
+        raise ValueError(f"xml_url inválido: {url}")
+    return match.group(1)
+
+
+class BlobStore(Protocol):
+    async def put(self, chave: str, dados: bytes) -> None: ...
+
+    async def get(self, chave: str) -> bytes: ...
+
+    async def url(self, chave: str) -> str: ...
+
+    def caminho_local(self, chave: str) -> Optional[str]: ...
+
+    async def url_download(self, chave: str) -> Optional[str]: ...
+
+
+class LocalBlobStore:
+    """Blobs em arquivos sob `raiz`; a escrita é atômica (arquivo temporário + rename)"""
+
+    def __init__(self, raiz: str = XML_STORAGE_DIR):
+        self.raiz = Path(raiz).resolve()
+
+    async def put(self, chave: str, dados: bytes) -> None:
+        await asyncio.to_thread(self._put, chave, dados)
+
+    def _put(self, chave: str, dados: bytes) -> None:
+        destino = self.raiz / chave
+        if destino.exists():
+            return  # Mesmo conteúdo, mesma chave
+
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=destino.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(dados)
+            os.replace(tmp, destino)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def get(self, chave: str) -> bytes:
+        return await asyncio.to_thread((self.raiz / chave).read_bytes)
+
+    async def url(self, chave: str) -> str:
+        return (self.raiz / chave).as_uri()
+
+    def caminho_local(self, chave: str) -> Optional[str]:
+        caminho = self.raiz / chave
+        return str(caminho) if caminho.is_file() else None
+
+    async def url_download(self, chave: str) -> Optional[str]:
+        return None
+
+
+class SupabaseBlobStore:
+    """Blobs em um bucket do Supabase Storage; downloads por URL assinada"""
+
+    def __init__(self, client=None, bucket: str = XML_STORAGE_BUCKET,
+                 url_ttl: int = XML_STORAGE_SIGNED_URL_TTL):
+        self.client = client or get_async_supabase_client()
+        self.bucket = bucket
+        self.url_ttl = url_ttl
+
+    def _bucket(self):
+        return self.client.storage.from_(self.bucket)
+
+    async def put(self, chave: str, dados: bytes) -> None:
+        try:
+            await self._bucket().upload(chave, dados, {
+                "content-type": "application/gzip",
+                "cache-control": "31536000",
+                "upsert": "false",
+            })
+        except Exception as exc:
+            # Conteúdo endereçado por hash: objeto existente já tem estes bytes
+            if str(getattr(exc, "status", "")) == "409" or getattr(exc, "code", None) == "Duplicate":
+                return
+            raise Exception(f"Falha ao gravar XML no Supabase Storage: {exc}")
+
+    async def get(self, chave: str) -> bytes:
+        try:
+            return await self._bucket().download(chave)
+        except Exception as exc:
+            if str(getattr(exc, "status", "")) in ("400", "404"):
+                raise FileNotFoundError(chave)
+            raise Exception(f"Falha ao ler XML do Supabase Storage: {exc}")
+
+    async def url(self, chave: str) -> str:
+        return await self._bucket().get_public_url(chave)
+
+    def caminho_local(self, chave: str) -> Optional[str]:
+        return None
+
+    async def url_download(self, chave: str) -> Optional[str]:
+        resposta = await self._bucket().create_signed_url(chave, self.url_ttl)
+        return resposta["signedURL"]
+
+
+class XMLStorage:
+    """XML de NF-e comprimidos (gzip) e endereçados pelo conteúdo.
+
+    `salvar` devolve a URL gravada em `nfe.xml_url`. Reprocessar uma NF-e
+    gera a mesma chave, então o documento não é duplicado nem reescrito.
+    """
+
+    def __init__(self, store: BlobStore, nivel: int = XML_STORAGE_GZIP_LEVEL):
+        self.store = store
+        self.nivel = nivel
+
+    async def salvar(self, xml: str) -> str:
+        dados = xml.encode("utf-8")
+        chave = chave_do_conteudo(dados)
+        # mtime=0: o mesmo XML sempre gera os mesmos bytes comprimidos
+        await self.store.put(chave, gzip.compress(dados, self.nivel, mtime=0))
+        return await self.store.url(chave)
+
+    async def ler(self, url: str) -> bytes:
+        """Documento comprimido (gzip) apontado por `url`"""
+        return await self.store.get(chave_da_url(url))
+
+    def caminho_local(self, url: str) -> Optional[str]:
+        """Arquivo comprimido em disco, quando o backend é local"""
+        return self.store.caminho_local(chave_da_url(url))
+
+    async def url_download(self, url: str) -> Optional[str]:
+        """URL temporária para o cliente baixar direto do backend, se houver"""
+        return await self.store.url_download(chave_da_url(url))
+
+
+@lru_cache(maxsize=1)
+def get_xml_storage() -> XMLStorage:
+    if XML_STORAGE_BACKEND == "supabase":
+        return XMLStorage(SupabaseBlobStore())
+    return XMLStorage(LocalBlobStore())
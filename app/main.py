@@ -1,18 +1,123 @@
-from fastapi import Depends, FastAPI, Body, HTTPException, Response, Request, BackgroundTasks
+from fastapi import Depends, FastAPI, Body, Header, HTTPException, Query, Response, Request
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
 from uuid import uuid4
+import asyncio
+import gzip
+import json
+import logging
+import os
+
+from pydantic import ValidationError
 
 from app.enums.nfe_status import StatusNFe
-from app.models.nfe import NFe
-from app.services.nfe.nfe import NFeService, NFeServiceProtocol
-from app.utils.validar_nfe import validar_nfe
-from app.utils.build_nfe_xml import build_nfe_xml
-from app.common.patterns.rate_limit import check_rate_limit
-from app.common.patterns.circuit_breaker import with_retry_and_circuit_breaker
-from app.workers.processar_nfe_worker import processar_nfe_worker
+from app.models.nfe import NFe, NFeCabecalho
+from app.models.nfe_item import NFeItem
+from app.services.nfe.nfe import (
+    INSERT_CHUNK_SIZE,
+    LIST_MAX_PAGE_SIZE,
+    LIST_PAGE_SIZE,
+    NFE_COLUNAS,
+    NFE_COLUNAS_LISTAGEM,
+    NFeFiltros,
+    NFeServiceProtocol,
+)
+from app.services.nfe.cached_nfe_service import get_nfe_service
+from app.services.idempotencia import (
+    IDEMPOTENCY_HEADER,
+    IdempotenciaConflitoError,
+    IdempotenciaService,
+    chave_idempotencia,
+    hash_payload,
+)
+from app.utils.validar_nfe import erros_cabecalho_nfe, validar_nfe
+from app.utils.build_nfe_xml import build_nfe_xml, stream_nfe_xml
+from app.utils.ler_ndjson import ler_ndjson
+from app.common.patterns.rate_limit import rate_limiter
+from app.common.patterns.circuit_breaker import circuit_breakers, with_retry_and_circuit_breaker
+from app.infra.supabase_client import close_async_supabase_client
+from app.infra.webhook_outbox import SQLiteWebhookOutbox, get_webhook_outbox
+from app.infra.work_queue import SQLiteWorkQueue, get_work_queue
+from app.infra.xml_storage import XMLStorage, get_xml_storage
+from app.services.sefaz.soap_client_registry import default_soap_client_registry
+from app.services.webhook_notifier import default_webhook_client
+from app.services.wsdl_urls.wsdl_urls import WSDLProvider
+
+logger = logging.getLogger(__name__)
+
+# UFs cujos clients SOAP são carregados na inicialização (ex.: "SP,RJ")
+SEFAZ_WARMUP_UFS = [uf.strip() for uf in os.getenv("SEFAZ_WARMUP_UFS", "").split(",") if uf.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SEFAZ_WARMUP_UFS:
+        wsdl_provider = WSDLProvider()
+        wsdls = [wsdl_provider.get(uf) for uf in SEFAZ_WARMUP_UFS]
+        result = await asyncio.to_thread(
+            default_soap_client_registry.warm, [wsdl for wsdl in wsdls if wsdl])
+        logger.info("Clients SOAP pré-carregados: %s", result)
+
+    yield
+
+    await default_soap_client_registry.aclose()
+    await rate_limiter.aclose()
+    await default_webhook_client.aclose()
+    await close_async_supabase_client()
+    # O service e o storage em cache guardam o client que acabou de ser fechado
+    get_nfe_service.cache_clear()
+    get_xml_storage.cache_clear()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Quantidade máxima de NF-e aceitas em uma única chamada de /emitir-nfe/lote
+MAX_NFE_POR_LOTE = int(os.getenv("MAX_NFE_POR_LOTE", "5000"))
+
+
+def _novo_registro_nfe(nfe: NFe, agora: datetime, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Monta o registro inicial (status CRIADA) da tabela `nfe`."""
+    payload_hash = hash_payload(nfe)
+    return {
+        "id": str(uuid4()),
+        "ref": f"{agora.strftime('%y%m%d%H%M%S')}{uuid4().hex[:6]}",
+        "status": "CRIADA",
+        "chave_nfe": None,
+        "numero": None,
+        "serie": None,
+        "xml_url": None,
+        "danfe_url": None,
+        "payload_envio": jsonable_encoder(nfe),
+        "payload_retorno": None,
+        "ambiente": "producao",
+        "data_emissao": (
+            nfe.data_emissao.isoformat()
+            if getattr(nfe, "data_emissao", None)
+            else None
+        ),
+        "autorizado_em": None,
+        "criado_em": agora.isoformat(),
+        "atualizado_em": agora.isoformat(),
+        "idempotency_key": chave_idempotencia(idempotency_key, payload_hash),
+        "payload_hash": payload_hash,
+        # Só registros de emissão são reivindicados pelos workers (nfe_reivindicar)
+        "emissao_solicitada": True,
+    }
 
-app = FastAPI()
+
+async def _registrar_idempotente(nfe_service, record: Dict[str, Any], response: Response):
+    """Grava o registro uma única vez por chave; reenvios recebem o original"""
+    try:
+        registro, criado = await IdempotenciaService(nfe_service).registrar(record)
+    except IdempotenciaConflitoError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if not criado:
+        response.headers["Idempotent-Replayed"] = "true"
+    return registro, criado
 
 
 @app.post(
@@ -23,7 +128,8 @@ app = FastAPI()
         400: {"description": "Erro de validação"},
         429: {"description": "Rate limit excedido"},
         500: {"description": "Erro interno"}
-    }
+    },
+    dependencies=[Depends(rate_limiter)],
 )
 @with_retry_and_circuit_breaker(
     max_attempts=3,
@@ -32,23 +138,19 @@ app = FastAPI()
     jitter=True
 )
 async def json_para_xml(
-    request: Request,
+    response: Response,
     nfe: NFe = Body(...),
-    nfe_service: NFeServiceProtocol = Depends(NFeService)
+    pretty: bool = Query(False, description="Indenta o XML gerado"),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service)
 ):
-    # ==========================
-    # RATE LIMIT
-    # ==========================
-    rate_limit_response = await check_rate_limit(request)
-    if rate_limit_response:
-        return rate_limit_response
-
     try:
         validar_nfe(nfe)
 
         xml_str = build_nfe_xml(nfe)
 
         agora = datetime.now(timezone.utc)
+        payload_hash = hash_payload(nfe)
 
         payload = {
             "id": str(uuid4()),
@@ -82,18 +184,29 @@ async def json_para_xml(
             "autorizado_em": None,
             "criado_em": agora.isoformat(),
             "atualizado_em": agora.isoformat(),
+
+            # Reexecuções do handler (retry) e reenvios do cliente não duplicam o registro
+            "idempotency_key": chave_idempotencia(idempotency_key, payload_hash),
+            "payload_hash": payload_hash,
+
+            # XML compacto: o worker envia este documento sem gerá-lo de novo
+            "xml": xml_str,
         }
 
-        inserted = await nfe_service.insert(payload)
+        inserted, criado = await _registrar_idempotente(nfe_service, payload, response)
 
         if not inserted:
             raise Exception("Falha ao persistir NF-e no Supabase")
 
         return Response(
-            content=xml_str,
-            media_type="application/xml"
+            content=build_nfe_xml(nfe, pretty=True) if pretty else xml_str,
+            media_type="application/xml",
+            headers=None if criado else {"Idempotent-Replayed": "true"},
         )
 
+    except HTTPException:
+        raise
+
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -104,12 +217,51 @@ async def json_para_xml(
         )
 
 
+@app.post(
+    "/nfe/json-para-xml/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/xml": {}}},
+        400: {"description": "Erro de validação do cabeçalho"},
+    }
+)
+async def json_para_xml_stream(request: Request):
+    """Converte NF-e muito grandes para XML sem carregá-las inteiras em memória.
+
+    O corpo é NDJSON: a primeira linha traz os campos da NF-e sem `items` e
+    cada linha seguinte traz um item. O XML começa a ser enviado assim que o
+    cabeçalho é validado. Este modo apenas converte; a NF-e não é gravada.
+    """
+    linhas = ler_ndjson(request.stream())
+
+    try:
+        cabecalho = NFeCabecalho.model_validate(await anext(linhas))
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Corpo vazio")
+    except (ValidationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao processar cabeçalho: {str(e)}")
+
+    erros = erros_cabecalho_nfe(cabecalho)
+    if erros:
+        raise HTTPException(status_code=400, detail=" | ".join(erros))
+
+    async def itens():
+        async for linha in linhas:
+            yield NFeItem.model_validate(linha)
+
+    return StreamingResponse(
+        stream_nfe_xml(cabecalho, itens()),
+        media_type="application/xml"
+    )
+
+
 @app.post("/emitir-nfe", status_code=202)
 async def emitir_nfe(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    nfe_service: NFeServiceProtocol = Depends(NFeService),
-    nfe: NFe = Body(...)
+    response: Response,
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service),
+    work_queue: SQLiteWorkQueue = Depends(get_work_queue),
+    nfe: NFe = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
 ):
     try:
         validar_nfe(nfe)
@@ -121,67 +273,280 @@ async def emitir_nfe(
             status_code=400, detail=f"Erro ao processar payload: {str(e)}")
 
     agora = datetime.now(timezone.utc)
-    nfe_id = str(uuid4())
-    record = {
-        "id": nfe_id,
-        "ref": f"{agora.strftime('%y%m%d%H%M%S')}{uuid4().hex[:6]}",
-        "status": "CRIADA",
-        "chave_nfe": None,
-        "numero": None,
-        "serie": None,
-        "xml_url": None,
-        "danfe_url": None,
-        "payload_envio": jsonable_encoder(nfe),
-        "payload_retorno": None,
-        "ambiente": "producao",
-        "data_emissao": (
-            nfe.data_emissao.isoformat()
-            if getattr(nfe, "data_emissao", None)
-            else None
-        ),
-        "autorizado_em": None,
-        "criado_em": agora.isoformat(),
-        "atualizado_em": agora.isoformat(),
-    }
+    record = _novo_registro_nfe(nfe, agora, idempotency_key)
 
     try:
-        await nfe_service.insert(record)
+        registro, criado = await _registrar_idempotente(nfe_service, record, response)
+        # O mesmo payload pode ter sido gravado antes só para conversão
+        # (/nfe/json-para-xml); a emissão passa a valer para esse registro
+        if not criado and not registro.get("emissao_solicitada") \
+                and registro["status"] == StatusNFe.CRIADA.value:
+            registro = await nfe_service.update_if_status(
+                registro["id"], {"emissao_solicitada": True}, [StatusNFe.CRIADA.value]) or registro
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Erro ao salvar NF-e: {str(e)}")
 
-    background_tasks.add_task(processar_nfe_worker, record["id"], nfe_service)
+    # Um reenvio só volta para a fila se o original ainda não foi processado;
+    # a fila ignora o job se ele já estiver pendente
+    if criado or registro["status"] == StatusNFe.CRIADA.value:
+        try:
+            await work_queue.enqueue(registro["id"])
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Erro ao enfileirar NF-e: {str(e)}")
 
     return {
         "success": True,
-        "message": "NF-e recebida e em processamento",
+        "message": "NF-e recebida e em processamento" if criado else "NF-e já recebida anteriormente",
+        "data": {
+            "id": registro["id"],
+            "ref": registro["ref"],
+            "status": registro["status"],
+            "criado_em": registro["criado_em"]
+        }
+    }
+
+async def _solicitar_emissao_dos_reenvios(nfe_service, bloco: List[Dict[str, Any]],
+                                          gravados: List[Dict[str, Any]]) -> List[str]:
+    """Ids do bloco a enfileirar: os inseridos e os reenvios ainda não processados.
+
+    Como em /emitir-nfe, um registro gravado antes só para conversão
+    (/nfe/json-para-xml) passa a ter a emissão solicitada.
+    """
+    ids = []
+    for record, gravado in zip(bloco, gravados):
+        if gravado["id"] != record["id"]:
+            if gravado["status"] != StatusNFe.CRIADA.value:
+                continue
+            if not gravado.get("emissao_solicitada"):
+                await nfe_service.update_if_status(
+                    gravado["id"], {"emissao_solicitada": True}, [StatusNFe.CRIADA.value])
+        ids.append(gravado["id"])
+    return ids
+
+
+@app.post("/emitir-nfe/lote", status_code=202)
+async def emitir_nfe_lote(
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service),
+    work_queue: SQLiteWorkQueue = Depends(get_work_queue),
+    nfes: List[Dict[str, Any]] = Body(...)
+):
+    """Recebe várias NF-e de uma vez.
+
+    Cada item é validado individualmente: os inválidos são reportados com o
+    seu índice e não impedem a gravação dos demais. Os válidos são gravados
+    em blocos de INSERT_CHUNK_SIZE, um insert por bloco, e cada bloco é
+    enfileirado assim que gravado; um bloco que falha não desfaz os
+    anteriores, e os seus itens voltam com o erro.
+
+    Sem Idempotency-Key por item, a chave de idempotência é o hash do
+    payload: uma NF-e repetida no lote ou já gravada antes volta com o
+    `id`/`ref` do registro original e `reenvio: true`.
+    """
+    if not nfes:
+        raise HTTPException(status_code=400, detail="Lote vazio")
+
+    if len(nfes) > MAX_NFE_POR_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Lote excede o máximo de {MAX_NFE_POR_LOTE} NF-e")
+
+    agora = datetime.now(timezone.utc)
+    itens: List[Dict[str, Any]] = []
+    records: List[Dict[str, Any]] = []
+    # Posições em `itens` de cada chave de idempotência do lote
+    posicoes: Dict[str, List[int]] = {}
+
+    for indice, raw in enumerate(nfes):
+        try:
+            nfe = NFe.model_validate(raw)
+            validar_nfe(nfe)
+        except ValidationError as e:
+            itens.append({
+                "indice": indice,
+                "success": False,
+                "erro": f"Erro ao processar payload: {e.errors(include_url=False, include_input=False)}"
+            })
+            continue
+        except ValueError as e:
+            itens.append({
+                "indice": indice,
+                "success": False,
+                "erro": f"Erro na validação: {str(e)}"
+            })
+            continue
+        except Exception as e:
+            itens.append({
+                "indice": indice,
+                "success": False,
+                "erro": f"Erro ao processar payload: {str(e)}"
+            })
+            continue
+
+        record = _novo_registro_nfe(nfe, agora)
+        chave = record["idempotency_key"]
+        if chave not in posicoes:
+            posicoes[chave] = []
+            records.append(record)
+        posicoes[chave].append(len(itens))
+        itens.append({"indice": indice, "success": True})
+
+    aceitas = reenvios = 0
+    erro_insert = None
+
+    for inicio in range(0, len(records), INSERT_CHUNK_SIZE):
+        bloco = records[inicio:inicio + INSERT_CHUNK_SIZE]
+        try:
+            gravados = await nfe_service.insert_many(bloco)
+            enfileirar = await _solicitar_emissao_dos_reenvios(nfe_service, bloco, gravados)
+        except Exception as e:
+            # Os blocos anteriores já estão gravados e enfileirados
+            erro_insert = e
+            for record in bloco:
+                for posicao in posicoes[record["idempotency_key"]]:
+                    itens[posicao] = {
+                        "indice": itens[posicao]["indice"],
+                        "success": False,
+                        "erro": f"Erro ao salvar NF-e: {str(e)}"
+                    }
+            continue
+
+        try:
+            await work_queue.enqueue_many(enfileirar)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Erro ao enfileirar lote de NF-e: {str(e)}")
+
+        for record, gravado in zip(bloco, gravados):
+            for ordem, posicao in enumerate(posicoes[record["idempotency_key"]]):
+                reenvio = ordem > 0 or gravado["id"] != record["id"]
+                itens[posicao].update({
+                    "id": gravado["id"],
+                    "ref": gravado["ref"],
+                    "status": gravado["status"],
+                    "reenvio": reenvio,
+                })
+                aceitas += 1
+                reenvios += reenvio
+
+    if erro_insert is not None and not aceitas:
+        raise HTTPException(
+            status_code=500, detail=f"Erro ao salvar lote de NF-e: {str(erro_insert)}")
+
+    return {
+        "success": bool(aceitas),
+        "message": f"{aceitas} de {len(nfes)} NF-e recebidas e em processamento",
         "data": {
-            "id": nfe_id,
-            "ref": record["ref"],
-            "status": StatusNFe.CRIADA,
-            "criado_em": agora.isoformat()
+            "aceitas": aceitas,
+            "reenvios": reenvios,
+            "rejeitadas": len(nfes) - aceitas,
+            "criado_em": agora.isoformat(),
+            "itens": itens
         }
     }
 
+def _colunas_listagem(fields: Optional[str] = Query(
+        None, description="Colunas separadas por vírgula; padrão: todas exceto payload_envio/payload_retorno")) -> List[str]:
+    if not fields:
+        return list(NFE_COLUNAS_LISTAGEM)
+    colunas = [c.strip() for c in fields.split(",") if c.strip()]
+    invalidas = [c for c in colunas if c not in NFE_COLUNAS]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidas)}")
+    return colunas
+
+
+def _filtros_listagem(
+    status: Optional[StatusNFe] = None,
+    ambiente: Optional[str] = None,
+    chave_nfe: Optional[str] = None,
+    criado_de: Optional[datetime] = None,
+    criado_ate: Optional[datetime] = None,
+) -> NFeFiltros:
+    return NFeFiltros(
+        status=status.value if status else None,
+        ambiente=ambiente,
+        chave_nfe=chave_nfe,
+        criado_de=criado_de,
+        criado_ate=criado_ate,
+    )
+
+
 @app.get("/get_all_nfes")
 async def get_all_nfes(
-    nfe_service: NFeServiceProtocol = Depends(NFeService)
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    colunas: List[str] = Depends(_colunas_listagem),
+    filtros: NFeFiltros = Depends(_filtros_listagem),
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service)
 ):
+    """Página de NF-e (mais recentes primeiro); `next_cursor` busca a seguinte"""
     try:
-        nfe_records = nfe_service.get_all()
+        nfe_records, next_cursor = await nfe_service.list_page(limit, cursor, colunas, filtros)
         return {
             "success": True,
-            "data": nfe_records
+            "data": nfe_records,
+            "next_cursor": next_cursor
         }
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Erro ao buscar NF-es: {str(e)}")
 
+
+@app.get(
+    "/nfes/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def stream_nfes(
+    page_size: int = Query(LIST_MAX_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    colunas: List[str] = Depends(_colunas_listagem),
+    filtros: NFeFiltros = Depends(_filtros_listagem),
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service)
+):
+    """Exporta a listagem inteira em NDJSON (uma NF-e por linha).
+
+    As páginas são buscadas à medida que o cliente consome a resposta, então
+    a memória usada não depende do tamanho da tabela.
+    """
+    paginas = nfe_service.iter_pages(page_size, cursor, colunas, filtros)
+
+    # A primeira página é buscada antes de responder para que erros virem 4xx/5xx
+    try:
+        primeira = await anext(paginas, [])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Erro ao buscar NF-es: {str(e)}")
+
+    async def linhas():
+        pagina = primeira
+        while pagina:
+            yield "".join(
+                json.dumps(row, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+                for row in pagina
+            )
+            try:
+                pagina = await anext(paginas, [])
+            except Exception:
+                # O status já foi enviado; a resposta termina incompleta
+                logger.exception("Falha ao buscar página da listagem de NF-e")
+                return
+
+    return StreamingResponse(linhas(), media_type="application/x-ndjson")
+
 @app.get("/get_nfe/{nfe_id}")
 async def get_nfe(
     nfe_id: str,
-    nfe_service: NFeServiceProtocol = Depends(NFeService)
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service)
 ):
     try:
         nfe_record = await nfe_service.get_by_id(nfe_id)
@@ -195,4 +560,110 @@ async def get_nfe(
 
     except Exception as e:
         raise HTTPException(
-            status_code=500, detail=f"Erro ao buscar NF-e: {str(e)}")
\ No newline at end of file
+            status_code=500, detail=f"Erro ao buscar NF-e: {str(e)}")
+
+
+@app.get(
+    "/nfe/{nfe_id}/xml",
+    response_class=Response,
+    responses={
+        200: {"content": {"application/xml": {}}},
+        307: {"description": "Download direto do storage (URL temporária)"},
+        404: {"description": "NF-e ou XML não encontrado"},
+    },
+)
+async def download_nfe_xml(
+    nfe_id: str,
+    request: Request,
+    nfe_service: NFeServiceProtocol = Depends(get_nfe_service),
+    xml_storage: XMLStorage = Depends(get_xml_storage),
+):
+    """XML da NF-e: o nfeProc quando autorizada, senão o XML assinado enviado à SEFAZ.
+
+    No storage local o arquivo comprimido é enviado como está (sendfile,
+    com suporte a Range) para clientes que aceitam gzip; no Supabase Storage
+    o cliente é redirecionado para uma URL assinada.
+    """
+    try:
+        nfe_record = await nfe_service.get_by_id(nfe_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Erro ao buscar NF-e: {str(e)}")
+
+    if not nfe_record or not nfe_record.get("xml_url"):
+        raise HTTPException(status_code=404, detail="XML da NF-e não encontrado")
+
+    xml_url = nfe_record["xml_url"]
+    sufixo = "procNFe" if nfe_record.get("status") == StatusNFe.AUTORIZADA.value else "nfe"
+    nome = f"{nfe_record.get('chave_nfe') or nfe_id}-{sufixo}.xml"
+
+    try:
+        caminho = xml_storage.caminho_local(xml_url)
+        if caminho and "gzip" in request.headers.get("accept-encoding", ""):
+            return FileResponse(
+                caminho,
+                media_type="application/xml",
+                filename=nome,
+                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+            )
+
+        destino = await xml_storage.url_download(xml_url)
+        if destino:
+            return RedirectResponse(destino, status_code=307)
+
+        dados = await xml_storage.ler(xml_url)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="XML da NF-e não encontrado")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Erro ao ler XML da NF-e: {str(e)}")
+
+    return Response(
+        content=gzip.decompress(dados),
+        media_type="application/xml",
+        headers={"Content-Disposition": f'attachment; filename="{nome}"', "Vary": "Accept-Encoding"},
+    )
+
+
+@app.get("/circuit-breakers")
+async def get_circuit_breakers():
+    """Estado dos circuit breakers deste processo"""
+    return {
+        "success": True,
+        "data": circuit_breakers.status()
+    }
+
+
+@app.get("/nfe-cache")
+async def get_nfe_cache():
+    """Hits, misses e ocupação do cache de NF-e deste processo"""
+    return {
+        "success": True,
+        "data": get_nfe_service().stats()
+    }
+
+
+@app.get("/webhooks/dead-letter")
+async def get_webhooks_dead_letter(
+    limite: int = Query(100, ge=1, le=1000),
+    outbox: SQLiteWebhookOutbox = Depends(get_webhook_outbox),
+):
+    """Eventos de webhook que esgotaram as tentativas ou foram recusados"""
+    eventos = await outbox.mortos(limite)
+    return {
+        "success": True,
+        "data": jsonable_encoder(eventos)
+    }
+
+
+@app.post("/webhooks/dead-letter/reprocessar")
+async def reprocessar_webhooks_dead_letter(
+    ids: Optional[List[int]] = Body(None, embed=True),
+    outbox: SQLiteWebhookOutbox = Depends(get_webhook_outbox),
+):
+    """Devolve eventos da dead-letter para entrega (todos, se `ids` não for informado)"""
+    reprocessados = await outbox.reprocessar(ids)
+    return {
+        "success": True,
+        "reprocessados": reprocessados
+    }
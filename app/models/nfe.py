@@ -4,9 +4,14 @@ from datetime import date
 
 from app.models.nfe_item import NFeItem
 
-class NFe(BaseModel):
+class NFeCabecalho(BaseModel):
+    """Campos da NF-e exceto os itens (usado no modo streaming)"""
     natureza_operacao: str
 
+    serie: int = 1
+    # nNF; sem ele o XML sai com o Id provisório, sem chave de acesso
+    numero_nota: Optional[int] = None
+
     data_emissao: date
     data_entrada_saida: date
 
@@ -50,4 +55,6 @@ class NFe(BaseModel):
 
     modalidade_frete: int
 
+
+class NFe(NFeCabecalho):
     items: List[NFeItem]
@@ -0,0 +1,3 @@
+from .certificate_registry import Certificado, CertificateRegistry, get_certificate_registry
+
+__all__ = ["Certificado", "CertificateRegistry", "get_certificate_registry"]
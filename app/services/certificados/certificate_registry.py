@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import serialization
+
+from app.common.patterns.lru_cache import LRUCache
+from app.services.sefaz.soap_client_registry import CertPair, SoapClientRegistry, default_soap_client_registry
+from app.services.xml_signer.xml_signer_real import XMLSignerReal
+
+logger = logging.getLogger(__name__)
+
+# Diretório com um certificado A1 por emitente: {CERTIFICADOS_DIR}/{cnpj}.pfx
+CERTIFICADOS_DIR = os.getenv("CERTIFICADOS_DIR", "")
+# Quantidade de certificados decifrados mantidos em memória
+CERTIFICADOS_CACHE_SIZE = int(os.getenv("CERTIFICADOS_CACHE_SIZE", "100"))
+
+def senha_do_ambiente(cnpj: str) -> str:
+    """Senha do PFX em CERTIFICADO_SENHA_<CNPJ>, com CERTIFICADO_SENHA como padrão"""
+    senha = os.getenv(f"CERTIFICADO_SENHA_{cnpj}", os.getenv("CERTIFICADO_SENHA"))
+    if senha is None:
+        raise ValueError(f"Senha do certificado não configurada para o CNPJ {cnpj}")
+    return senha
+
+
+@dataclass
+class Certificado:
+    """Certificado A1 de um emitente pronto para assinar e abrir conexões mTLS"""
+    cnpj: str
+    signer: XMLSignerReal
+    # Arquivos PEM (certificado, chave) usados pelos transportes HTTP
+    cert_pair: CertPair
+    versao: Tuple[int, int]
+
+
+class CertificateRegistry:
+    """Carrega os certificados dos emitentes sob demanda, indexados por CNPJ.
+
+    Os certificados decifrados ficam em um LRU limitado. Para cada certificado
+    é gerado um par de arquivos PEM (em diretório temporário acessível só pelo
+    processo), que identifica as sessions mTLS no `SoapClientRegistry`: todas
+    as NF-e de um mesmo emitente reaproveitam as conexões já negociadas com
+    cada autorizador. Quando um certificado sai do LRU as sessions associadas
+    são descartadas; os PEM só são apagados quando o PFX muda ou no `close`,
+    já que clients em criação podem estar lendo os arquivos.
+    """
+
+    def __init__(
+        self,
+        diretorio: str = CERTIFICADOS_DIR,
+        maxsize: int = CERTIFICADOS_CACHE_SIZE,
+        senha_provider: Callable[[str], str] = senha_do_ambiente,
+        client_registry: Optional[SoapClientRegistry] = None,
+    ):
+        self.diretorio = diretorio
+        self.senha_provider = senha_provider
+        self.client_registry = client_registry
+        self._pem_dir = tempfile.mkdtemp(prefix="nfe-certs-")
+        self._cache: LRUCache[Certificado] = LRUCache(maxsize, on_evict=self._descartar)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cnpj: str) -> Certificado:
+        cnpj = self._normalizar(cnpj)
+        pfx_path = self._pfx_path(cnpj)
+        versao = self._versao(pfx_path)
+
+        certificado = self._cache.get(cnpj)
+        if certificado is not None and certificado.versao == versao:
+            return certificado
+
+        # Um lock por CNPJ: a decifragem do PFX é cara e não deve se repetir
+        with self._lock:
+            cnpj_lock = self._locks.setdefault(cnpj, threading.Lock())
+
+        with cnpj_lock:
+            certificado = self._cache.get(cnpj)
+            if certificado is not None and certificado.versao == versao:
+                return certificado
+
+            certificado = self._carregar(cnpj, pfx_path, versao)
+            self._cache.set(cnpj, certificado)
+            return certificado
+
+    async def get_async(self, cnpj: str) -> Certificado:
+        """Versão para o event loop: a decifragem roda em outra thread"""
+        certificado = self._cache.get(self._normalizar(cnpj))
+        if certificado is not None:
+            try:
+                if certificado.versao == self._versao(self._pfx_path(certificado.cnpj)):
+                    return certificado
+            except ValueError:
+                pass
+        return await asyncio.to_thread(self.get, cnpj)
+
+    def invalidate(self, cnpj: Optional[str] = None) -> None:
+        if cnpj is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(self._normalizar(cnpj))
+
+    def close(self) -> None:
+        self._cache.clear()
+        shutil.rmtree(self._pem_dir, ignore_errors=True)
+
+    def _carregar(self, cnpj: str, pfx_path: str, versao: Tuple[int, int]) -> Certificado:
+        logger.info("Carregando certificado do CNPJ %s", cnpj)
+
+        signer = XMLSignerReal(pfx_path, self.senha_provider(cnpj))
+        try:
+            key, cert = signer.load_key_and_certificate()
+        except Exception as e:
+            raise Exception(f"Falha ao carregar certificado do CNPJ {cnpj}: {e}")
+
+        nome = f"{cnpj}-{versao[0]}"
+        self._remover_pem_antigos(cnpj, nome)
+        base = os.path.join(self._pem_dir, nome)
+        cert_path, key_path = f"{base}.crt.pem", f"{base}.key.pem"
+        self._escrever_privado(cert_path, cert.public_bytes(serialization.Encoding.PEM))
+        self._escrever_privado(key_path, key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+
+        return Certificado(cnpj=cnpj, signer=signer, cert_pair=(cert_path, key_path), versao=versao)
+
+    def _descartar(self, cnpj: str, certificado: Certificado) -> None:
+        if self.client_registry is not None:
+            self.client_registry.invalidate_cert(certificado.cert_pair)
+
+    def _remover_pem_antigos(self, cnpj: str, atual: str) -> None:
+        for nome in os.listdir(self._pem_dir):
+            if nome.startswith(f"{cnpj}-") and not nome.startswith(f"{atual}."):
+                try:
+                    os.remove(os.path.join(self._pem_dir, nome))
+                except FileNotFoundError:
+                    pass
+
+    def _pfx_path(self, cnpj: str) -> str:
+        if not self.diretorio:
+            raise ValueError("CERTIFICADOS_DIR não configurado")
+        return os.path.join(self.diretorio, f"{cnpj}.pfx")
+
+    def _versao(self, pfx_path: str) -> Tuple[int, int]:
+        try:
+            stat = os.stat(pfx_path)
+        except FileNotFoundError:
+            raise ValueError(f"Certificado não encontrado: {os.path.basename(pfx_path)}")
+        return stat.st_mtime_ns, stat.st_size
+
+    def _normalizar(self, cnpj: str) -> str:
+        cnpj = re.sub(r"\D", "", cnpj or "")
+        if not cnpj:
+            raise ValueError("CNPJ do emitente não informado")
+        return cnpj
+
+    @staticmethod
+    def _escrever_privado(path: str, conteudo: bytes) -> None:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(conteudo)
+
+
+@lru_cache(maxsize=1)
+def get_certificate_registry() -> CertificateRegistry:
+    return CertificateRegistry(client_registry=default_soap_client_registry)
@@ -0,0 +1,15 @@
+from .idempotencia import (
+    IDEMPOTENCY_HEADER,
+    IdempotenciaConflitoError,
+    IdempotenciaService,
+    chave_idempotencia,
+    hash_payload,
+)
+
+__all__ = [
+    "IDEMPOTENCY_HEADER",
+    "IdempotenciaConflitoError",
+    "IdempotenciaService",
+    "chave_idempotencia",
+    "hash_payload",
+]
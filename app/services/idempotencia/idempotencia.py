@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from app.common.patterns.lru_cache import LRUCache
+from app.models.nfe import NFe
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCIA_CACHE_SIZE = int(os.getenv("IDEMPOTENCIA_CACHE_SIZE", "10000"))
+# Tempo que uma chave fica no cache local; a constraint do banco vale para sempre
+IDEMPOTENCIA_CACHE_TTL = float(os.getenv("IDEMPOTENCIA_CACHE_TTL", "86400"))
+# Campos imutáveis guardados no cache; o status é sempre lido do banco
+_CAMPOS = ("id", "ref", "payload_hash")
+
+
+class IdempotenciaConflitoError(ValueError):
+    """Mesma Idempotency-Key enviada com um payload diferente"""
+
+
+def hash_payload(nfe: NFe) -> str:
+    """SHA-256 do payload em JSON canônico (chaves ordenadas, sem espaços)"""
+    canonico = json.dumps(
+        jsonable_encoder(nfe), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def chave_idempotencia(idempotency_key: Optional[str], payload_hash: str) -> str:
+    """Chave gravada em `nfe.idempotency_key`.
+
+    Com o header, a chave do cliente define a requisição; sem ele, payloads
+    idênticos (mesma data de emissão, partes e itens) são tratados como o
+    mesmo envio.
+    """
+    if idempotency_key:
+        return f"key:{idempotency_key}"
+    return f"sha256:{payload_hash}"
+
+
+class IdempotenciaService:
+    """Grava um registro de NF-e no máximo uma vez por chave de idempotência.
+
+    Consulta primeiro um LRU+TTL local; no banco, o insert ignora conflitos
+    na constraint única e, se a chave já existia, devolve o registro original.
+    O cache guarda só a identidade do registro: num reenvio, o registro é
+    lido de novo para que o status devolvido seja o atual.
+    """
+
+    def __init__(self, nfe_service, cache: Optional[LRUCache] = None):
+        self.nfe_service = nfe_service
+        self.cache = cache if cache is not None else _cache
+
+    async def registrar(self, record: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Retorna (registro, criado); `criado=False` indica um reenvio"""
+        chave = record["idempotency_key"]
+
+        resumo = self.cache.get(chave)
+        atual = None
+        if resumo is None:
+            inserido = await self.nfe_service.insert_if_absent(record)
+            if inserido is not None:
+                self.cache.set(chave, self._resumo(inserido))
+                return inserido, True
+
+            atual = await self.nfe_service.get_by_idempotency_key(chave)
+            if atual is None:
+                raise Exception(f"Registro da chave de idempotência {chave} não encontrado")
+            resumo = self._resumo(atual)
+            self.cache.set(chave, resumo)
+
+        if resumo.get("payload_hash") != record["payload_hash"]:
+            raise IdempotenciaConflitoError(
+                "Idempotency-Key já utilizada com um payload diferente")
+
+        if atual is None:
+            atual = await self.nfe_service.get_by_id(resumo["id"])
+            if atual is None:
+                raise Exception(f"Registro {resumo['id']} da chave de idempotência {chave} não encontrado")
+        return atual, False
+
+    def _resumo(self, registro: Dict[str, Any]) -> Dict[str, Any]:
+        return {campo: registro.get(campo) for campo in _CAMPOS}
+
+
+_cache: LRUCache = LRUCache(IDEMPOTENCIA_CACHE_SIZE, ttl=IDEMPOTENCIA_CACHE_TTL)
@@ -0,0 +1,176 @@
+import itertools
+import os
+import threading
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from app.common.patterns.lru_cache import LRUCache
+from app.enums.nfe_status import StatusNFe
+from app.infra.supabase_client import get_async_supabase_client
+from app.services.nfe.nfe import (
+    INSERT_CHUNK_SIZE,
+    LIST_PAGE_SIZE,
+    NFE_COLUNAS_LISTAGEM,
+    NFeFiltros,
+    NFeService,
+    NFeServiceProtocol,
+)
+
+NFE_CACHE_SIZE = int(os.getenv("NFE_CACHE_SIZE", "10000"))
+# Registros em andamento mudam em outro processo (worker): TTL curto
+NFE_CACHE_TTL = float(os.getenv("NFE_CACHE_TTL", "1.0"))
+# AUTORIZADA/REJEITADA/ERRO não mudam mais de status
+NFE_CACHE_TTL_FINAL = float(os.getenv("NFE_CACHE_TTL_FINAL", "60"))
+
+_STATUS_FINAIS = (StatusNFe.AUTORIZADA.value, StatusNFe.REJEITADA.value, StatusNFe.ERRO.value)
+
+
+class CachedNFeService:
+    """`NFeServiceProtocol` com cache LRU+TTL de `get_by_id` na frente de outro service.
+
+    As escritas feitas por este processo atualizam o cache com a linha
+    devolvida pelo banco; uma escrita que falha remove a entrada, já que o
+    estado no banco fica desconhecido. Escritas de outros processos só são
+    vistas quando a entrada expira, por isso o TTL de registros ainda em
+    processamento é curto. Os registros são copiados na entrada e na saída:
+    quem altera o dict recebido não altera o cache.
+    """
+
+    def __init__(
+        self,
+        inner: NFeServiceProtocol,
+        maxsize: int = NFE_CACHE_SIZE,
+        ttl: float = NFE_CACHE_TTL,
+        ttl_final: float = NFE_CACHE_TTL_FINAL,
+    ):
+        self.inner = inner
+        self.ttl = ttl
+        self.ttl_final = ttl_final
+        self.cache: LRUCache[Dict[str, Any]] = LRUCache(maxsize)
+        # Versão por registro: uma leitura que cruzou com uma escrita não grava no cache
+        self._versoes: LRUCache[int] = LRUCache(maxsize)
+        self._sequencia = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidacoes = 0
+
+    # ==========================
+    # Leituras
+    # ==========================
+    async def get_by_id(self, record_id: str) -> Optional[Dict[str, Any]]:
+        record = self.cache.get(record_id)
+        if record is not None:
+            self._contar("hits")
+            return dict(record)
+
+        self._contar("misses")
+        versao = self._versoes.get(record_id)
+        record = await self.inner.get_by_id(record_id)
+        if record is not None and self._versoes.get(record_id) == versao:
+            self._guardar(record)
+        return record
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        return await self.inner.get_by_idempotency_key(idempotency_key)
+
+    async def list_page(
+        self,
+        limit: int = LIST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+        filtros: Optional[NFeFiltros] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return await self.inner.list_page(limit, cursor, colunas, filtros)
+
+    def iter_pages(
+        self,
+        page_size: int = LIST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+        filtros: Optional[NFeFiltros] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        return self.inner.iter_pages(page_size, cursor, colunas, filtros)
+
+    # ==========================
+    # Escritas
+    # ==========================
+    async def insert(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        return self._guardar(await self.inner.insert(record))
+
+    async def insert_if_absent(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        inserido = await self.inner.insert_if_absent(record)
+        if inserido is not None:
+            self._guardar(inserido)
+        return inserido
+
+    async def insert_many(self, records: List[Dict[str, Any]],
+                          chunk_size: int = INSERT_CHUNK_SIZE) -> List[Dict[str, Any]]:
+        # Só algumas colunas voltam do banco; não servem para popular o cache
+        return await self.inner.insert_many(records, chunk_size)
+
+    async def update(self, record_id: str, update_payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._escrever(record_id, self.inner.update(record_id, update_payload))
+
+    async def update_status(self, record_id: str, status: str,
+                            payload_retorno: Optional[Any] = None,
+                            expected_current_status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return await self._escrever(record_id, self.inner.update_status(
+            record_id, status, payload_retorno, expected_current_status))
+
+    async def update_if_status(self, record_id: str, update_payload: Dict[str, Any],
+                               expected_statuses: Sequence[str]) -> Optional[Dict[str, Any]]:
+        return await self._escrever(record_id, self.inner.update_if_status(
+            record_id, update_payload, expected_statuses))
+
+    async def mark_error(self, record_id: str, error: Any) -> Dict[str, Any]:
+        return await self.update_status(record_id, StatusNFe.ERRO.value, {"error": str(error)})
+
+    # ==========================
+    # Métricas
+    # ==========================
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "invalidacoes": self.invalidacoes,
+            "tamanho": len(self.cache),
+            "capacidade": self.cache.maxsize,
+        }
+
+    def invalidate(self, record_id: str) -> None:
+        self._versoes.set(record_id, next(self._sequencia))
+        if self.cache.pop(record_id) is not None:
+            self._contar("invalidacoes")
+
+    # ==========================
+    # Internos
+    # ==========================
+    async def _escrever(self, record_id: str, escrita) -> Optional[Dict[str, Any]]:
+        # A versão muda antes da escrita: leituras em andamento não sobrescrevem o resultado
+        self.invalidate(record_id)
+        try:
+            record = await escrita
+        except BaseException:
+            self.invalidate(record_id)
+            raise
+        if record is not None:
+            self._guardar(record)
+        return record
+
+    def _guardar(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        ttl = self.ttl_final if record.get("status") in _STATUS_FINAIS else self.ttl
+        self.cache.set(record["id"], dict(record), ttl=ttl)
+        return record
+
+    def _contar(self, contador: str) -> None:
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+
+@lru_cache(maxsize=1)
+def get_nfe_service() -> CachedNFeService:
+    """Service com cache compartilhado por todas as requisições do processo"""
+    return CachedNFeService(NFeService(get_async_supabase_client()))
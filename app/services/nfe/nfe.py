@@ -1,18 +1,22 @@
+import base64
+import json
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from uuid import uuid4
-from typing import Optional, Any, Dict, Protocol, runtime_checkable
+from typing import Optional, Any, AsyncIterator, Dict, List, Protocol, Sequence, Tuple, runtime_checkable
 
 from fastapi import Depends
 from fastapi.encoders import jsonable_encoder
+from postgrest import ReturnMethod
 
-from app.infra.supabase_client import get_supabase_client
+from app.infra.supabase_client import get_async_supabase_client
 from app.models.nfe import NFe
 from app.common.patterns.circuit_breaker import (
-    CircuitBreaker,
     CircuitBreakerConfig,
+    circuit_breakers,
     retry_with_circuit_breaker,
-    ExponentialBackoff,
 )
+from app.common.patterns.retry import RetryPolicy
 
 circuit_breaker_config = CircuitBreakerConfig(
     failure_threshold=5,
@@ -20,7 +24,61 @@ circuit_breaker_config = CircuitBreakerConfig(
     retry_timeout=timedelta(seconds=10),
 )
 
-nfe_circuit_breaker = CircuitBreaker(circuit_breaker_config)
+nfe_circuit_breaker = circuit_breakers.get("supabase:nfe", circuit_breaker_config)
+
+# Inserts toleram mais espera; consultas e updates falham mais rápido
+insert_retry_policy = RetryPolicy(initial_delay=1.0, max_delay=10.0, max_attempts=4, jitter=True)
+query_retry_policy = RetryPolicy(initial_delay=0.5, max_delay=5.0, max_attempts=3, jitter=True)
+
+# Quantidade máxima de linhas por requisição de insert em lote no PostgREST
+INSERT_CHUNK_SIZE = 500
+# Colunas lidas de volta depois do insert em lote, para identificar reenvios
+COLUNAS_INSERT_MANY = ("id", "ref", "status", "criado_em", "idempotency_key", "emissao_solicitada")
+
+# Colunas que `nfe_atualizar_lote` (update_many) sabe atualizar
+NFE_COLUNAS_ATUALIZAVEIS = frozenset({
+    "status", "payload_retorno", "chave_nfe", "numero", "serie",
+    "xml_url", "danfe_url", "autorizado_em", "atualizado_em", "xml_assinado",
+})
+
+# Colunas que a listagem aceita em `fields`
+NFE_COLUNAS = (
+    "id", "ref", "status", "chave_nfe", "numero", "serie", "xml_url", "danfe_url",
+    "payload_envio", "payload_retorno", "ambiente", "data_emissao", "autorizado_em",
+    "criado_em", "atualizado_em", "idempotency_key", "payload_hash", "xml", "xml_assinado",
+    "emissao_solicitada",
+)
+# Sem os JSONB de envio/retorno e os XML, que são a maior parte de cada linha
+NFE_COLUNAS_LISTAGEM = tuple(
+    c for c in NFE_COLUNAS if c not in ("payload_envio", "payload_retorno", "xml", "xml_assinado"))
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+
+
+@dataclass
+class NFeFiltros:
+    """Filtros da listagem de NF-e; campos None não filtram"""
+    status: Optional[str] = None
+    ambiente: Optional[str] = None
+    chave_nfe: Optional[str] = None
+    criado_de: Optional[datetime] = None
+    criado_ate: Optional[datetime] = None
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Cursor opaco com a posição (criado_em, id) da última linha da página"""
+    dados = json.dumps([row["criado_em"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        dados = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        criado_em, record_id = json.loads(dados)
+        datetime.fromisoformat(criado_em)
+        return criado_em, str(record_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
 
 
 @runtime_checkable
@@ -33,27 +91,42 @@ class NFeServiceProtocol(Protocol):
     async def update_status(self, record_id: str, status: str,
                       payload_retorno: Optional[Any] = None, expected_current_status: Optional[str] = None) -> Optional[Dict[str, Any]]: ...
 
+    async def update_if_status(self, record_id: str, update_payload: Dict[str, Any],
+                               expected_statuses: Sequence[str]) -> Optional[Dict[str, Any]]: ...
+
     async def mark_error(self, record_id: str, error: Any) -> Dict[str, Any]: ...
 
-    async def get_all(self) -> Any: ...
+    async def list_page(self, limit: int = LIST_PAGE_SIZE, cursor: Optional[str] = None,
+                        colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+                        filtros: Optional[NFeFiltros] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]: ...
+
+    def iter_pages(self, page_size: int = LIST_PAGE_SIZE, cursor: Optional[str] = None,
+                   colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+                   filtros: Optional[NFeFiltros] = None) -> AsyncIterator[List[Dict[str, Any]]]: ...
+
+    async def insert_many(self, records: List[Dict[str, Any]],
+                          chunk_size: int = INSERT_CHUNK_SIZE) -> List[Dict[str, Any]]: ...
+
+    async def insert_if_absent(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]: ...
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]: ...
 
 class NFeService:
     """Service encapsulating common operations on the `nfe` Supabase table.
     """
 
-    def __init__(self, client=Depends(get_supabase_client)):
-        self.client = client or get_supabase_client()
+    def __init__(self, client=Depends(get_async_supabase_client)):
+        self.client = client or get_async_supabase_client()
         self.circuit_breaker = nfe_circuit_breaker
 
     async def insert(self, record: Dict[str, Any]) -> Dict[str, Any]:
         insert_op = self.client.table("nfe").insert(record)
 
         try:
-            backoff = ExponentialBackoff(initial_delay=1.0, max_delay=10.0, max_attemps=4, jitter=True)
             resp = await retry_with_circuit_breaker(
-                lambda: insert_op.execute(),
+                insert_op.execute,
                 self.circuit_breaker,
-                backoff,
+                insert_retry_policy,
             )
 
             if getattr(resp, "error", None):
@@ -64,11 +137,174 @@ class NFeService:
         except Exception as exc:
             raise Exception(f"Falha ao inserir NF-e no Supabase: {exc}")
 
+    async def insert_if_absent(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Insere o registro, a menos que a `idempotency_key` já exista.
+
+        Retorna o registro inserido, ou None se a chave já estava gravada.
+        """
+        insert_op = self.client.table("nfe").upsert(
+            record, on_conflict="idempotency_key", ignore_duplicates=True)
+
+        try:
+            resp = await retry_with_circuit_breaker(
+                insert_op.execute,
+                self.circuit_breaker,
+                insert_retry_policy,
+            )
+
+            if getattr(resp, "error", None):
+                raise Exception(resp.error)
+            return resp.data[0] if resp.data else None
+        except Exception as exc:
+            raise Exception(f"Falha ao inserir NF-e no Supabase: {exc}")
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        try:
+            async def op():
+                return await self.client.table("nfe").select("*").eq(
+                    "idempotency_key", idempotency_key).execute()
+
+            resp = await retry_with_circuit_breaker(
+                op,
+                self.circuit_breaker,
+                query_retry_policy,
+            )
+
+            if not resp.data:
+                return None
+            return resp.data[0]
+        except Exception as exc:
+            raise Exception(f"Falha ao buscar NF-e por chave de idempotência no Supabase: {exc}")
+
+    async def insert_many(self, records: List[Dict[str, Any]],
+                          chunk_size: int = INSERT_CHUNK_SIZE) -> List[Dict[str, Any]]:
+        """Insere vários registros com um único upsert por bloco de `chunk_size` linhas.
+
+        Registros cuja `idempotency_key` já está gravada são ignorados pelo
+        banco (``ON CONFLICT DO NOTHING``). Depois de cada bloco, as linhas das
+        chaves são lidas de volta (só `COLUNAS_INSERT_MANY`), na ordem de
+        `records`: o `id` difere do enviado quando a chave já existia e a
+        linha é a do registro original.
+        """
+        linhas: List[Dict[str, Any]] = []
+
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            insert_op = self.client.table("nfe").upsert(
+                chunk, on_conflict="idempotency_key", ignore_duplicates=True,
+                returning=ReturnMethod.minimal)
+
+            try:
+                resp = await retry_with_circuit_breaker(
+                    insert_op.execute,
+                    self.circuit_breaker,
+                    insert_retry_policy,
+                )
+
+                if getattr(resp, "error", None):
+                    raise Exception(resp.error)
+            except Exception as exc:
+                raise Exception(
+                    f"Falha ao inserir lote de NF-e no Supabase "
+                    f"(registros {start}-{start + len(chunk) - 1}): {exc}")
+
+            gravadas = await self.get_by_idempotency_keys([r["idempotency_key"] for r in chunk])
+            for record in chunk:
+                linha = gravadas.get(record["idempotency_key"])
+                if linha is None:
+                    raise Exception(
+                        f"Registro da chave de idempotência {record['idempotency_key']} não encontrado")
+                linhas.append(linha)
+
+        return linhas
+
+    async def get_by_idempotency_keys(self, idempotency_keys: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Colunas `COLUNAS_INSERT_MANY` das linhas com as chaves, indexadas pela chave"""
+        try:
+            async def op():
+                return await self.client.table("nfe").select(",".join(COLUNAS_INSERT_MANY)).in_(
+                    "idempotency_key", list(idempotency_keys)).execute()
+
+            resp = await retry_with_circuit_breaker(
+                op,
+                self.circuit_breaker,
+                query_retry_policy,
+            )
+
+            return {linha["idempotency_key"]: linha for linha in resp.data or []}
+        except Exception as exc:
+            raise Exception(f"Falha ao buscar NF-e por chaves de idempotência no Supabase: {exc}")
+
     def _generate_ref(self, agora: datetime) -> str:
         return f"{agora.strftime('%y%m%d%H%M%S')}{uuid4().hex[:6]}"
     
-    def get_all(self) -> Any:
-        return self.client.table("nfe").select("*").execute()
+    async def list_page(
+        self,
+        limit: int = LIST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+        filtros: Optional[NFeFiltros] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Página de NF-e da mais recente para a mais antiga, paginada por keyset.
+
+        A posição é (criado_em, id) da última linha, então cada página é uma
+        busca no índice, sem OFFSET. Retorna as linhas e o cursor da próxima
+        página (None na última).
+        """
+        limit = max(1, min(limit, LIST_MAX_PAGE_SIZE))
+        # O cursor precisa de criado_em e id, mesmo que não tenham sido pedidos
+        selecionadas = list(dict.fromkeys([*colunas, "criado_em", "id"]))
+        posicao = decode_cursor(cursor) if cursor else None
+        filtros = filtros or NFeFiltros()
+
+        async def op():
+            query = self.client.table("nfe").select(",".join(selecionadas))
+            for coluna in ("status", "ambiente", "chave_nfe"):
+                valor = getattr(filtros, coluna)
+                if valor is not None:
+                    query = query.eq(coluna, valor)
+            if filtros.criado_de is not None:
+                query = query.gte("criado_em", filtros.criado_de.isoformat())
+            if filtros.criado_ate is not None:
+                query = query.lt("criado_em", filtros.criado_ate.isoformat())
+            if posicao is not None:
+                criado_em, record_id = posicao
+                query = query.or_(
+                    f'criado_em.lt."{criado_em}",'
+                    f'and(criado_em.eq."{criado_em}",id.lt."{record_id}")'
+                )
+            # Uma linha a mais indica se existe próxima página
+            return await query.order("criado_em", desc=True).order("id", desc=True).limit(limit + 1).execute()
+
+        try:
+            resp = await retry_with_circuit_breaker(
+                op,
+                self.circuit_breaker,
+                query_retry_policy,
+            )
+        except Exception as exc:
+            raise Exception(f"Falha ao listar NF-e no Supabase: {exc}")
+
+        rows = resp.data or []
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+
+    async def iter_pages(
+        self,
+        page_size: int = LIST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        colunas: Sequence[str] = NFE_COLUNAS_LISTAGEM,
+        filtros: Optional[NFeFiltros] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Percorre a listagem buscando cada página só quando a anterior foi consumida"""
+        while True:
+            rows, cursor = await self.list_page(page_size, cursor, colunas, filtros)
+            if rows:
+                yield rows
+            if cursor is None:
+                return
 
     async def create_from_model(self, nfe: NFe, xml_str: Optional[str] = None) -> Dict[str, Any]:
         agora = datetime.now(timezone.utc)
@@ -91,6 +327,8 @@ class NFeService:
             "autorizado_em": None,
             "criado_em": agora.isoformat(),
             "atualizado_em": agora.isoformat(),
+            # O worker reaproveita o XML em vez de gerá-lo de novo
+            "xml": xml_str,
         }
 
         try:
@@ -101,15 +339,13 @@ class NFeService:
 
     async def get_by_id(self, record_id: str) -> Optional[Dict[str, Any]]:
         try:
-            backoff = ExponentialBackoff(initial_delay=0.5, max_delay=5.0, max_attemps=3, jitter=True)
-
-            def op():
-                return self.client.table("nfe").select("*").eq("id", record_id).execute()
+            async def op():
+                return await self.client.table("nfe").select("*").eq("id", record_id).execute()
 
             resp = await retry_with_circuit_breaker(
                 op,
                 self.circuit_breaker,
-                backoff,
+                query_retry_policy,
             )
 
             if not resp.data:
@@ -123,11 +359,10 @@ class NFeService:
             update_payload).eq("id", record_id)
 
         try:
-            backoff = ExponentialBackoff(initial_delay=0.5, max_delay=5.0, max_attemps=3, jitter=True)
             resp = await retry_with_circuit_breaker(
-                lambda: update_op.execute(),
+                update_op.execute,
                 self.circuit_breaker,
-                backoff,
+                query_retry_policy,
             )
 
             if getattr(resp, "error", None):
@@ -149,11 +384,10 @@ class NFeService:
             query = query.eq("status", expected_current_status)
 
         try:
-            backoff = ExponentialBackoff(initial_delay=0.5, max_delay=5.0, max_attemps=3, jitter=True)
             resp = await retry_with_circuit_breaker(
-                lambda: query.execute(),
+                query.execute,
                 self.circuit_breaker,
-                backoff,
+                query_retry_policy,
             )
             if getattr(resp, "error", None):
                 raise Exception(resp.error)
@@ -161,8 +395,111 @@ class NFeService:
         except Exception as exc:
             raise Exception(f"Falha ao atualizar status da NF-e no Supabase: {exc}")
 
+    async def update_if_status(self, record_id: str, update_payload: Dict[str, Any],
+                               expected_statuses: Sequence[str]) -> Optional[Dict[str, Any]]:
+        """UPDATE condicionado ao status atual, em uma requisição.
+
+        Retorna a linha atualizada, ou None se o registro não existe ou o
+        status não está em `expected_statuses`.
+        """
+        query = self.client.table("nfe").update(update_payload) \
+            .eq("id", record_id).in_("status", list(expected_statuses))
+
+        try:
+            resp = await retry_with_circuit_breaker(
+                query.execute,
+                self.circuit_breaker,
+                query_retry_policy,
+            )
+            if getattr(resp, "error", None):
+                raise Exception(resp.error)
+            return resp.data[0] if resp.data else None
+        except Exception as exc:
+            raise Exception(f"Falha ao atualizar status da NF-e no Supabase: {exc}")
+
+    async def update_many(self, itens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Várias atualizações em uma requisição (RPC `nfe_atualizar_lote`).
+
+        Cada item é `{"id", "payload", "expected"}`; `expected` (lista de
+        status ou None) condiciona a atualização ao status atual. Retorna as
+        linhas atualizadas; itens sem linha no retorno não foram aplicados.
+        """
+        return await self._rpc(
+            "nfe_atualizar_lote", {"itens": jsonable_encoder(itens)}, "atualizar lote de NF-e") or []
+
+    # ==========================
+    # Leases (vários workers sobre a tabela)
+    # ==========================
+    async def claim_batch(self, owner: str, limit: int, lease_seconds: float,
+                          max_tentativas: int) -> List[Dict[str, Any]]:
+        """Reivindica até `limit` registros CRIADA livres para `owner` (RPC `nfe_reivindicar`)"""
+        return await self._rpc("nfe_reivindicar", {
+            "p_owner": owner,
+            "p_limite": limit,
+            "p_lease_segundos": lease_seconds,
+            "p_max_tentativas": max_tentativas,
+        }, "reivindicar NF-e") or []
+
+    async def renew_leases(self, owner: str, lease_seconds: float) -> int:
+        return await self._rpc("nfe_renovar_leases", {
+            "p_owner": owner,
+            "p_lease_segundos": lease_seconds,
+        }, "renovar leases de NF-e") or 0
+
+    async def release_lease(self, record_id: str, owner: str, delay: float,
+                            lease_recibo_seconds: float, devolver: bool = False) -> None:
+        """Libera o lease de `owner`; com `devolver`, PROCESSANDO volta para CRIADA"""
+        await self._rpc("nfe_liberar_lease", {
+            "p_id": record_id,
+            "p_owner": owner,
+            "p_atraso_segundos": delay,
+            "p_lease_recibo_segundos": lease_recibo_seconds,
+            "p_devolver": devolver,
+        }, "liberar lease de NF-e")
+
+    async def sweep_leases(self, max_tentativas: int) -> int:
+        """Devolve para CRIADA (ou ERRO) registros PROCESSANDO com lease vencido
+        e leva para ERRO os CRIADA que esgotaram as tentativas"""
+        return await self._rpc("nfe_varrer_leases", {
+            "p_max_tentativas": max_tentativas,
+        }, "varrer leases de NF-e") or 0
+
+    # ==========================
+    # Eventos de webhook (outbox transacional, gravado por trigger)
+    # ==========================
+    async def claim_webhook_events(self, owner: str, limit: int,
+                                   lease_seconds: float) -> List[Dict[str, Any]]:
+        """Reivindica até `limit` eventos de `nfe_webhook_eventos` (RPC `nfe_webhook_eventos_reivindicar`)"""
+        return await self._rpc("nfe_webhook_eventos_reivindicar", {
+            "p_owner": owner,
+            "p_limite": limit,
+            "p_lease_segundos": lease_seconds,
+        }, "reivindicar eventos de webhook") or []
+
+    async def ack_webhook_events(self, owner: str, ids: List[int]) -> int:
+        """Apaga os eventos já repassados ao outbox local"""
+        return await self._rpc("nfe_webhook_eventos_confirmar", {
+            "p_owner": owner,
+            "p_ids": ids,
+        }, "confirmar eventos de webhook") or 0
+
+    async def _rpc(self, fn: str, params: Dict[str, Any], descricao: str) -> Any:
+        rpc_op = self.client.rpc(fn, params)
+
+        try:
+            resp = await retry_with_circuit_breaker(
+                rpc_op.execute,
+                self.circuit_breaker,
+                query_retry_policy,
+            )
+            if getattr(resp, "error", None):
+                raise Exception(resp.error)
+            return resp.data
+        except Exception as exc:
+            raise Exception(f"Falha ao {descricao} no Supabase: {exc}")
+
     async def mark_error(self, record_id: str, error: Any) -> Dict[str, Any]:
         return await self.update_status(record_id, "ERRO", {"error": str(error)})
 
 
-__all__ = ["NFeService", "NFeServiceProtocol"]
+__all__ = ["NFeService", "NFeServiceProtocol", "NFeFiltros"]
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, Iterable, Mapping, Optional
+
+from app.enums.nfe_status import StatusNFe
+
+CRIADA = StatusNFe.CRIADA.value
+PROCESSANDO = StatusNFe.PROCESSANDO.value
+AUTORIZADA = StatusNFe.AUTORIZADA.value
+REJEITADA = StatusNFe.REJEITADA.value
+ERRO = StatusNFe.ERRO.value
+
+# Transições permitidas; PROCESSANDO -> PROCESSANDO grava o retorno parcial
+# (recibo de lote) sem mudar o status. Status finais não saem mais.
+# PROCESSANDO -> CRIADA só acontece no banco (nfe_varrer_leases e
+# nfe_liberar_lease), quando o worker dono do lease cai ou o job falha antes
+# de concluir.
+TRANSICOES: Mapping[str, FrozenSet[str]] = {
+    CRIADA: frozenset({PROCESSANDO, ERRO}),
+    PROCESSANDO: frozenset({PROCESSANDO, AUTORIZADA, REJEITADA, ERRO}),
+    AUTORIZADA: frozenset(),
+    REJEITADA: frozenset(),
+    ERRO: frozenset(),
+}
+
+
+class TransicaoInvalidaError(ValueError):
+    """Transição de status não prevista em `TRANSICOES`"""
+
+
+def origens(para: str) -> FrozenSet[str]:
+    """Status a partir dos quais `para` pode ser alcançado"""
+    return frozenset(de for de, destinos in TRANSICOES.items() if para in destinos)
+
+
+class NFeStateMachine:
+    """Transições de status da NF-e sobre o `NFeService`.
+
+    Cada transição é um único UPDATE condicionado ao status atual
+    (`update_if_status`) que devolve a linha atualizada, então não há
+    leitura antes nem depois. Retorna None quando o registro não existe ou
+    já não está em um dos status de origem (outro worker chegou antes).
+    """
+
+    def __init__(self, nfe_service):
+        self.nfe_service = nfe_service
+
+    async def transicionar(
+        self,
+        record_id: str,
+        para: str,
+        de: Optional[Iterable[str]] = None,
+        campos: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        de = frozenset(de) if de is not None else origens(para)
+        invalidas = sorted(origem for origem in de if para not in TRANSICOES.get(origem, ()))
+        if invalidas or not de:
+            raise TransicaoInvalidaError(
+                f"Transição inválida para {para} a partir de {', '.join(invalidas) or 'nenhum status'}")
+
+        payload = {
+            **(campos or {}),
+            "status": para,
+            "atualizado_em": datetime.now(timezone.utc).isoformat(),
+        }
+        return await self.nfe_service.update_if_status(record_id, payload, sorted(de))
+
+    async def iniciar_processamento(self, record_id: str, retomada: bool = False) -> Optional[Dict[str, Any]]:
+        """CRIADA -> PROCESSANDO; funciona como lock do registro entre workers.
+
+        Com `retomada`, o job foi reentregue pela fila depois de uma falha ou
+        de um lease vencido, e o registro pode ter ficado em PROCESSANDO.
+        """
+        de = [CRIADA, PROCESSANDO] if retomada else [CRIADA]
+        return await self.transicionar(record_id, PROCESSANDO, de=de)
+
+    async def registrar_retorno(self, record_id: str, payload_retorno: Any,
+                                campos: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Grava um retorno intermediário mantendo o registro em PROCESSANDO"""
+        return await self.transicionar(
+            record_id, PROCESSANDO, de=[PROCESSANDO],
+            campos={**(campos or {}), "payload_retorno": payload_retorno})
+
+    async def finalizar(self, record_id: str, status: str,
+                        campos: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """PROCESSANDO -> AUTORIZADA/REJEITADA"""
+        return await self.transicionar(record_id, status, de=[PROCESSANDO], campos=campos)
+
+    async def marcar_erro(self, record_id: str, erro: Any,
+                          campos: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Qualquer status não final -> ERRO; um status final não é sobrescrito"""
+        return await self.transicionar(
+            record_id, ERRO, campos={**(campos or {}), "payload_retorno": {"error": str(erro)}})
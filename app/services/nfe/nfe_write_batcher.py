@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from app.enums.nfe_status import StatusNFe
+from app.services.nfe.nfe import NFE_COLUNAS_ATUALIZAVEIS, NFeService
+
+logger = logging.getLogger(__name__)
+
+# Tempo que a primeira escrita espera por outras antes do envio
+NFE_WRITE_BATCH_WINDOW = float(os.getenv("NFE_WRITE_BATCH_WINDOW", "0.005"))
+NFE_WRITE_BATCH_MAX = int(os.getenv("NFE_WRITE_BATCH_MAX", "200"))
+
+
+@dataclass
+class _Escrita:
+    record_id: str
+    payload: Dict[str, Any]
+    expected: Optional[List[str]]
+    future: asyncio.Future
+
+
+class NFeWriteBatcher:
+    """Group commit das atualizações de NF-e feitas pelos workflows do processo.
+
+    As escritas que chegam dentro de `janela` segundos (ou até `max_lote`)
+    seguem juntas em uma chamada de `update_many`; cada chamador recebe a
+    própria linha quando o lote é gravado. Um mesmo registro aparece uma
+    única vez por lote: uma segunda escrita para ele vai no lote seguinte.
+    Leituras e inserts são repassados ao service interno.
+    """
+
+    def __init__(
+        self,
+        inner: NFeService,
+        janela: float = NFE_WRITE_BATCH_WINDOW,
+        max_lote: int = NFE_WRITE_BATCH_MAX,
+    ):
+        self.inner = inner
+        self.janela = janela
+        self.max_lote = max_lote
+        self._pendentes: List[_Escrita] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._em_voo: Set[asyncio.Task] = set()
+        self.lotes = 0
+        self.escritas = 0
+
+    def __getattr__(self, nome: str):
+        # Demais operações do NFeServiceProtocol vão direto para o service
+        return getattr(self.inner, nome)
+
+    async def update(self, record_id: str, update_payload: Dict[str, Any]) -> Dict[str, Any]:
+        record = await self._enfileirar(record_id, update_payload, None)
+        if record is None:
+            raise Exception(f"Falha ao atualizar NF-e no Supabase: registro {record_id} não encontrado")
+        return record
+
+    async def update_if_status(self, record_id: str, update_payload: Dict[str, Any],
+                               expected_statuses: Sequence[str]) -> Optional[Dict[str, Any]]:
+        return await self._enfileirar(record_id, update_payload, list(expected_statuses))
+
+    async def update_status(self, record_id: str, status: str,
+                            payload_retorno: Optional[Any] = None,
+                            expected_current_status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        payload = {"status": status, "atualizado_em": datetime.now(timezone.utc).isoformat()}
+        if payload_retorno is not None:
+            payload["payload_retorno"] = payload_retorno
+        expected = [expected_current_status] if expected_current_status is not None else None
+        return await self._enfileirar(record_id, payload, expected)
+
+    async def mark_error(self, record_id: str, error: Any) -> Optional[Dict[str, Any]]:
+        return await self.update_status(record_id, StatusNFe.ERRO.value, {"error": str(error)})
+
+    async def aclose(self) -> None:
+        """Envia as escritas pendentes e espera os lotes em andamento"""
+        if self._pendentes:
+            self._disparar()
+        while self._em_voo:
+            await asyncio.gather(*self._em_voo, return_exceptions=True)
+
+    async def _enfileirar(self, record_id: str, payload: Dict[str, Any],
+                          expected: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        if not payload.keys() <= NFE_COLUNAS_ATUALIZAVEIS:
+            # Colunas que a RPC não cobre seguem pelo UPDATE individual
+            if expected is None:
+                return await self.inner.update(record_id, payload)
+            return await self.inner.update_if_status(record_id, payload, expected)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pendentes.append(_Escrita(record_id, payload, expected, future))
+
+        if len(self._pendentes) >= self.max_lote:
+            self._disparar()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.janela, self._disparar)
+
+        return await future
+
+    def _disparar(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        lote: List[_Escrita] = []
+        restantes: List[_Escrita] = []
+        ids = set()
+        for escrita in self._pendentes:
+            if escrita.future.done():
+                continue  # chamador cancelado
+            if escrita.record_id in ids or len(lote) >= self.max_lote:
+                restantes.append(escrita)
+            else:
+                ids.add(escrita.record_id)
+                lote.append(escrita)
+        self._pendentes = restantes
+
+        if restantes:
+            self._timer = asyncio.get_running_loop().call_later(self.janela, self._disparar)
+        if lote:
+            task = asyncio.create_task(self._gravar(lote))
+            self._em_voo.add(task)
+            task.add_done_callback(self._em_voo.discard)
+
+    async def _gravar(self, lote: List[_Escrita]) -> None:
+        itens = [
+            {"id": escrita.record_id, "payload": escrita.payload, "expected": escrita.expected}
+            for escrita in lote
+        ]
+
+        try:
+            rows = await self.inner.update_many(itens)
+        except Exception as e:
+            logger.warning("Falha ao gravar lote de %s atualização(ões) de NF-e: %s", len(lote), e)
+            for escrita in lote:
+                if not escrita.future.done():
+                    escrita.future.set_exception(e)
+            return
+
+        self.lotes += 1
+        self.escritas += len(lote)
+        por_id = {str(row["id"]): row for row in rows}
+        for escrita in lote:
+            if not escrita.future.done():
+                escrita.future.set_result(por_id.get(escrita.record_id))
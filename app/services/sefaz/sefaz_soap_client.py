@@ -1,24 +1,39 @@
-from zeep import Client
+from typing import Optional, Tuple
+import asyncio
+
+import httpx
 from requests import Session
 from lxml import etree
-from zeep.transports import Transport
+from zeep.transports import AsyncTransport, Transport
+from zeep.cache import InMemoryCache
 import logging
-from zeep.plugins import HistoryPlugin
-from zeep import Client, Settings
-from lxml import etree
+from zeep import AsyncClient, Client, Settings
 
 logger = logging.getLogger(__name__)
 
 
 class SEFAZSoapClient:
-    def __init__(self, wsdl_url: str, verify_ssl=True):
-        # Plugin para capturar histórico de requisições/respostas
-        self.history = HistoryPlugin()
-
-        # Configurar session HTTP
-        session = Session()
-        session.verify = verify_ssl
-        transport = Transport(session=session, operation_timeout=30) # Timeout de 30 segundos
+    def __init__(
+        self,
+        wsdl_url: str,
+        verify_ssl=True,
+        session: Optional[Session] = None,
+        cert: Optional[Tuple[str, str]] = None,
+        cache: Optional[InMemoryCache] = None,
+    ):
+        self.wsdl_url = wsdl_url
+
+        # Configurar session HTTP (reaproveitada quando fornecida pelo registry)
+        if session is None:
+            session = Session()
+            session.verify = verify_ssl
+            if cert:
+                session.cert = cert
+        transport = Transport(
+            session=session,
+            cache=cache,
+            operation_timeout=30  # Timeout de 30 segundos
+        )
 
         # Criar client zeep com configurações robustas
         settings = Settings(
@@ -31,46 +46,38 @@ class SEFAZSoapClient:
             wsdl=wsdl_url,
             transport=transport,
             settings=settings,
-            plugins=[self.history]
         )
 
     def autorizar(self, xml: str) -> str:
         """
         Envia XML para autorização e retorna a resposta XML raw
 
-        Esta abordagem usa o HistoryPlugin do zeep para capturar
-        a resposta HTTP real, similar ao que sistemas de boleto fazem.
+        A chamada é feita com `raw_response=True`, que devolve a resposta HTTP
+        sem o parse do zeep. Diferente do HistoryPlugin, isso é seguro quando
+        o mesmo client é compartilhado entre várias threads.
         """
         try:
             # Faz a chamada SOAP
             logger.debug("Enviando requisição SOAP...")
 
-            # Tenta chamar o serviço
-            try:
-                result = self.client.service.nfeAutorizacaoLote(xml)
-                logger.debug(
-                    f"Resultado zeep (type={type(result)}): {str(result)[:200]}")
-            except TypeError as e: 
-                logger.warning(f"Chamada direta falhou: {e}")
-                
-            if self.history.last_received:
-                response_content = self.history.last_received['envelope']
-                logger.debug(
-                    f"Response envelope (primeiros 300 chars): {etree.tostring(response_content, encoding='unicode')[:300]}")
+            with self.client.settings(raw_response=True):
+                response = self.client.service.nfeAutorizacaoLote(xml)
 
-                # Extrair o corpo da resposta SOAP
-                xml_response = self._extract_nfe_result(response_content)
+            response.raise_for_status()
+            response_content = etree.fromstring(response.content)
+            logger.debug(
+                f"Response envelope (primeiros 300 chars): {etree.tostring(response_content, encoding='unicode')[:300]}")
 
-                if not xml_response or not xml_response.strip():
-                    logger.error("Resposta extraída está vazia!")
-                    logger.error(
-                        f"Envelope completo: {etree.tostring(response_content, encoding='unicode')}")
-                    raise ValueError("Resposta SEFAZ está vazia após extração")
+            # Extrair o corpo da resposta SOAP
+            xml_response = self._extract_nfe_result(response_content)
 
-                return xml_response
-            else:
-                logger.error("Não há histórico de resposta disponível")
-                raise ValueError("Não foi possível capturar resposta SOAP")
+            if not xml_response or not xml_response.strip():
+                logger.error("Resposta extraída está vazia!")
+                logger.error(
+                    f"Envelope completo: {etree.tostring(response_content, encoding='unicode')}")
+                raise ValueError("Resposta SEFAZ está vazia após extração")
+
+            return xml_response
 
         except Exception as e:
             logger.exception(f"Erro ao enviar para SEFAZ: {e}")
@@ -140,3 +147,109 @@ class SEFAZSoapClient:
         except Exception as e:
             logger.exception(f"Erro ao extrair resultado NFe: {e}")
             raise
+
+
+class SEFAZAsyncSoapClient(SEFAZSoapClient):
+    """Versão assíncrona do client, com as operações enviadas via httpx.
+
+    O carregamento do WSDL continua síncrono (feito por `wsdl_client`), então
+    deve ser criado fora do event loop; ver `SoapClientRegistry.get_async`.
+    """
+
+    def __init__(
+        self,
+        wsdl_url: str,
+        http_client: httpx.AsyncClient,
+        wsdl_client: httpx.Client,
+        cache: Optional[InMemoryCache] = None,
+        host_limit: Optional[asyncio.Semaphore] = None,
+    ):
+        self.wsdl_url = wsdl_url
+        self.host_limit = host_limit
+
+        transport = AsyncTransport(
+            client=http_client,
+            wsdl_client=wsdl_client,
+            cache=cache,
+        )
+
+        # raw_response fica fixo no client: o context manager `settings()` do
+        # zeep é por thread e não isola corrotinas concorrentes no mesmo loop
+        settings = Settings(
+            strict=False,
+            xml_huge_tree=True,
+            xsd_ignore_sequence_order=True,
+            raw_response=True,
+        )
+
+        self.client = AsyncClient(
+            wsdl=wsdl_url,
+            transport=transport,
+            settings=settings,
+        )
+
+    async def _chamar(self, operacao: str, xml: str):
+        servico = getattr(self.client.service, operacao)
+
+        if self.host_limit is not None:
+            async with self.host_limit:
+                response = await servico(xml)
+        else:
+            response = await servico(xml)
+
+        response.raise_for_status()
+        return etree.fromstring(response.content)
+
+    async def autorizar(self, xml: str) -> str:
+        """Envia XML para autorização sem bloquear o event loop"""
+        try:
+            logger.debug("Enviando requisição SOAP assíncrona...")
+
+            response_content = await self._chamar("nfeAutorizacaoLote", xml)
+            xml_response = self._extract_nfe_result(response_content)
+
+            if not xml_response or not xml_response.strip():
+                logger.error("Resposta extraída está vazia!")
+                raise ValueError("Resposta SEFAZ está vazia após extração")
+
+            return xml_response
+
+        except Exception as e:
+            logger.exception(f"Erro ao enviar para SEFAZ: {e}")
+            raise
+
+    async def consultar_recibo(self, xml: str) -> str:
+        """Consulta o processamento de um lote (nfeRetAutorizacaoLote) e retorna o <retConsReciNFe>"""
+        try:
+            response_content = await self._chamar("nfeRetAutorizacaoLote", xml)
+
+            ret_cons_reci = response_content.find(
+                './/{http://www.portalfiscal.inf.br/nfe}retConsReciNFe')
+            if ret_cons_reci is None:
+                logger.error(
+                    f"Envelope: {etree.tostring(response_content, encoding='unicode')}")
+                raise ValueError("Estrutura SOAP inesperada")
+
+            return etree.tostring(ret_cons_reci, encoding='unicode')
+
+        except Exception as e:
+            logger.exception(f"Erro ao consultar recibo na SEFAZ: {e}")
+            raise
+
+    async def consultar_protocolo(self, xml: str) -> str:
+        """Consulta a situação de uma NF-e pela chave (nfeConsultaNF) e retorna o <retConsSitNFe>"""
+        try:
+            response_content = await self._chamar("nfeConsultaNF", xml)
+
+            ret_cons_sit = response_content.find(
+                './/{http://www.portalfiscal.inf.br/nfe}retConsSitNFe')
+            if ret_cons_sit is None:
+                logger.error(
+                    f"Envelope: {etree.tostring(response_content, encoding='unicode')}")
+                raise ValueError("Estrutura SOAP inesperada")
+
+            return etree.tostring(ret_cons_sit, encoding='unicode')
+
+        except Exception as e:
+            logger.exception(f"Erro ao consultar protocolo na SEFAZ: {e}")
+            raise
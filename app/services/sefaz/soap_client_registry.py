@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from requests import Session
+from requests.adapters import HTTPAdapter
+from zeep.cache import InMemoryCache
+
+from app.services.sefaz.sefaz_soap_client import SEFAZAsyncSoapClient, SEFAZSoapClient
+
+logger = logging.getLogger(__name__)
+
+# Tempo de vida de um client parseado antes de baixar o WSDL novamente
+SEFAZ_CLIENT_TTL = float(os.getenv("SEFAZ_CLIENT_TTL", "3600"))
+# Conexões HTTP mantidas abertas por host em cada session
+SEFAZ_POOL_MAXSIZE = int(os.getenv("SEFAZ_POOL_MAXSIZE", "20"))
+# Limites do transporte assíncrono (httpx)
+SEFAZ_MAX_CONNECTIONS = int(os.getenv("SEFAZ_MAX_CONNECTIONS", "200"))
+SEFAZ_MAX_CONNECTIONS_PER_HOST = int(os.getenv("SEFAZ_MAX_CONNECTIONS_PER_HOST", "50"))
+SEFAZ_OPERATION_TIMEOUT = float(os.getenv("SEFAZ_OPERATION_TIMEOUT", "30"))
+
+CertPair = Tuple[str, str]
+
+
+class SoapClientRegistry:
+    """Mantém clients zeep já parseados e sessions HTTP reaproveitáveis.
+
+    Os clients são indexados por (URL do WSDL, certificado) e reconstruídos
+    quando passam de `ttl` segundos. As sessions são indexadas pelo
+    certificado, então todos os autorizadores de um mesmo certificado
+    compartilham o pool de conexões.
+
+    Os clients assíncronos (`get_async`) seguem a mesma lógica, com um
+    `httpx.AsyncClient` por certificado e um semáforo por host limitando
+    as requisições simultâneas a cada autorizador.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SEFAZ_CLIENT_TTL,
+        pool_maxsize: int = SEFAZ_POOL_MAXSIZE,
+        verify_ssl=True,
+        max_connections: int = SEFAZ_MAX_CONNECTIONS,
+        max_connections_per_host: int = SEFAZ_MAX_CONNECTIONS_PER_HOST,
+        operation_timeout: float = SEFAZ_OPERATION_TIMEOUT,
+    ):
+        self.ttl = ttl
+        self.pool_maxsize = pool_maxsize
+        self.verify_ssl = verify_ssl
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.operation_timeout = operation_timeout
+        # Cache dos documentos WSDL/XSD baixados, compartilhado entre os clients
+        self._wsdl_cache = InMemoryCache(timeout=int(ttl))
+        self._clients: Dict[Tuple[str, Optional[CertPair]], Tuple[SEFAZSoapClient, float]] = {}
+        self._sessions: Dict[Optional[CertPair], Session] = {}
+        self._locks: Dict[Tuple[str, Optional[CertPair]], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._async_clients: Dict[Tuple[str, Optional[CertPair]], Tuple[SEFAZAsyncSoapClient, float]] = {}
+        self._http_clients: Dict[Optional[CertPair], Tuple[httpx.AsyncClient, httpx.Client]] = {}
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self, wsdl_url: str, cert: Optional[CertPair] = None) -> SEFAZSoapClient:
+        key = (wsdl_url, cert)
+
+        client = self._get_valid(key)
+        if client is not None:
+            return client
+
+        # Um lock por chave evita que várias threads parseiem o mesmo WSDL
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            client = self._get_valid(key)
+            if client is not None:
+                return client
+
+            logger.info("Criando client SOAP para %s", wsdl_url)
+            client = SEFAZSoapClient(
+                wsdl_url,
+                session=self._get_session(cert),
+                cache=self._wsdl_cache,
+            )
+            self._clients[key] = (client, time.monotonic())
+            return client
+
+    async def get_async(self, wsdl_url: str, cert: Optional[CertPair] = None) -> SEFAZAsyncSoapClient:
+        key = (wsdl_url, cert)
+
+        client = self._get_valid(key, self._async_clients)
+        if client is not None:
+            return client
+
+        self._loop = asyncio.get_running_loop()
+        http_client, wsdl_client = self._get_http_clients(cert)
+        host_limit = self._get_host_limit(wsdl_url)
+
+        # O parse do WSDL é síncrono; roda fora do event loop
+        return await asyncio.to_thread(
+            self._build_async_client, key, http_client, wsdl_client, host_limit)
+
+    def _build_async_client(self, key, http_client, wsdl_client, host_limit) -> SEFAZAsyncSoapClient:
+        with self._lock:
+            key_lock = self._locks.setdefault(("async",) + key, threading.Lock())
+
+        with key_lock:
+            client = self._get_valid(key, self._async_clients)
+            if client is not None:
+                return client
+
+            logger.info("Criando client SOAP assíncrono para %s", key[0])
+            client = SEFAZAsyncSoapClient(
+                key[0],
+                http_client=http_client,
+                wsdl_client=wsdl_client,
+                cache=self._wsdl_cache,
+                host_limit=host_limit,
+            )
+            self._async_clients[key] = (client, time.monotonic())
+            return client
+
+    def _get_http_clients(self, cert: Optional[CertPair]) -> Tuple[httpx.AsyncClient, httpx.Client]:
+        clients = self._http_clients.get(cert)
+        if clients is None:
+            verify = self.verify_ssl
+            if cert:
+                verify = httpx.create_ssl_context(verify=self.verify_ssl)
+                verify.load_cert_chain(*cert)
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            )
+            clients = (
+                httpx.AsyncClient(verify=verify, limits=limits, timeout=self.operation_timeout),
+                httpx.Client(verify=verify, timeout=self.operation_timeout),
+            )
+            self._http_clients[cert] = clients
+        return clients
+
+    def _get_host_limit(self, wsdl_url: str) -> asyncio.Semaphore:
+        host = urlsplit(wsdl_url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_limits[host] = limit
+        return limit
+
+    def warm(self, wsdl_urls: Iterable[str], cert: Optional[CertPair] = None) -> Dict[str, bool]:
+        """Carrega antecipadamente os clients; falhas são apenas registradas"""
+        result = {}
+        for wsdl_url in wsdl_urls:
+            try:
+                self.get(wsdl_url, cert)
+                result[wsdl_url] = True
+            except Exception as e:
+                logger.warning("Falha ao pré-carregar WSDL %s: %s", wsdl_url, e)
+                result[wsdl_url] = False
+        return result
+
+    def invalidate(self, wsdl_url: Optional[str] = None) -> None:
+        with self._lock:
+            if wsdl_url is None:
+                self._clients.clear()
+                self._async_clients.clear()
+                return
+            for clients in (self._clients, self._async_clients):
+                for key in [k for k in clients if k[0] == wsdl_url]:
+                    del clients[key]
+
+    def invalidate_cert(self, cert: CertPair) -> None:
+        """Descarta clients e conexões de um certificado que deixou de ser usado"""
+        with self._lock:
+            for clients in (self._clients, self._async_clients):
+                for key in [k for k in clients if k[1] == cert]:
+                    del clients[key]
+            session = self._sessions.pop(cert, None)
+            http_clients = self._http_clients.pop(cert, None)
+
+        if session is not None:
+            session.close()
+        if http_clients is not None:
+            http_client, wsdl_client = http_clients
+            wsdl_client.close()
+            # O descarte pode vir de outra thread (ex.: carga de certificado);
+            # o fechamento é agendado no loop que usa o client, depois do
+            # timeout de operação para não interromper requisições em andamento
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(
+                    loop.call_later, self.operation_timeout,
+                    lambda: loop.create_task(http_client.aclose()))
+
+    def close(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    async def aclose(self) -> None:
+        self.close()
+        self._async_clients.clear()
+        http_clients, self._http_clients = self._http_clients, {}
+        for http_client, wsdl_client in http_clients.values():
+            await http_client.aclose()
+            wsdl_client.close()
+
+    def _get_valid(self, key, clients=None) -> Optional[SEFAZSoapClient]:
+        entry = (self._clients if clients is None else clients).get(key)
+        if entry is None:
+            return None
+        client, created_at = entry
+        if time.monotonic() - created_at > self.ttl:
+            return None
+        return client
+
+    def _get_session(self, cert: Optional[CertPair]) -> Session:
+        with self._lock:
+            session = self._sessions.get(cert)
+            if session is None:
+                session = Session()
+                session.verify = self.verify_ssl
+                if cert:
+                    session.cert = cert
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[cert] = session
+            return session
+
+
+# Instância global compartilhada por todos os envios do processo
+default_soap_client_registry = SoapClientRegistry()
@@ -1,3 +1,4 @@
+from .webhook_client import WebhookClient, default_webhook_client
 from .webhook_notifier import WebhookNotifier
 
-__all__ = ["WebhookNotifier"]
+__all__ = ["WebhookClient", "WebhookNotifier", "default_webhook_client"]
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+# Pool compartilhado por todas as notificações do processo
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+WEBHOOK_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_KEEPALIVE_CONNECTIONS", "50"))
+WEBHOOK_KEEPALIVE_EXPIRY = float(os.getenv("WEBHOOK_KEEPALIVE_EXPIRY", "30"))
+# Requisições simultâneas para um mesmo host de cliente
+WEBHOOK_MAX_CONNECTIONS_PER_HOST = int(os.getenv("WEBHOOK_MAX_CONNECTIONS_PER_HOST", "10"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_HTTP2 = os.getenv("WEBHOOK_HTTP2", "1") == "1"
+
+
+class WebhookClient:
+    """`httpx.AsyncClient` de longa duração para os webhooks dos clientes.
+
+    As conexões (e o handshake TLS) são reaproveitadas entre notificações;
+    com HTTP/2, várias notificações para o mesmo host compartilham uma
+    conexão. Um semáforo por host impede que um cliente lento ocupe todo o
+    pool.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+        max_keepalive_connections: int = WEBHOOK_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = WEBHOOK_KEEPALIVE_EXPIRY,
+        max_connections_per_host: int = WEBHOOK_MAX_CONNECTIONS_PER_HOST,
+        timeout: float = WEBHOOK_TIMEOUT,
+        http2: bool = WEBHOOK_HTTP2,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, http2=self.http2)
+        return self._client
+
+    async def post(self, url: str, content: bytes, headers: Mapping[str, str]) -> httpx.Response:
+        """Envia `content` exatamente como recebido (os bytes assinados)"""
+        async with self._host_limit(url):
+            resp = await self.client.post(url, content=content, headers=headers)
+        resp.raise_for_status()
+        return resp
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return limit
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+default_webhook_client = WebhookClient()
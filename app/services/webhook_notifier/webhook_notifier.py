@@ -4,45 +4,66 @@ import hmac
 import hashlib
 from datetime import datetime, timezone
 import httpx
-from app.common.patterns.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, retry_with_circuit_breaker, ExponentialBackoff
+from urllib.parse import urlsplit
+from app.common.patterns.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, circuit_breakers
+from app.common.patterns.retry import RetryPolicy
+from app.infra.webhook_outbox import WEBHOOK_OUTBOX_MAX_TENTATIVAS, SQLiteWebhookOutbox, get_webhook_outbox
+from app.services.webhook_notifier.webhook_client import WebhookClient, default_webhook_client
 import logging
-from typing import Optional
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+# URLs que aceitam vários eventos em uma requisição (corpo JSON em lista),
+# além das que o cliente marcar com `webhook_batch` no payload
+WEBHOOK_BATCH_URLS = {url.strip() for url in os.getenv("WEBHOOK_BATCH_URLS", "").split(",") if url.strip()}
+
+
 class WebhookNotifier:
-    """Notifica clientes via webhook"""
+    """Notifica clientes via webhook.
+
+    `notificar` apenas grava o evento no outbox; a entrega (`entregar`) é
+    feita pelo `WebhookDispatcher`, fora do workflow da NF-e. Os eventos
+    chegam do banco pelo `WebhookRelay`.
+    """
     
-    def __init__(self):
-        self.circuit_breaker = CircuitBreaker(
-            CircuitBreakerConfig(failure_threshold=5)
-        )
-        self.backoff = ExponentialBackoff(
-            initial_delay=1.0, max_delay=10.0, max_attemps=4, jitter=True
+    def __init__(self, client: WebhookClient = None, outbox: SQLiteWebhookOutbox = None):
+        self.client = client or default_webhook_client
+        self.outbox = outbox or get_webhook_outbox()
+        self.circuit_breaker_config = CircuitBreakerConfig(failure_threshold=5)
+        self.retry_policy = RetryPolicy(
+            initial_delay=1.0, max_delay=300.0, max_attempts=WEBHOOK_OUTBOX_MAX_TENTATIVAS, jitter=True
         )
     
     async def notificar(self, record: dict, status: str) -> None:
-        """Envia notificação para o webhook do cliente"""
+        """Registra a notificação do novo status para entrega pelo dispatcher"""
         url = self._extrair_webhook_url(record)
         
         if not url:
             logger.debug("Nenhuma URL de webhook configurada; skip")
             return
         
-        body = self._construir_payload(record, status)
-        
-        async def operation():
-            return await self._enviar_webhook(url, body)
-        
         try:
-            await retry_with_circuit_breaker(
-                operation, 
-                self.circuit_breaker, 
-                self.backoff
+            await self.outbox.adicionar(
+                str(record.get("id")),
+                url,
+                status,
+                self._construir_payload(record, status),
+                lote=self._aceita_lote(record, url),
             )
         except Exception as e:
-            logger.exception("Falha ao notificar webhook: %s", e)
+            raise Exception(f"Falha ao registrar webhook no outbox: {e}")
+    
+    async def entregar(self, url: str, body) -> httpx.Response:
+        """Envia um evento (dict) ou um lote de eventos (list) para o webhook"""
+        # Serializa e assina uma vez; o corpo enviado é exatamente o assinado
+        payload_bytes, signature = self._assinar(body)
+        return await self._enviar_webhook(url, payload_bytes, signature)
+    
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        # Um breaker por host: um cliente fora do ar não afeta os demais
+        return circuit_breakers.get(f"webhook:{urlsplit(url).netloc}", self.circuit_breaker_config)
     
     def _extrair_webhook_url(self, record: dict) -> Optional[str]:
         """Extrai URL do webhook do registro ou variável de ambiente"""
@@ -57,6 +78,14 @@ class WebhookNotifier:
         
         return os.getenv("CLIENT_WEBHOOK_URL")
     
+    def _aceita_lote(self, record: dict, url: str) -> bool:
+        payload_envio = record.get("payload_envio") or {}
+        client_info = payload_envio.get("client") if isinstance(
+            payload_envio, dict) else None
+        if isinstance(client_info, dict) and client_info.get("webhook_url") == url:
+            return bool(client_info.get("webhook_batch"))
+        return url in WEBHOOK_BATCH_URLS
+    
     def _construir_payload(self, record: dict, status: str) -> dict:
         """Constrói o payload da notificação"""
         return {
@@ -66,24 +95,25 @@ class WebhookNotifier:
             "updated_at": datetime.now(timezone.utc).isoformat(),
         }
     
-    async def _enviar_webhook(self, url: str, body: dict) -> httpx.Response:
+    def _assinar(self, body) -> Tuple[bytes, str]:
+        """Serializa o payload e calcula a assinatura HMAC dos bytes"""
+        secret = os.getenv("CLIENT_WEBHOOK_SECRET", "default-secret")
+        payload_bytes = json.dumps(
+            body, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+        signature = hmac.new(
+            secret.encode(), payload_bytes, hashlib.sha256
+        ).hexdigest()
+        return payload_bytes, signature
+
+    async def _enviar_webhook(self, url: str, payload_bytes: bytes, signature: str) -> httpx.Response:
         """Envia requisição HTTP para o webhook"""
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            secret = os.getenv("CLIENT_WEBHOOK_SECRET", "default-secret")
-            payload_bytes = json.dumps(
-                body, separators=(",", ":"), ensure_ascii=False
-            ).encode("utf-8")
-            signature = hmac.new(
-                secret.encode(), payload_bytes, hashlib.sha256
-            ).hexdigest()
-            
-            resp = await client.post(
-                url, 
-                json=body, 
-                headers={
-                    "Content-Type": "application/json",
-                    "x-webhook-signature": signature
-                }
-            )
-            resp.raise_for_status()
-            return resp
+        # O corpo enviado é exatamente o que foi assinado
+        return await self.client.post(
+            url,
+            content=payload_bytes,
+            headers={
+                "Content-Type": "application/json",
+                "x-webhook-signature": signature
+            }
+        )
@@ -4,6 +4,22 @@ class WSDLProvider:
         "RJ": "http://localhost:8080/ws/NFeAutorizacao4.asmx?wsdl",
     }
 
+    RET_AUTORIZACAO_WSDL_URLS = {
+        "SP": "http://localhost:8080/ws/NFeRetAutorizacao4.asmx?wsdl",
+        "RJ": "http://localhost:8080/ws/NFeRetAutorizacao4.asmx?wsdl",
+    }
+
+    CONSULTA_PROTOCOLO_WSDL_URLS = {
+        "SP": "http://localhost:8080/ws/NFeConsultaProtocolo4.asmx?wsdl",
+        "RJ": "http://localhost:8080/ws/NFeConsultaProtocolo4.asmx?wsdl",
+    }
+
     def get(self, uf: str) -> str:
         print("WSDLProvider.get called with uf:", uf)
-        return self.WSDL_URLS.get(uf, "")
\ No newline at end of file
+        return self.WSDL_URLS.get(uf, "")
+
+    def get_ret_autorizacao(self, uf: str) -> str:
+        return self.RET_AUTORIZACAO_WSDL_URLS.get(uf, "")
+
+    def get_consulta_protocolo(self, uf: str) -> str:
+        return self.CONSULTA_PROTOCOLO_WSDL_URLS.get(uf, "")
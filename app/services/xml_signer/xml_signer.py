@@ -1,3 +1,17 @@
+import asyncio
+from typing import List
+
+
 class XMLSigner:
     def sign(self, xml: str) -> str:
         raise NotImplementedError
+
+    def sign_many(self, xmls: List[str]) -> List[str]:
+        return [self.sign(xml) for xml in xmls]
+
+    async def sign_async(self, xml: str) -> str:
+        """Assina fora do event loop; implementações podem usar outro executor"""
+        return await asyncio.to_thread(self.sign, xml)
+
+    async def sign_many_async(self, xmls: List[str]) -> List[str]:
+        return await asyncio.to_thread(self.sign_many, xmls)
@@ -1,6 +1,15 @@
+from typing import List
+
 from app.services.xml_signer.xml_signer import XMLSigner
 
 
 class XMLSignerMock(XMLSigner):
     def sign(self, xml: str) -> str:
         return xml
+
+    # Sem custo de CPU: não vale a troca de thread das versões padrão
+    async def sign_async(self, xml: str) -> str:
+        return xml
+
+    async def sign_many_async(self, xmls: List[str]) -> List[str]:
+        return list(xmls)
@@ -1,26 +1,131 @@
-import xml.etree.ElementTree as ET
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
 from cryptography.hazmat.primitives.serialization import pkcs12
-from signxml import XMLSigner as Signer
+from lxml import etree
+from signxml import XMLSigner as Signer, methods
+
 from app.services.xml_signer.xml_signer import XMLSigner
 
+# Canonicalização exigida pelo leiaute da NF-e
+C14N_2001 = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+
+
+class _NFeSigner(Signer):
+    # O leiaute da NF-e exige RSA-SHA1, que o signxml bloqueia por padrão
+    def check_deprecated_methods(self):
+        pass
+
+
 class XMLSignerReal(XMLSigner):
     def __init__(self, pfx_path: str, password: str):
         self.pfx_path = pfx_path
         self.password = password
+        self._lock = threading.Lock()
+        self._cached: Optional[Tuple[tuple, object, object]] = None
+
+    def load_key_and_certificate(self):
+        """Carrega o PFX uma vez e recarrega apenas quando o arquivo muda"""
+        stat = os.stat(self.pfx_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        with self._lock:
+            cached = self._cached
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+
+            with open(self.pfx_path, "rb") as f:
+                pfx = f.read()
+
+            key, cert, _ = pkcs12.load_key_and_certificates(
+                pfx, self.password.encode()
+            )
+            self._cached = (version, key, cert)
+            return key, cert
 
     def sign(self, xml: str) -> str:
-        with open(self.pfx_path, "rb") as f:
-            pfx = f.read()
+        key, cert = self.load_key_and_certificate()
+
+        root = etree.fromstring(xml.encode("utf-8"))
+        inf_nfe = root.find(".//{http://www.portalfiscal.inf.br/nfe}infNFe")
+        reference_uri = f"#{inf_nfe.get('Id')}" if inf_nfe is not None and inf_nfe.get("Id") else None
+
+        signed = _NFeSigner(
+            method=methods.enveloped,
+            signature_algorithm="rsa-sha1",
+            digest_algorithm="sha1",
+            c14n_algorithm=C14N_2001,
+        ).sign(root, key=key, cert=[cert], reference_uri=reference_uri)
+
+        return etree.tostring(signed, encoding="unicode")
+
 
-        key, cert, _ = pkcs12.load_key_and_certificates(
-            pfx, self.password.encode()
+# ==========================
+# Assinatura em processos separados
+# ==========================
+_worker_signer: Optional[XMLSignerReal] = None
+
+
+def _init_worker(pfx_path: str, password: str) -> None:
+    global _worker_signer
+    _worker_signer = XMLSignerReal(pfx_path, password)
+
+
+def _sign_in_worker(xml: str) -> str:
+    return _worker_signer.sign(xml)
+
+
+def _sign_many_in_worker(xmls: List[str]) -> List[str]:
+    return [_worker_signer.sign(xml) for xml in xmls]
+
+
+class ProcessPoolXMLSigner(XMLSigner):
+    """Distribui a canonicalização e a assinatura RSA entre vários processos.
+
+    Cada processo carrega o certificado uma única vez (no initializer) e
+    mantém o cache de `XMLSignerReal`, então o custo por assinatura é só a
+    CPU da assinatura em si.
+    """
+
+    def __init__(self, pfx_path: str, password: str, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(pfx_path, password),
         )
 
-        root = ET.fromstring(xml)
+    def sign(self, xml: str) -> str:
+        return self._executor.submit(_sign_in_worker, xml).result()
+
+    def sign_many(self, xmls: List[str]) -> List[str]:
+        return [signed for chunk in self._executor.map(_sign_many_in_worker, self._chunks(xmls)) for signed in chunk]
+
+    async def sign_async(self, xml: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _sign_in_worker, xml)
+
+    async def sign_many_async(self, xmls: List[str]) -> List[str]:
+        loop = asyncio.get_running_loop()
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _sign_many_in_worker, chunk)
+            for chunk in self._chunks(xmls)
+        ))
+        return [signed for chunk in chunks for signed in chunk]
 
-        signed = Signer(
-            method="rsa-sha1",
-            digest_algorithm="sha1"
-        ).sign(root, key=key, cert=cert)
+    def _chunks(self, xmls: List[str]) -> List[List[str]]:
+        # Um bloco por processo reduz a serialização entre processos
+        tamanho = max(1, -(-len(xmls) // self.max_workers))
+        return [xmls[i:i + tamanho] for i in range(0, len(xmls), tamanho)]
 
-        return ET.tostring(signed, encoding="unicode")
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
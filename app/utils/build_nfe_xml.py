@@ -1,123 +1,247 @@
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+import re
 from datetime import date
-from typing import Union
-from app.models.nfe import NFe
+from typing import AsyncIterable, AsyncIterator, Optional, Union
 
+from lxml import etree
 
-def build_nfe_xml(nfe: NFe) -> str:
-    def add(parent, tag, value):
-        el = SubElement(parent, tag)
-        el.text = str(value)
-        return el
+from app.models.nfe import NFe, NFeCabecalho
+from app.models.nfe_item import NFeItem
+from app.utils.chave_acesso import CODIGOS_UF, MODELO_NFE, TIPO_EMISSAO_NORMAL, gerar_chave_acesso
+from app.utils.validar_nfe import erros_item_nfe, erros_totais_nfe
 
-    def format_date(d: Union[date, str]):
-        if isinstance(d, date):
-            return d.isoformat()
-        return d
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+NFE_ID_PLACEHOLDER = "NFe00000000000000000000000000000000000000000000"
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+_XML_DECLARATION_RE = re.compile(r"^\s*<\?xml[^>]*\?>\s*")
 
-    nfe_el = Element("NFe", xmlns="http://www.portalfiscal.inf.br/nfe")
-    inf_nfe = SubElement(nfe_el, "infNFe", versao="4.00", Id="NFe00000000000000000000000000000000000000000000")
 
-    ide = SubElement(inf_nfe, "ide")
-    add(ide, "natOp", nfe.natureza_operacao)
-    add(ide, "mod", 55)
-    add(ide, "tpNF", nfe.tipo_documento)
-    add(ide, "finNFe", nfe.finalidade_emissao)
-    add(ide, "dhEmi", format_date(nfe.data_emissao))
-    add(ide, "dhSaiEnt", format_date(nfe.data_entrada_saida))
+def _q(tag: str) -> str:
+    return f"{{{NFE_NS}}}{tag}"
 
-    emit = SubElement(inf_nfe, "emit")
+
+def _element(tag: str, **attrs) -> etree._Element:
+    return etree.Element(_q(tag), attrs, nsmap={None: NFE_NS})
+
+
+def _sub(parent, tag: str, **attrs) -> etree._Element:
+    return etree.SubElement(parent, _q(tag), attrs)
+
+
+def _add(parent, tag, value):
+    el = etree.SubElement(parent, _q(tag))
+    el.text = str(value)
+    return el
+
+
+def _format_date(d: Union[date, str]):
+    if isinstance(d, date):
+        return d.isoformat()
+    return d
+
+
+def _id_nfe(chave: Optional[str]) -> str:
+    return f"NFe{chave}" if chave else NFE_ID_PLACEHOLDER
+
+
+def _build_ide(nfe: NFeCabecalho, chave: Optional[str]) -> etree._Element:
+    ide = _element("ide")
+    if chave:
+        _add(ide, "cUF", CODIGOS_UF[nfe.uf_emitente])
+        _add(ide, "cNF", chave[35:43])
+    _add(ide, "natOp", nfe.natureza_operacao)
+    _add(ide, "mod", MODELO_NFE)
+    if chave:
+        _add(ide, "serie", nfe.serie)
+        _add(ide, "nNF", nfe.numero_nota)
+    _add(ide, "tpNF", nfe.tipo_documento)
+    _add(ide, "finNFe", nfe.finalidade_emissao)
+    _add(ide, "dhEmi", _format_date(nfe.data_emissao))
+    _add(ide, "dhSaiEnt", _format_date(nfe.data_entrada_saida))
+    if chave:
+        _add(ide, "tpEmis", TIPO_EMISSAO_NORMAL)
+        _add(ide, "cDV", chave[43])
+    return ide
+
+
+def _build_emit(nfe: NFeCabecalho) -> etree._Element:
+    emit = _element("emit")
 
     if nfe.cnpj_emitente:
-        add(emit, "CNPJ", nfe.cnpj_emitente)
+        _add(emit, "CNPJ", nfe.cnpj_emitente)
     else:
-        add(emit, "CPF", nfe.cpf_emitente)
+        _add(emit, "CPF", nfe.cpf_emitente)
 
-    add(emit, "xNome", nfe.nome_emitente)
+    _add(emit, "xNome", nfe.nome_emitente)
 
     if nfe.nome_fantasia_emitente:
-        add(emit, "xFant", nfe.nome_fantasia_emitente)
+        _add(emit, "xFant", nfe.nome_fantasia_emitente)
 
-    ender_emit = SubElement(emit, "enderEmit")
-    add(ender_emit, "xLgr", nfe.logradouro_emitente)
-    add(ender_emit, "nro", nfe.numero_emitente)
-    add(ender_emit, "xBairro", nfe.bairro_emitente)
-    add(ender_emit, "xMun", nfe.municipio_emitente)
-    add(ender_emit, "UF", nfe.uf_emitente)
-    add(ender_emit, "CEP", nfe.cep_emitente)
+    ender_emit = _sub(emit, "enderEmit")
+    _add(ender_emit, "xLgr", nfe.logradouro_emitente)
+    _add(ender_emit, "nro", nfe.numero_emitente)
+    _add(ender_emit, "xBairro", nfe.bairro_emitente)
+    _add(ender_emit, "xMun", nfe.municipio_emitente)
+    _add(ender_emit, "UF", nfe.uf_emitente)
+    _add(ender_emit, "CEP", nfe.cep_emitente)
 
     if nfe.inscricao_estadual_emitente:
-        add(emit, "IE", nfe.inscricao_estadual_emitente)
+        _add(emit, "IE", nfe.inscricao_estadual_emitente)
+
+    return emit
+
 
-    dest = SubElement(inf_nfe, "dest")
+def _build_dest(nfe: NFeCabecalho) -> etree._Element:
+    dest = _element("dest")
 
     if nfe.cnpj_destinatario:
-        add(dest, "CNPJ", nfe.cnpj_destinatario)
+        _add(dest, "CNPJ", nfe.cnpj_destinatario)
     else:
-        add(dest, "CPF", nfe.cpf_destinatario)
+        _add(dest, "CPF", nfe.cpf_destinatario)
 
-    add(dest, "xNome", nfe.nome_destinatario)
+    _add(dest, "xNome", nfe.nome_destinatario)
 
     if nfe.inscricao_estadual_destinatario:
-        add(dest, "IE", nfe.inscricao_estadual_destinatario)
+        _add(dest, "IE", nfe.inscricao_estadual_destinatario)
 
-    ender_dest = SubElement(dest, "enderDest")
-    add(ender_dest, "xLgr", nfe.logradouro_destinatario)
-    add(ender_dest, "nro", nfe.numero_destinatario)
-    add(ender_dest, "xBairro", nfe.bairro_destinatario)
-    add(ender_dest, "xMun", nfe.municipio_destinatario)
-    add(ender_dest, "UF", nfe.uf_destinatario)
-    add(ender_dest, "xPais", nfe.pais_destinatario)
-    add(ender_dest, "CEP", nfe.cep_destinatario)
+    ender_dest = _sub(dest, "enderDest")
+    _add(ender_dest, "xLgr", nfe.logradouro_destinatario)
+    _add(ender_dest, "nro", nfe.numero_destinatario)
+    _add(ender_dest, "xBairro", nfe.bairro_destinatario)
+    _add(ender_dest, "xMun", nfe.municipio_destinatario)
+    _add(ender_dest, "UF", nfe.uf_destinatario)
+    _add(ender_dest, "xPais", nfe.pais_destinatario)
+    _add(ender_dest, "CEP", nfe.cep_destinatario)
 
     if nfe.telefone_destinatario:
-        add(ender_dest, "fone", nfe.telefone_destinatario)
+        _add(ender_dest, "fone", nfe.telefone_destinatario)
+
+    return dest
+
+
+def _build_det(item: NFeItem) -> etree._Element:
+    det = _element("det", nItem=str(item.numero_item))
+
+    prod = _sub(det, "prod")
+    _add(prod, "cProd", item.codigo_produto)
+    _add(prod, "xProd", item.descricao)
+    _add(prod, "NCM", item.codigo_ncm)
+    _add(prod, "CFOP", item.cfop)
+
+    _add(prod, "uCom", item.unidade_comercial)
+    _add(prod, "qCom", f"{item.quantidade_comercial:.4f}")
+    _add(prod, "vUnCom", f"{item.valor_unitario_comercial:.4f}")
+    _add(prod, "vProd", f"{item.valor_bruto:.2f}")
+
+    _add(prod, "uTrib", item.unidade_tributavel)
+    _add(prod, "qTrib", f"{item.quantidade_tributavel:.4f}")
+    _add(prod, "vUnTrib", f"{item.valor_unitario_tributavel:.4f}")
+
+    imposto = _sub(det, "imposto")
+
+    icms = _sub(imposto, "ICMS")
+    icms00 = _sub(icms, "ICMS00")
+    _add(icms00, "orig", item.icms_origem)
+    _add(icms00, "CST", item.icms_situacao_tributaria)
+
+    pis = _sub(imposto, "PIS")
+    pis_nt = _sub(pis, "PISNT")
+    _add(pis_nt, "CST", item.pis_situacao_tributaria)
+
+    cofins = _sub(imposto, "COFINS")
+    cofins_nt = _sub(cofins, "COFINSNT")
+    _add(cofins_nt, "CST", item.cofins_situacao_tributaria)
+
+    return det
+
+
+def _build_total(nfe: NFeCabecalho) -> etree._Element:
+    total = _element("total")
+    icms_tot = _sub(total, "ICMSTot")
+
+    _add(icms_tot, "vProd", f"{nfe.valor_produtos:.2f}")
+    _add(icms_tot, "vFrete", f"{nfe.valor_frete:.2f}")
+    _add(icms_tot, "vSeg", f"{nfe.valor_seguro:.2f}")
+    _add(icms_tot, "vNF", f"{nfe.valor_total:.2f}")
+    return total
+
+
+def _build_transp(nfe: NFeCabecalho) -> etree._Element:
+    transp = _element("transp")
+    _add(transp, "modFrete", nfe.modalidade_frete)
+    return transp
+
+
+def build_nfe_xml(nfe: NFe, pretty: bool = False) -> str:
+    """Gera o XML da NF-e em uma única serialização.
+
+    A saída é compacta por padrão; `pretty=True` indenta com dois espaços.
+    O Id do `infNFe` leva a chave de acesso quando a NF-e tem `numero_nota`;
+    sem ele, sai o Id provisório.
+    """
+    chave = gerar_chave_acesso(nfe)
+    nfe_el = _element("NFe")
+    inf_nfe = _sub(nfe_el, "infNFe", versao="4.00", Id=_id_nfe(chave))
+
+    inf_nfe.append(_build_ide(nfe, chave))
+    inf_nfe.append(_build_emit(nfe))
+    inf_nfe.append(_build_dest(nfe))
 
     for item in nfe.items:
-        det = SubElement(inf_nfe, "det", nItem=str(item.numero_item))
+        inf_nfe.append(_build_det(item))
+
+    inf_nfe.append(_build_total(nfe))
+    inf_nfe.append(_build_transp(nfe))
+
+    return XML_DECLARATION + etree.tostring(nfe_el, encoding="unicode", pretty_print=pretty)
+
 
-        prod = SubElement(det, "prod")
-        add(prod, "cProd", item.codigo_produto)
-        add(prod, "xProd", item.descricao)
-        add(prod, "NCM", item.codigo_ncm)
-        add(prod, "CFOP", item.cfop)
+def montar_nfe_proc(xml_assinado: str, prot_nfe: str) -> str:
+    """Monta o nfeProc (NF-e assinada + protocolo de autorização) distribuído ao destinatário"""
+    nfe = _XML_DECLARATION_RE.sub("", xml_assinado)
+    prot = _XML_DECLARATION_RE.sub("", prot_nfe)
+    return f'{XML_DECLARATION}<nfeProc xmlns="{NFE_NS}" versao="4.00">{nfe}{prot}</nfeProc>'
 
-        add(prod, "uCom", item.unidade_comercial)
-        add(prod, "qCom", f"{item.quantidade_comercial:.4f}")
-        add(prod, "vUnCom", f"{item.valor_unitario_comercial:.4f}")
-        add(prod, "vProd", f"{item.valor_bruto:.2f}")
 
-        add(prod, "uTrib", item.unidade_tributavel)
-        add(prod, "qTrib", f"{item.quantidade_tributavel:.4f}")
-        add(prod, "vUnTrib", f"{item.valor_unitario_tributavel:.4f}")
+def _fragmento(el: etree._Element) -> bytes:
+    # Serializado isoladamente, o elemento repete o xmlns que já foi declarado em <NFe>
+    return etree.tostring(el, encoding="unicode").replace(f' xmlns="{NFE_NS}"', "", 1).encode("utf-8")
 
-        imposto = SubElement(det, "imposto")
 
-        icms = SubElement(imposto, "ICMS")
-        icms00 = SubElement(icms, "ICMS00")
-        add(icms00, "orig", item.icms_origem)
-        add(icms00, "CST", item.icms_situacao_tributaria)
+async def stream_nfe_xml(cabecalho: NFeCabecalho, itens: AsyncIterable[NFeItem]) -> AsyncIterator[bytes]:
+    """Gera o XML (compacto) da NF-e em pedaços, um `det` por vez.
 
-        pis = SubElement(imposto, "PIS")
-        pis_nt = SubElement(pis, "PISNT")
-        add(pis_nt, "CST", item.pis_situacao_tributaria)
+    Produz o mesmo documento que `build_nfe_xml`, mas os itens são validados
+    conforme chegam e descartados depois de serializados, então o uso de
+    memória não depende da quantidade de itens. Um item inválido ou totais
+    inconsistentes interrompem o stream com `ValueError`; como parte do XML
+    já pode ter sido enviada, o cliente recebe uma resposta truncada.
+    """
+    chave = gerar_chave_acesso(cabecalho)
+    yield (
+        XML_DECLARATION
+        + f'<NFe xmlns="{NFE_NS}"><infNFe versao="4.00" Id="{_id_nfe(chave)}">'
+    ).encode("utf-8") + b"".join((
+        _fragmento(_build_ide(cabecalho, chave)),
+        _fragmento(_build_emit(cabecalho)),
+        _fragmento(_build_dest(cabecalho)),
+    ))
 
-        cofins = SubElement(imposto, "COFINS")
-        cofins_nt = SubElement(cofins, "COFINSNT")
-        add(cofins_nt, "CST", item.cofins_situacao_tributaria)
-    total = SubElement(inf_nfe, "total")
-    icms_tot = SubElement(total, "ICMSTot")
+    quantidade = 0
+    soma_itens = 0.0
 
-    add(icms_tot, "vProd", f"{nfe.valor_produtos:.2f}")
-    add(icms_tot, "vFrete", f"{nfe.valor_frete:.2f}")
-    add(icms_tot, "vSeg", f"{nfe.valor_seguro:.2f}")
-    add(icms_tot, "vNF", f"{nfe.valor_total:.2f}")
+    async for item in itens:
+        erros = erros_item_nfe(item)
+        if erros:
+            raise ValueError(" | ".join(erros))
 
-    transp = SubElement(inf_nfe, "transp")
-    add(transp, "modFrete", nfe.modalidade_frete)
+        quantidade += 1
+        soma_itens += item.valor_bruto
+        yield _fragmento(_build_det(item))
 
-    rough_xml = tostring(nfe_el, encoding="utf-8")
-    reparsed = minidom.parseString(rough_xml)
+    erros = erros_totais_nfe(cabecalho, soma_itens)
+    if not quantidade:
+        erros.insert(0, "NF-e deve possuir ao menos um item")
+    if erros:
+        raise ValueError(" | ".join(erros))
 
-    return reparsed.toprettyxml(indent="  ", encoding="utf-8").decode("utf-8")
\ No newline at end of file
+    yield _fragmento(_build_total(cabecalho)) + _fragmento(_build_transp(cabecalho)) + b"</infNFe></NFe>"
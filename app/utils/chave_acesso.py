@@ -0,0 +1,57 @@
+import hashlib
+from typing import Optional
+
+from app.models.nfe import NFeCabecalho
+from app.utils.somente_numeros import somente_numeros
+
+# Código IBGE da UF (cUF)
+CODIGOS_UF = {
+    "RO": 11, "AC": 12, "AM": 13, "RR": 14, "PA": 15, "AP": 16, "TO": 17,
+    "MA": 21, "PI": 22, "CE": 23, "RN": 24, "PB": 25, "PE": 26, "AL": 27,
+    "SE": 28, "BA": 29, "MG": 31, "ES": 32, "RJ": 33, "SP": 35, "PR": 41,
+    "SC": 42, "RS": 43, "MS": 50, "MT": 51, "GO": 52, "DF": 53,
+}
+
+MODELO_NFE = 55
+# Emissão normal
+TIPO_EMISSAO_NORMAL = 1
+
+
+def digito_verificador(chave: str) -> int:
+    """Módulo 11 sobre as 43 primeiras posições, pesos 2 a 9 da direita para a esquerda"""
+    soma = sum(int(d) * (2 + i % 8) for i, d in enumerate(reversed(chave)))
+    resto = soma % 11
+    return 0 if resto < 2 else 11 - resto
+
+
+def codigo_numerico(documento: str, serie: int, numero: int) -> str:
+    """cNF de 8 dígitos derivado do emitente, série e número.
+
+    É determinístico para que a NF-e reconstruída em uma nova tentativa
+    tenha a mesma chave da que talvez já tenha chegado à SEFAZ.
+    """
+    resumo = hashlib.sha256(f"{documento}:{serie}:{numero}".encode("utf-8")).digest()
+    cnf = int.from_bytes(resumo[:8], "big") % 10 ** 8
+    # O cNF não pode repetir o nNF
+    if cnf == numero % 10 ** 8:
+        cnf = (cnf + 1) % 10 ** 8
+    return f"{cnf:08d}"
+
+
+def gerar_chave_acesso(nfe: NFeCabecalho) -> Optional[str]:
+    """Chave de acesso de 44 dígitos; None enquanto a NF-e não tiver número"""
+    if nfe.numero_nota is None:
+        return None
+
+    documento = somente_numeros(nfe.cnpj_emitente or nfe.cpf_emitente or "")
+    chave = (
+        f"{CODIGOS_UF[nfe.uf_emitente]:02d}"
+        f"{nfe.data_emissao:%y%m}"
+        f"{documento:0>14}"
+        f"{MODELO_NFE:02d}"
+        f"{nfe.serie:03d}"
+        f"{nfe.numero_nota:09d}"
+        f"{TIPO_EMISSAO_NORMAL}"
+        f"{codigo_numerico(documento, nfe.serie, nfe.numero_nota)}"
+    )
+    return chave + str(digito_verificador(chave))
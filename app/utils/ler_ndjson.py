@@ -0,0 +1,17 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator
+
+
+async def ler_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """Decodifica um corpo NDJSON (um JSON por linha) à medida que os bytes chegam"""
+    buffer = b""
+
+    async for chunk in chunks:
+        buffer += chunk
+        *linhas, buffer = buffer.split(b"\n")
+        for linha in linhas:
+            if linha.strip():
+                yield json.loads(linha)
+
+    if buffer.strip():
+        yield json.loads(buffer)
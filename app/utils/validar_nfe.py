@@ -1,4 +1,7 @@
-from app.models.nfe import NFe
+from typing import List
+
+from app.models.nfe import NFe, NFeCabecalho
+from app.models.nfe_item import NFeItem
 from math import isclose
 from app.utils.validar_cnpj import validar_cnpj
 from app.utils.validar_cpf import validar_cpf
@@ -7,7 +10,7 @@ from app.utils.ufc_validas import UFS_VALIDAS
 from app.utils.validar_datas import validar_datas
 
 
-def validar_nfe(nfe: NFe) -> None:
+def erros_cabecalho_nfe(nfe: NFeCabecalho) -> List[str]:
     erros = []
 
     if not nfe.cnpj_emitente and not nfe.cpf_emitente:
@@ -27,6 +30,12 @@ def validar_nfe(nfe: NFe) -> None:
     if nfe.uf_emitente not in UFS_VALIDAS:
         erros.append("UF do emitente inválida")
 
+    if not 0 <= nfe.serie <= 999:
+        erros.append("Série inválida")
+
+    if nfe.numero_nota is not None and not 1 <= nfe.numero_nota <= 999999999:
+        erros.append("Número da NF-e inválido")
+
     if not nfe.cnpj_destinatario and not nfe.cpf_destinatario:
         erros.append("Destinatário deve possuir CNPJ ou CPF")
 
@@ -50,33 +59,37 @@ def validar_nfe(nfe: NFe) -> None:
     if not validar_datas(nfe.data_emissao, nfe.data_entrada_saida):
         erros.append("Data de entrada/saída não pode ser anterior à emissão")
 
-    if not nfe.items or len(nfe.items) == 0:
-        erros.append("NF-e deve possuir ao menos um item")
+    return erros
 
-    soma_itens = 0.0
 
-    for item in nfe.items:
-        if item.quantidade_comercial <= 0:
-            erros.append(f"Item {item.numero_item}: quantidade inválida")
+def erros_item_nfe(item: NFeItem) -> List[str]:
+    erros = []
 
-        if item.valor_unitario_comercial <= 0:
-            erros.append(f"Item {item.numero_item}: valor unitário inválido")
+    if item.quantidade_comercial <= 0:
+        erros.append(f"Item {item.numero_item}: quantidade inválida")
 
-        if len(str(item.cfop)) != 4:
-            erros.append(f"Item {item.numero_item}: CFOP inválido")
+    if item.valor_unitario_comercial <= 0:
+        erros.append(f"Item {item.numero_item}: valor unitário inválido")
 
-        if len(str(item.codigo_ncm)) != 8:
-            erros.append(f"Item {item.numero_item}: NCM inválido")
+    if len(str(item.cfop)) != 4:
+        erros.append(f"Item {item.numero_item}: CFOP inválido")
 
-        valor_calculado = item.quantidade_comercial * item.valor_unitario_comercial
+    if len(str(item.codigo_ncm)) != 8:
+        erros.append(f"Item {item.numero_item}: NCM inválido")
 
-        if not isclose(valor_calculado, item.valor_bruto, rel_tol=1e-2):
-            erros.append(
-                f"Item {item.numero_item}: valor bruto inconsistente "
-                f"(esperado {valor_calculado:.2f}, informado {item.valor_bruto:.2f})"
-            )
+    valor_calculado = item.quantidade_comercial * item.valor_unitario_comercial
 
-        soma_itens += item.valor_bruto
+    if not isclose(valor_calculado, item.valor_bruto, rel_tol=1e-2):
+        erros.append(
+            f"Item {item.numero_item}: valor bruto inconsistente "
+            f"(esperado {valor_calculado:.2f}, informado {item.valor_bruto:.2f})"
+        )
+
+    return erros
+
+
+def erros_totais_nfe(nfe: NFeCabecalho, soma_itens: float) -> List[str]:
+    erros = []
 
     if not isclose(soma_itens, nfe.valor_produtos, rel_tol=1e-2):
         erros.append(
@@ -96,5 +109,22 @@ def validar_nfe(nfe: NFe) -> None:
             f"(esperado {valor_total_calculado:.2f}, informado {nfe.valor_total:.2f})"
         )
 
+    return erros
+
+
+def validar_nfe(nfe: NFe) -> None:
+    erros = erros_cabecalho_nfe(nfe)
+
+    if not nfe.items or len(nfe.items) == 0:
+        erros.append("NF-e deve possuir ao menos um item")
+
+    soma_itens = 0.0
+
+    for item in nfe.items:
+        erros.extend(erros_item_nfe(item))
+        soma_itens += item.valor_bruto
+
+    erros.extend(erros_totais_nfe(nfe, soma_itens))
+
     if erros:
         raise ValueError(" | ".join(erros))
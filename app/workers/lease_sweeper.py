@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import os
+
+from app.infra.work_queue import NFE_QUEUE_MAX_TENTATIVAS
+
+logger = logging.getLogger(__name__)
+
+NFE_LEASE_SWEEP_INTERVAL = float(os.getenv("NFE_LEASE_SWEEP_INTERVAL", "30"))
+
+
+class LeaseSweeper:
+    """Recupera NF-e presas em PROCESSANDO por um worker que caiu.
+
+    A cada `intervalo`, registros com lease vencido voltam para CRIADA (e
+    são reivindicados de novo) ou vão para ERRO depois de `max_tentativas`
+    claims. Pode rodar em todos os workers: a varredura usa SKIP LOCKED.
+    """
+
+    def __init__(
+        self,
+        nfe_service,
+        max_tentativas: int = NFE_QUEUE_MAX_TENTATIVAS,
+        intervalo: float = NFE_LEASE_SWEEP_INTERVAL,
+    ):
+        self.nfe_service = nfe_service
+        self.max_tentativas = max_tentativas
+        self.intervalo = intervalo
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.executar_ciclo()
+            except Exception:
+                logger.exception("Falha na varredura de leases de NF-e")
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    async def executar_ciclo(self) -> int:
+        varridos = await self.nfe_service.sweep_leases(self.max_tentativas)
+        if varridos:
+            logger.warning("%s NF-e com lease vencido devolvidas para processamento", varridos)
+        return varridos
@@ -0,0 +1,40 @@
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Dict, Optional
+
+from app.models.nfe import NFe
+
+
+@dataclass
+class NFeContexto:
+    """Estado de uma NF-e ao longo de um workflow.
+
+    O `payload_envio` é validado no modelo `NFe` uma única vez e o XML
+    gerado/assinado fica guardado para as etapas seguintes. Quando o
+    registro já traz o XML (gerado por `/nfe/json-para-xml` ou assinado em
+    um processamento anterior), ele é reaproveitado em vez de refeito.
+    """
+
+    record_id: str
+    record: Dict[str, Any]
+    xml: Optional[str] = None
+    xml_assinado: Optional[str] = None
+
+    @classmethod
+    def do_registro(cls, record: Dict[str, Any]) -> "NFeContexto":
+        return cls(
+            record_id=str(record["id"]),
+            record=record,
+            xml=record.get("xml"),
+            xml_assinado=record.get("xml_assinado"),
+        )
+
+    @cached_property
+    def nfe(self) -> NFe:
+        return NFe(**(self.record.get("payload_envio") or {}))
+
+    def campos_novos(self) -> Dict[str, Any]:
+        """Colunas produzidas neste workflow que o registro ainda não tem"""
+        if self.xml_assinado and self.xml_assinado != self.record.get("xml_assinado"):
+            return {"xml_assinado": self.xml_assinado}
+        return {}
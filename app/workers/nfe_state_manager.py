@@ -3,55 +3,41 @@ from typing import Optional
 
 import logging
 
-from app.enums.nfe_status import StatusNFe
+from app.services.nfe.nfe_state_machine import NFeStateMachine
+from app.workers.nfe_contexto import NFeContexto
 
 logger = logging.getLogger(__name__)
 
 class NFeStateManager:
-    """Gerencia transições de estado da NF-e"""
+    """Gerencia transições de estado da NF-e.
+
+    Os webhooks de cada transição são gravados pelo banco, na mesma
+    transação do UPDATE (trigger de `nfe_webhook_eventos`).
+    """
     
-    def __init__(self, nfe_service, webhook_notifier):
+    def __init__(self, nfe_service, state_machine: Optional[NFeStateMachine] = None):
         self.nfe_service = nfe_service
-        self.webhook_notifier = webhook_notifier
+        self.state_machine = state_machine or NFeStateMachine(nfe_service)
     
-    async def preparar_processamento(self, record_id: str) -> Optional[dict]:
+    async def preparar_processamento(self, record_id: str, retomada: bool = False) -> Optional[dict]:
         """Valida e prepara o registro para processamento"""
-        record = await self.nfe_service.get_by_id(record_id)
+        # CRIADA -> PROCESSANDO em um único UPDATE, que também serve de lock
+        record = await self.state_machine.iniciar_processamento(record_id, retomada)
         
         if not record:
-            logger.warning("Registro NF-e não encontrado: %s", record_id)
-            return None
-        
-        current_status = record.get("status")
-        
-        # Validar se pode ser processado
-        if current_status not in (StatusNFe.CRIADA.value, StatusNFe.PROCESSANDO.value):
-            logger.info("Registro %s com status %s - não será processado", 
-                       record_id, current_status)
+            logger.info("Registro %s inexistente, já em processamento ou finalizado; skipping",
+                        record_id)
             return None
         
-        # Tentar adquirir lock
-        updated = await self.nfe_service.update_status(
-            record_id,
-            StatusNFe.PROCESSANDO.value,
-            expected_current_status=StatusNFe.CRIADA.value,
-        )
-        
-        if not updated:
-            logger.info("Registro %s já está sendo processado; skipping", record_id)
-            return None
-        
-        # Notificar início do processamento
-        await self.webhook_notifier.notificar(record, StatusNFe.PROCESSANDO.value)
-        
         return record
     
-    async def marcar_erro(self, record_id: str, erro: Exception) -> None:
-        """Marca o registro como erro"""
+    async def marcar_erro(self, record_id: str, erro: Exception,
+                          contexto: Optional[NFeContexto] = None) -> None:
+        """Marca o registro como erro, gravando o XML já assinado pelo workflow"""
         try:
-            await self.nfe_service.mark_error(record_id, erro)
-            record = await self.nfe_service.get_by_id(record_id)
-            if record:
-                await self.webhook_notifier.notificar(record, StatusNFe.ERRO.value)
+            record = await self.state_machine.marcar_erro(
+                record_id, erro, contexto.campos_novos() if contexto else None)
+            if not record:
+                logger.info("Registro %s já finalizado; erro não registrado: %s", record_id, erro)
         except Exception:
             logger.exception("Falha ao marcar erro para %s", record_id)
@@ -2,6 +2,10 @@ from dataclasses import dataclass
 from typing import Optional
 import logging
 
+from app.common.patterns.retry import NonRetryableError, is_retryable
+from app.core.sefaz import CSTAT_DUPLICIDADE
+from app.workers.nfe_contexto import NFeContexto
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -13,6 +17,10 @@ class ProcessamentoResult:
     erro: Optional[Exception] = None
 
 
+class DuplicidadeSemProtocoloError(NonRetryableError):
+    """SEFAZ rejeitou por duplicidade (cStat 204), mas o protocolo da chave não foi encontrado"""
+
+
 class NFeWorkflowOrchestrator:
     """Orquestra o fluxo completo de processamento da NF-e"""
 
@@ -32,23 +40,60 @@ class NFeWorkflowOrchestrator:
         self.webhook_notifier = webhook_notifier
         self.result_processor = result_processor
 
-    async def processar(self, record_id: str) -> None:
-        """Executa o workflow completo de processamento"""
+    async def processar(self, record_id: str, retomada: bool = False,
+                        ultima_tentativa: bool = True) -> None:
+        """Executa o workflow completo de processamento.
+
+        Erros transitórios são propagados para que a fila entregue o job de
+        novo (com `retomada=True`, que aceita o registro ainda em
+        PROCESSANDO); erros definitivos, ou na `ultima_tentativa`, levam o
+        registro para ERRO. Uma retomada pode já ter sido enviada (e até
+        autorizada) antes da falha, então o protocolo é consultado pela chave
+        antes de reenviar.
+        """
+        contexto = None
         try:
             # 1. Validar e preparar processamento
-            record = await self.state_manager.preparar_processamento(record_id)
+            record = await self.state_manager.preparar_processamento(record_id, retomada)
             if not record:
                 return
 
-            # 2. Construir XML
-            xml_str = self.xml_builder.build(record)
+            # Modelo e XML compartilhados pelas etapas seguintes
+            contexto = NFeContexto.do_registro(record)
 
-            # 3. Enviar para SEFAZ
-            result = await self.sefaz_sender.enviar(xml_str, record)
+            # 2. Construir e assinar XML (reaproveitados se já estão no registro)
+            if contexto.xml_assinado is None:
+                self.xml_builder.build(contexto)
+                await self.sefaz_sender.assinar(contexto)
+
+            # 3. Enviar para SEFAZ, a menos que a retomada já tenha resultado lá
+            result = None
+            if retomada:
+                result = await self.sefaz_sender.consultar_protocolo(contexto)
+            if result is None:
+                result = await self.sefaz_sender.enviar(contexto)
+                if result.get("codigo") == CSTAT_DUPLICIDADE:
+                    result = await self._resultado_da_duplicidade(contexto, result)
 
             # 4. Processar resultado
-            await self.result_processor.processar(record_id, record, result)
+            await self.result_processor.processar(record_id, result, contexto)
 
         except Exception as e:
+            if is_retryable(e) and not ultima_tentativa:
+                logger.warning("Erro transitório no workflow para %s; o job será reentregue: %s",
+                               record_id, e)
+                raise
             logger.exception("Erro no workflow para %s: %s", record_id, e)
-            await self.state_manager.marcar_erro(record_id, e)
+            await self.state_manager.marcar_erro(record_id, e, contexto)
+
+    async def _resultado_da_duplicidade(self, contexto: NFeContexto, rejeicao: dict) -> dict:
+        """Duplicidade significa que a chave já foi recebida: vale o protocolo dela.
+
+        Sem o protocolo, a NF-e vai para ERRO em vez de REJEITADA, porque a
+        nota pode ter sido autorizada.
+        """
+        result = await self.sefaz_sender.consultar_protocolo(contexto)
+        if result is None:
+            raise DuplicidadeSemProtocoloError(
+                f"Duplicidade de NF-e sem protocolo localizado: {rejeicao.get('mensagem')}")
+        return result
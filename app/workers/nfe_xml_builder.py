@@ -1,11 +1,11 @@
-from app.models.nfe import NFe
 from app.utils.build_nfe_xml import build_nfe_xml
+from app.workers.nfe_contexto import NFeContexto
 
 
 class NFeXMLBuilder:
     """Constrói o XML da NF-e"""
 
-    def build(self, record: dict) -> str:
-        payload_envio = record.get("payload_envio") or {}
-        nfe = NFe(**payload_envio)
-        return build_nfe_xml(nfe)
+    def build(self, contexto: NFeContexto) -> str:
+        if contexto.xml is None:
+            contexto.xml = build_nfe_xml(contexto.nfe)
+        return contexto.xml
@@ -10,16 +10,15 @@ from app.workers.nfe_workflow_orchestrator import NFeWorkflowOrchestrator
 logger = logging.getLogger(__name__)
 
 
-async def processar_nfe_worker(record_id: str, nfe_service) -> None:
-    """Worker principal - apenas orquestra o processamento"""
-    
+def criar_orquestrador(nfe_service) -> NFeWorkflowOrchestrator:
+    """Monta o workflow com os componentes padrão"""
     webhook_notifier = WebhookNotifier()
-    state_manager = NFeStateManager(nfe_service, webhook_notifier)
+    state_manager = NFeStateManager(nfe_service)
     xml_builder = NFeXMLBuilder()
     sefaz_sender = SefazSender()
-    result_processor = ResultProcessor(nfe_service, webhook_notifier)
+    result_processor = ResultProcessor(nfe_service)
 
-    orchestrator = NFeWorkflowOrchestrator(
+    return NFeWorkflowOrchestrator(
         nfe_service=nfe_service,
         state_manager=state_manager,
         xml_builder=xml_builder,
@@ -28,10 +27,17 @@ async def processar_nfe_worker(record_id: str, nfe_service) -> None:
         result_processor=result_processor
     )
 
+
+async def processar_nfe_worker(record_id: str, nfe_service) -> None:
+    """Worker principal - apenas orquestra o processamento"""
+
+    orchestrator = criar_orquestrador(nfe_service)
+
     try:
         # Executar workflow
         await orchestrator.processar(record_id)
     except Exception as e:
         logger.exception(f"Erro no processamento da NFe {record_id}: {e}")
-        await state_manager.update_nfe_status(record_id, 'ERRO')
-        raise
\ No newline at end of file
+        await orchestrator.state_manager.marcar_erro(record_id, e)
+        raise
+
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from typing import Dict
+
+from app.infra.work_queue import Job, SQLiteWorkQueue, NFE_QUEUE_PATH
+from app.infra.nfe_lease_queue import SupabaseLeaseQueue
+from app.infra.recibo_store import get_recibo_store
+from app.workers.lease_sweeper import LeaseSweeper
+from app.workers.processar_nfe_worker import criar_orquestrador
+from app.workers.recibo_scheduler import ReciboPollingScheduler
+from app.workers.webhook_dispatcher import WebhookDispatcher
+from app.workers.webhook_relay import WebhookRelay
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv("NFE_WORKER_CONCURRENCY", "10"))
+WORKER_VISIBILITY_TIMEOUT = float(os.getenv("NFE_WORKER_VISIBILITY_TIMEOUT", "120"))
+WORKER_POLL_INTERVAL = float(os.getenv("NFE_WORKER_POLL_INTERVAL", "1.0"))
+WORKER_DRAIN_TIMEOUT = float(os.getenv("NFE_WORKER_DRAIN_TIMEOUT", "60"))
+# "sqlite": fila local alimentada pela API; "supabase": registros CRIADA
+# reivindicados direto da tabela nfe por lease (vários hosts)
+WORKER_FONTE = os.getenv("NFE_WORKER_FONTE", "sqlite")
+
+
+class NFeQueueWorker:
+    """Consome a fila persistente executando até `concurrency` workflows ao mesmo tempo"""
+
+    def __init__(
+        self,
+        queue: SQLiteWorkQueue,
+        orchestrator,
+        concurrency: int = WORKER_CONCURRENCY,
+        visibility_timeout: float = WORKER_VISIBILITY_TIMEOUT,
+        poll_interval: float = WORKER_POLL_INTERVAL,
+        drain_timeout: float = WORKER_DRAIN_TIMEOUT,
+    ):
+        self.queue = queue
+        self.orchestrator = orchestrator
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self._stopping = asyncio.Event()
+        self._in_flight: Dict[asyncio.Task, Job] = {}
+
+    def stop(self) -> None:
+        """Para de retirar jobs; os que estão em execução são drenados por `run`"""
+        self._stopping.set()
+
+    async def run(self) -> None:
+        logger.info("Worker iniciado (concorrência=%s)", self.concurrency)
+
+        while not self._stopping.is_set():
+            livres = self.concurrency - len(self._in_flight)
+
+            jobs = []
+            if livres > 0:
+                try:
+                    jobs = await self.queue.claim(livres, self.visibility_timeout)
+                except Exception:
+                    logger.exception("Falha ao retirar jobs da fila")
+
+            for job in jobs:
+                task = asyncio.create_task(self._executar(job))
+                self._in_flight[task] = job
+                task.add_done_callback(self._in_flight.pop)
+
+            if jobs and len(jobs) == livres:
+                continue
+
+            # Espera um job terminar, novos jobs chegarem ou o pedido de parada
+            aguardando = set(self._in_flight) | {asyncio.create_task(self._stopping.wait())}
+            _, pendentes = await asyncio.wait(
+                aguardando,
+                timeout=self.poll_interval,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in pendentes - set(self._in_flight):
+                task.cancel()
+
+        await self._drenar()
+
+    async def _drenar(self) -> None:
+        if not self._in_flight:
+            return
+
+        logger.info("Drenando %s job(s) em execução", len(self._in_flight))
+        jobs = dict(self._in_flight)
+        _, pendentes = await asyncio.wait(set(jobs), timeout=self.drain_timeout)
+
+        for task in pendentes:
+            task.cancel()
+        # Os jobs cancelados terminam antes do nack e do fechamento da fila
+        await asyncio.gather(*pendentes, return_exceptions=True)
+
+        for task in pendentes:
+            # Devolve imediatamente para outro worker em vez de esperar o lease vencer
+            await self.queue.nack(jobs[task].id, "worker encerrado durante o processamento")
+
+    async def _executar(self, job: Job) -> None:
+        heartbeat = asyncio.create_task(self._renovar_lease(job))
+
+        try:
+            await self.orchestrator.processar(
+                job.record_id,
+                retomada=job.tentativas > 1,
+                ultima_tentativa=job.tentativas >= self.queue.max_tentativas,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Erro ao processar job %s (NF-e %s)", job.id, job.record_id)
+            await self.queue.nack(job.id, str(e), delay=min(2 ** job.tentativas, 300))
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self.queue.ack(job.id)
+
+    async def _renovar_lease(self, job: Job) -> None:
+        intervalo = self.visibility_timeout / 3
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.queue.extend(job.id, self.visibility_timeout)
+            except Exception:
+                logger.exception("Falha ao renovar lease do job %s", job.id)
+
+
+async def main(args: argparse.Namespace) -> None:
+    from app.infra.supabase_client import close_async_supabase_client, get_async_supabase_client
+    from app.services.nfe.cached_nfe_service import CachedNFeService
+    from app.services.nfe.nfe import NFeService
+    from app.services.nfe.nfe_write_batcher import NFeWriteBatcher
+
+    supabase_nfe_service = NFeService(get_async_supabase_client())
+    tarefas = []
+    if args.fonte == "supabase":
+        queue = SupabaseLeaseQueue(supabase_nfe_service)
+        tarefas.append(LeaseSweeper(supabase_nfe_service))
+        logger.info("Consumindo a tabela nfe com lease (owner=%s)", queue.owner)
+    else:
+        queue = SQLiteWorkQueue(args.queue_path)
+    # As atualizações dos workflows simultâneos seguem em lotes (group commit); o cache
+    # atende as releituras do registro que o próprio worker acabou de gravar
+    write_batcher = NFeWriteBatcher(supabase_nfe_service)
+    nfe_service = CachedNFeService(write_batcher)
+    orchestrator = criar_orquestrador(nfe_service)
+    worker = NFeQueueWorker(
+        queue,
+        orchestrator,
+        concurrency=args.concurrency,
+        visibility_timeout=args.visibility_timeout,
+        drain_timeout=args.drain_timeout,
+    )
+    # Recibos de lotes assíncronos são consultados no mesmo processo, sem ocupar slots do worker
+    scheduler = ReciboPollingScheduler(
+        orchestrator.sefaz_sender.sefaz_api,
+        get_recibo_store(),
+        nfe_service,
+        orchestrator.result_processor,
+    )
+    # Webhooks gravados pelo banco junto com cada status passam pelo outbox
+    # local e são entregues por aqui, sem segurar os jobs
+    webhook_notifier = orchestrator.webhook_notifier
+    relay = WebhookRelay(supabase_nfe_service, webhook_notifier)
+    dispatcher = WebhookDispatcher(webhook_notifier.outbox, webhook_notifier)
+    tarefas = [worker, scheduler, relay, dispatcher, *tarefas]
+
+    def stop():
+        for tarefa in tarefas:
+            tarefa.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop)
+
+    try:
+        await asyncio.gather(*(tarefa.run() for tarefa in tarefas))
+    finally:
+        queue.close()
+        webhook_notifier.outbox.close()
+        await write_batcher.aclose()
+        sefaz_api = orchestrator.sefaz_sender.sefaz_api
+        if sefaz_api.certificate_registry is not None:
+            # Remove os PEM temporários dos certificados
+            sefaz_api.certificate_registry.close()
+        await sefaz_api.client_registry.aclose()
+        await webhook_notifier.client.aclose()
+        await close_async_supabase_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de processamento de NF-e")
+    parser.add_argument("--fonte", choices=("sqlite", "supabase"), default=WORKER_FONTE)
+    parser.add_argument("--queue-path", default=NFE_QUEUE_PATH)
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--visibility-timeout", type=float, default=WORKER_VISIBILITY_TIMEOUT)
+    parser.add_argument("--drain-timeout", type=float, default=WORKER_DRAIN_TIMEOUT)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from app.core.sefaz import SefazAPI
+from app.infra.recibo_store import ReciboPendente, SQLiteReciboStore
+
+logger = logging.getLogger(__name__)
+
+SEFAZ_RECIBO_INTERVALO_MINIMO = float(os.getenv("SEFAZ_RECIBO_INTERVALO_MINIMO", "1.0"))
+SEFAZ_RECIBO_INTERVALO_MAXIMO = float(os.getenv("SEFAZ_RECIBO_INTERVALO_MAXIMO", "60"))
+SEFAZ_RECIBO_MAX_CONSULTAS = int(os.getenv("SEFAZ_RECIBO_MAX_CONSULTAS", "30"))
+# Consultas simultâneas por autorizador
+SEFAZ_RECIBO_CONCORRENCIA = int(os.getenv("SEFAZ_RECIBO_CONCORRENCIA", "5"))
+SEFAZ_RECIBO_TICK = float(os.getenv("SEFAZ_RECIBO_TICK", "0.5"))
+
+
+def proxima_consulta(tempo_medio, tentativas: int) -> float:
+    """Horário da próxima consulta: respeita o tMed da SEFAZ e cresce a cada 105 recebido"""
+    base = max(tempo_medio or 0, SEFAZ_RECIBO_INTERVALO_MINIMO)
+    return time.time() + min(base * (2 ** tentativas), SEFAZ_RECIBO_INTERVALO_MAXIMO)
+
+
+class ReciboPollingScheduler:
+    """Consulta recibos de lotes assíncronos (NFeRetAutorizacao4) fora dos workers.
+
+    A cada ciclo os recibos vencidos são agrupados por UF e consultados com
+    concorrência limitada por autorizador. Quando o lote termina, o resultado
+    de cada NF-e segue para o `ResultProcessor`, que move o registro de
+    PROCESSANDO para o status final.
+    """
+
+    def __init__(
+        self,
+        sefaz_api: SefazAPI,
+        recibo_store: SQLiteReciboStore,
+        nfe_service,
+        result_processor,
+        concorrencia: int = SEFAZ_RECIBO_CONCORRENCIA,
+        tick: float = SEFAZ_RECIBO_TICK,
+    ):
+        self.sefaz_api = sefaz_api
+        self.recibo_store = recibo_store
+        self.nfe_service = nfe_service
+        self.result_processor = result_processor
+        self.concorrencia = concorrencia
+        self.tick = tick
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.executar_ciclo()
+            except Exception:
+                logger.exception("Falha no ciclo de consulta de recibos")
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+    async def executar_ciclo(self) -> int:
+        pendentes = await self.recibo_store.vencidos(limite=self.concorrencia * 20)
+
+        por_uf: Dict[str, List[ReciboPendente]] = defaultdict(list)
+        for pendente in pendentes:
+            por_uf[pendente.uf].append(pendente)
+
+        await asyncio.gather(*(
+            self._consultar_autorizador(recibos) for recibos in por_uf.values()
+        ))
+        return len(pendentes)
+
+    async def _consultar_autorizador(self, recibos: List[ReciboPendente]) -> None:
+        semaforo = asyncio.Semaphore(self.concorrencia)
+
+        async def consultar(pendente: ReciboPendente) -> None:
+            async with semaforo:
+                await self._consultar(pendente)
+
+        await asyncio.gather(*(consultar(pendente) for pendente in recibos))
+
+    async def _consultar(self, pendente: ReciboPendente) -> None:
+        chaves = [item.chave_nfe for item in pendente.itens]
+
+        try:
+            resultados = await self.sefaz_api.consultar_recibo_async(
+                pendente.recibo, pendente.uf, chaves, pendente.cnpj)
+        except Exception as e:
+            logger.warning("Falha ao consultar recibo %s: %s", pendente.recibo, e)
+            resultados = None
+            erro = e
+        else:
+            erro = None
+
+        if resultados is None:
+            if pendente.tentativas + 1 >= SEFAZ_RECIBO_MAX_CONSULTAS:
+                await self._desistir(pendente, erro)
+                return
+            await self.recibo_store.reagendar(
+                pendente.recibo,
+                proxima_consulta(pendente.tempo_medio, pendente.tentativas + 1),
+            )
+            return
+
+        for item, resultado in zip(pendente.itens, resultados):
+            try:
+                if resultado is None:
+                    await self.result_processor.marcar_erro(
+                        item.record_id,
+                        f"Protocolo da NF-e ausente no retorno do recibo {pendente.recibo}")
+                    continue
+                await self.result_processor.processar(
+                    item.record_id, resultado, xml_assinado=item.xml_assinado)
+            except Exception:
+                logger.exception("Falha ao aplicar resultado do recibo %s para %s",
+                                 pendente.recibo, item.record_id)
+
+        await self.recibo_store.remover(pendente.recibo)
+
+    async def _desistir(self, pendente: ReciboPendente, erro) -> None:
+        logger.error("Recibo %s sem resposta após %s consultas",
+                     pendente.recibo, pendente.tentativas + 1)
+
+        for item in pendente.itens:
+            try:
+                await self.result_processor.marcar_erro(
+                    item.record_id,
+                    erro or f"Lote {pendente.recibo} ainda em processamento na SEFAZ")
+            except Exception:
+                logger.exception("Falha ao marcar erro para %s", item.record_id)
+
+        await self.recibo_store.remover(pendente.recibo)
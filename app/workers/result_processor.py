@@ -1,29 +1,106 @@
-from datetime import datetime, timezone
+import logging
+from typing import Optional
+
 from app.enums.nfe_status import StatusNFe
+from app.infra.recibo_store import ReciboItem, get_recibo_store
+from app.infra.xml_storage import get_xml_storage
+from app.services.nfe.nfe_state_machine import NFeStateMachine
+from app.utils.build_nfe_xml import montar_nfe_proc
+from app.workers.nfe_contexto import NFeContexto
+from app.workers.recibo_scheduler import proxima_consulta
+
+logger = logging.getLogger(__name__)
 
 class ResultProcessor:
     """Processa o resultado da SEFAZ e atualiza o registro"""
     
-    def __init__(self, nfe_service, webhook_notifier):
+    def __init__(self, nfe_service, recibo_store=None, state_machine=None, xml_storage=None):
         self.nfe_service = nfe_service
-        self.webhook_notifier = webhook_notifier
+        self.recibo_store = recibo_store or get_recibo_store()
+        self.state_machine = state_machine or NFeStateMachine(nfe_service)
+        self.xml_storage = xml_storage or get_xml_storage()
     
-    async def processar(self, record_id: str, record: dict, sefaz_result: dict) -> None:
-        """Processa resultado da SEFAZ e atualiza registro"""
+    async def processar(self, record_id: str, sefaz_result: dict,
+                        contexto: Optional[NFeContexto] = None,
+                        xml_assinado: Optional[str] = None) -> None:
+        """Processa resultado da SEFAZ e atualiza registro.
+
+        Com o `contexto` do workflow, o XML assinado nesta execução é gravado
+        na mesma atualização de status. O documento (nfeProc, se autorizada)
+        vai para o `XMLStorage` e a URL para `xml_url`. Sem contexto (consulta
+        de recibo), `xml_assinado` é o XML guardado com o recibo.
+        """
+        campos = contexto.campos_novos() if contexto else {}
+        if contexto:
+            xml_assinado = contexto.xml_assinado
+
+        # Lote assíncrono: o resultado final virá da consulta do recibo
+        if isinstance(sefaz_result, dict) and \
+           sefaz_result.get("status") == StatusNFe.PROCESSANDO.value:
+            campos.update(await self._arquivar_xml(record_id, sefaz_result, xml_assinado))
+            await self._registrar_recibo(record_id, sefaz_result, campos, xml_assinado)
+            return
+
         # Determinar novo status
         novo_status = self._determinar_status(sefaz_result)
         
-        # Construir payload de atualização
-        update_payload = self._construir_update_payload(sefaz_result, novo_status)
-        
-        # Atualizar registro
-        await self.nfe_service.update(record_id, update_payload)
-        
-        # Atualizar record local para notificação
-        record.update(update_payload)
-        
-        # Notificar cliente
-        await self.webhook_notifier.notificar(record, novo_status)
+        # PROCESSANDO -> status final; o webhook é gravado pelo banco na mesma transação
+        record = await self.state_machine.finalizar(record_id, novo_status, {
+            **campos,
+            **self._construir_update_payload(sefaz_result),
+            **await self._arquivar_xml(record_id, sefaz_result, xml_assinado),
+        })
+        if not record:
+            logger.warning("Registro %s não está mais em PROCESSANDO; resultado %s ignorado",
+                           record_id, novo_status)
+    
+    async def marcar_erro(self, record_id: str, erro) -> None:
+        """Registro sem resultado da SEFAZ: PROCESSANDO -> ERRO"""
+        await self.state_machine.marcar_erro(record_id, erro)
+    
+    async def _arquivar_xml(self, record_id: str, sefaz_result: dict,
+                            xml_assinado: Optional[str]) -> dict:
+        """Grava o XML assinado, ou o nfeProc quando autorizada, e devolve o `xml_url`.
+
+        Uma falha no storage não impede o registro do resultado da SEFAZ:
+        o status é gravado sem `xml_url`.
+        """
+        prot_nfe = sefaz_result.get("prot_nfe") if isinstance(sefaz_result, dict) else None
+
+        try:
+            if xml_assinado is None:
+                if not prot_nfe:
+                    return {}
+                # Recibos gravados antes de o XML ir junto com o item: lê do registro
+                record = await self.nfe_service.get_by_id(record_id)
+                xml_assinado = record.get("xml_assinado") if record else None
+                if not xml_assinado:
+                    return {}
+
+            documento = montar_nfe_proc(xml_assinado, prot_nfe) if prot_nfe else xml_assinado
+            return {"xml_url": await self.xml_storage.salvar(documento)}
+        except Exception:
+            logger.exception("Falha ao arquivar XML da NF-e %s", record_id)
+            return {}
+
+    async def _registrar_recibo(self, record_id: str, sefaz_result: dict, campos: dict,
+                                xml_assinado: Optional[str]) -> None:
+        """Guarda o recibo para o ReciboPollingScheduler e mantém o registro em PROCESSANDO"""
+        await self.recibo_store.adicionar(
+            sefaz_result["recibo"],
+            sefaz_result["uf"],
+            ReciboItem(
+                record_id=record_id,
+                posicao=sefaz_result.get("posicao", 0),
+                chave_nfe=sefaz_result.get("chave_nfe"),
+                xml_assinado=xml_assinado,
+            ),
+            sefaz_result.get("tempo_medio"),
+            proxima_consulta(sefaz_result.get("tempo_medio"), 0),
+            cnpj=sefaz_result.get("cnpj"),
+        )
+
+        await self.state_machine.registrar_retorno(record_id, sefaz_result, campos)
     
     def _determinar_status(self, sefaz_result: dict) -> str:
         """Determina o novo status baseado no resultado da SEFAZ"""
@@ -32,12 +109,10 @@ class ResultProcessor:
             return StatusNFe.AUTORIZADA.value
         return StatusNFe.REJEITADA.value
     
-    def _construir_update_payload(self, sefaz_result: dict, novo_status: str) -> dict:
-        """Constrói o payload de atualização do registro"""
+    def _construir_update_payload(self, sefaz_result: dict) -> dict:
+        """Constrói os campos gravados junto com o status final"""
         update_payload = {
-            "status": novo_status,
             "payload_retorno": sefaz_result,
-            "atualizado_em": datetime.now(timezone.utc).isoformat(),
         }
         
         # Copiar campos adicionais se existirem
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.sefaz import ProtocoloAusenteError, SefazAPI, chave_do_xml
+
+logger = logging.getLogger(__name__)
+
+# A SEFAZ aceita até 50 NF-e e 500 KB por lote (enviNFe)
+SEFAZ_LOTE_MAX_DOCUMENTOS = int(os.getenv("SEFAZ_LOTE_MAX_DOCUMENTOS", "50"))
+SEFAZ_LOTE_MAX_BYTES = int(os.getenv("SEFAZ_LOTE_MAX_BYTES", "500000"))
+# Tempo máximo que uma NF-e espera o lote encher antes do envio
+SEFAZ_LOTE_MAX_WAIT = float(os.getenv("SEFAZ_LOTE_MAX_WAIT", "0.2"))
+
+
+class _LotePendente:
+    def __init__(self):
+        self.itens: List[Tuple[str, asyncio.Future]] = []
+        self.tamanho = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class SefazLoteAggregator:
+    """Agrupa NF-e de workflows concorrentes em lotes enviNFe por UF e emitente.
+
+    Cada chamada a `enviar` aguarda o resultado da sua própria NF-e; o lote
+    é enviado quando atinge `max_documentos`/`max_bytes` ou quando a NF-e
+    mais antiga espera `max_wait` segundos.
+
+    Lotes recebidos para processamento assíncrono devolvem `status=PROCESSANDO`
+    com o recibo; a consulta fica a cargo do `ReciboPollingScheduler`.
+
+    O retorno é associado a cada NF-e pela chave de acesso, então uma NF-e
+    sem chave (payload sem `numero_nota`, ver `build_nfe_xml`) vai sozinha
+    em um lote próprio.
+    """
+
+    def __init__(
+        self,
+        sefaz_api: SefazAPI,
+        max_documentos: int = SEFAZ_LOTE_MAX_DOCUMENTOS,
+        max_bytes: int = SEFAZ_LOTE_MAX_BYTES,
+        max_wait: float = SEFAZ_LOTE_MAX_WAIT,
+    ):
+        self.sefaz_api = sefaz_api
+        self.max_documentos = max_documentos
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self._pendentes: Dict[Tuple[str, Optional[str], bool], _LotePendente] = {}
+        self._envios: set = set()
+
+    async def enviar(self, xml: str, uf: str, cnpj: Optional[str] = None,
+                     assinado: bool = False) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tamanho = len(xml.encode("utf-8"))
+        if chave_do_xml(xml) is None:
+            await self._enviar_lote(uf, cnpj, assinado, [(xml, future)])
+            return await future
+
+        # Um lote é assinado e transmitido com o certificado de um único emitente;
+        # XML já assinados não se misturam com os que o lote ainda vai assinar
+        chave = (uf, cnpj, assinado)
+
+        lote = self._pendentes.get(chave)
+        if lote is not None and lote.tamanho + tamanho > self.max_bytes:
+            self._flush(chave)
+            lote = None
+
+        if lote is None:
+            lote = self._pendentes[chave] = _LotePendente()
+            lote.timer = loop.call_later(self.max_wait, self._flush, chave)
+
+        lote.itens.append((xml, future))
+        lote.tamanho += tamanho
+
+        if len(lote.itens) >= self.max_documentos:
+            self._flush(chave)
+
+        return await future
+
+    def _flush(self, chave: Tuple[str, Optional[str], bool]) -> None:
+        lote = self._pendentes.pop(chave, None)
+        if lote is None:
+            return
+
+        if lote.timer is not None:
+            lote.timer.cancel()
+
+        # NF-e cujo workflow foi cancelado enquanto esperava não entram no lote
+        itens = [(xml, future) for xml, future in lote.itens if not future.done()]
+        if not itens:
+            return
+
+        task = asyncio.create_task(self._enviar_lote(*chave, itens))
+        self._envios.add(task)
+        task.add_done_callback(self._envios.discard)
+
+    async def _enviar_lote(self, uf: str, cnpj: Optional[str], assinado: bool,
+                           itens: List[Tuple[str, asyncio.Future]]) -> None:
+        id_lote = str(time.time_ns() // 1000)[-15:]
+        logger.info("Enviando lote %s (%s NF-e) para %s", id_lote, len(itens), uf)
+
+        try:
+            resultados = await self.sefaz_api.send_lote_async(
+                [xml for xml, _ in itens], uf, id_lote, cnpj, assinados=assinado)
+        except Exception as e:
+            for _, future in itens:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), resultado in zip(itens, resultados):
+            if future.done():
+                continue
+            if resultado is None:
+                future.set_exception(ProtocoloAusenteError(
+                    f"Protocolo da NF-e ausente no retorno do lote {id_lote}"))
+            else:
+                future.set_result(resultado)
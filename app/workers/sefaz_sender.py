@@ -1,43 +1,91 @@
-from app.core.sefaz import SefazAPI
-from app.models.nfe import NFe
+from typing import Optional
+
+from app.core.sefaz import SefazAPI, chave_do_xml
+from app.services.certificados import get_certificate_registry
+from app.services.certificados.certificate_registry import CERTIFICADOS_DIR
 from app.services.wsdl_urls.wsdl_urls import WSDLProvider
 from app.services.xml_signer.xml_signer_mock import XMLSignerMock
-from app.common.patterns.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, retry_with_circuit_breaker
-from app.common.patterns.retry import ExponentialBackoff
+from app.common.patterns.circuit_breaker import (
+    CircuitBreaker, CircuitBreakerConfig, circuit_breakers, retry_with_circuit_breaker,
+)
+from app.common.patterns.retry import RetryPolicy
+from app.workers.nfe_contexto import NFeContexto
+from app.workers.sefaz_lote_aggregator import SefazLoteAggregator
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Agregador compartilhado: NF-e de todos os workflows do processo entram nos mesmos lotes
+# Com CERTIFICADOS_DIR configurado, cada emitente usa o próprio certificado A1
+_default_lote_aggregator = SefazLoteAggregator(SefazAPI(
+    XMLSignerMock(),
+    WSDLProvider(),
+    certificate_registry=get_certificate_registry() if CERTIFICADOS_DIR else None,
+))
+
 class SefazSender:
     """Envia NF-e para a SEFAZ"""
     
-    def __init__(self):
-        self.sefaz_api = SefazAPI(XMLSignerMock(), WSDLProvider())
-        self.circuit_breaker = CircuitBreaker(
-            CircuitBreakerConfig(failure_threshold=5)
-        )
-        self.backoff = ExponentialBackoff(
-            initial_delay=1.0, max_delay=10.0, max_attemps=4, jitter=True
+    def __init__(self, lote_aggregator: SefazLoteAggregator = None):
+        self.lote_aggregator = lote_aggregator or _default_lote_aggregator
+        self.sefaz_api = self.lote_aggregator.sefaz_api
+        self.circuit_breaker_config = CircuitBreakerConfig(failure_threshold=5)
+        self.retry_policy = RetryPolicy(
+            initial_delay=1.0, max_delay=10.0, max_attempts=4, jitter=True
         )
     
-    async def enviar(self, xml_str: str, record: dict) -> dict:
-        """Envia XML para SEFAZ com retry e circuit breaker"""
-        payload_envio = record.get("payload_envio") or {}
-        nfe = NFe(**payload_envio)
-        
+    def circuit_breaker(self, uf: str) -> CircuitBreaker:
+        # Um breaker por autorizador: uma SEFAZ fora do ar não bloqueia as demais UFs
+        return circuit_breakers.get(f"sefaz:{uf}", self.circuit_breaker_config)
+
+    async def assinar(self, contexto: NFeContexto) -> str:
+        """Assina o XML do contexto com o certificado do emitente (uma vez por NF-e)"""
+        if contexto.xml_assinado is None:
+            contexto.xml_assinado = await self.sefaz_api.assinar_async(
+                contexto.xml, contexto.nfe.cnpj_emitente)
+        return contexto.xml_assinado
+
+    async def enviar(self, contexto: NFeContexto) -> dict:
+        """Envia o XML assinado do contexto para SEFAZ com retry e circuit breaker"""
+        nfe = contexto.nfe
+        xml_assinado = await self.assinar(contexto)
+
         async def operation():
-            result = self.sefaz_api.send_nfe(xml_str, nfe.uf_emitente)
-            if hasattr(result, "__await__"):
-                return await result
-            return result
-        
+            return await self.lote_aggregator.enviar(
+                xml_assinado, nfe.uf_emitente, nfe.cnpj_emitente, assinado=True)
+
         try:
             return await retry_with_circuit_breaker(
-                operation, 
-                self.circuit_breaker, 
-                self.backoff
+                operation,
+                self.circuit_breaker(nfe.uf_emitente),
+                self.retry_policy
             )
         except Exception as e:
             logger.exception("Erro ao enviar para SEFAZ: %s", e)
-            raise
\ No newline at end of file
+            raise
+
+    async def consultar_protocolo(self, contexto: NFeContexto) -> Optional[dict]:
+        """Resultado já registrado na SEFAZ para a NF-e do contexto, pela chave de acesso.
+
+        None quando a SEFAZ não conhece a NF-e ou o XML não tem chave (Id
+        provisório, payload sem `numero_nota`), caso em que não há como consultar.
+        """
+        chave = chave_do_xml(contexto.xml_assinado or contexto.xml or "")
+        if chave is None:
+            return None
+        nfe = contexto.nfe
+
+        async def operation():
+            return await self.sefaz_api.consultar_protocolo_async(
+                chave, nfe.uf_emitente, nfe.cnpj_emitente)
+
+        try:
+            return await retry_with_circuit_breaker(
+                operation,
+                self.circuit_breaker(nfe.uf_emitente),
+                self.retry_policy
+            )
+        except Exception as e:
+            logger.exception("Erro ao consultar protocolo na SEFAZ: %s", e)
+            raise
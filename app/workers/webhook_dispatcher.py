@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import random
+from collections import defaultdict
+from typing import Dict, List
+
+from app.infra.webhook_outbox import SQLiteWebhookOutbox, WebhookEvento
+from app.services.webhook_notifier.webhook_notifier import WebhookNotifier
+
+logger = logging.getLogger(__name__)
+
+# Requisições simultâneas para uma mesma URL de webhook
+WEBHOOK_DISPATCHER_CONCORRENCIA = int(os.getenv("WEBHOOK_DISPATCHER_CONCORRENCIA", "4"))
+# Eventos por requisição para receptores que aceitam lotes
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_DISPATCHER_TICK = float(os.getenv("WEBHOOK_DISPATCHER_TICK", "0.5"))
+WEBHOOK_DISPATCHER_VISIBILITY_TIMEOUT = float(os.getenv("WEBHOOK_DISPATCHER_VISIBILITY_TIMEOUT", "60"))
+
+
+class WebhookDispatcher:
+    """Entrega os eventos do outbox de webhooks fora do workflow da NF-e.
+
+    A cada ciclo retira até `concorrencia` requisições por URL e entrega
+    cada URL em uma task própria: um cliente lento só atrasa os próprios
+    eventos. Receptores que aceitam lotes recebem até `tamanho_lote`
+    eventos por requisição. Falhas transitórias voltam ao outbox com
+    backoff; rejeições (4xx) e eventos sem tentativas restantes ficam na
+    dead-letter.
+    """
+
+    def __init__(
+        self,
+        outbox: SQLiteWebhookOutbox,
+        notifier: WebhookNotifier,
+        concorrencia: int = WEBHOOK_DISPATCHER_CONCORRENCIA,
+        tamanho_lote: int = WEBHOOK_BATCH_SIZE,
+        tick: float = WEBHOOK_DISPATCHER_TICK,
+        visibility_timeout: float = WEBHOOK_DISPATCHER_VISIBILITY_TIMEOUT,
+    ):
+        self.outbox = outbox
+        self.notifier = notifier
+        self.concorrencia = concorrencia
+        self.tamanho_lote = tamanho_lote
+        self.tick = tick
+        self.visibility_timeout = visibility_timeout
+        self._stopping = asyncio.Event()
+        self._em_entrega: Dict[str, asyncio.Task] = {}
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.executar_ciclo()
+            except Exception:
+                logger.exception("Falha no ciclo de entrega de webhooks")
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+        if self._em_entrega:
+            # Entregas não concluídas voltam ao outbox quando o lease vencer
+            await asyncio.wait(set(self._em_entrega.values()), timeout=self.visibility_timeout)
+
+    async def executar_ciclo(self) -> int:
+        # URLs com entrega em andamento ficam de fora até a task terminar
+        eventos = await self.outbox.claim(
+            self.concorrencia, self.tamanho_lote, self.visibility_timeout,
+            ignorar_urls=self._em_entrega,
+        )
+
+        por_url: Dict[str, List[WebhookEvento]] = defaultdict(list)
+        for evento in eventos:
+            por_url[evento.url].append(evento)
+
+        for url, eventos_url in por_url.items():
+            task = asyncio.create_task(self._entregar_endpoint(url, eventos_url))
+            self._em_entrega[url] = task
+            task.add_done_callback(lambda _, url=url: self._em_entrega.pop(url, None))
+        return len(eventos)
+
+    async def _entregar_endpoint(self, url: str, eventos: List[WebhookEvento]) -> None:
+        avulsos = [evento for evento in eventos if not evento.lote]
+        lote = [evento for evento in eventos if evento.lote]
+
+        requisicoes = [[evento] for evento in avulsos]
+        requisicoes += [lote[i:i + self.tamanho_lote] for i in range(0, len(lote), self.tamanho_lote)]
+
+        await asyncio.gather(*(self._entregar(url, grupo) for grupo in requisicoes))
+
+    async def _entregar(self, url: str, eventos: List[WebhookEvento]) -> None:
+        ids = [evento.id for evento in eventos]
+        cb = self.notifier.circuit_breaker(url)
+
+        if not cb.can_retry():
+            # Não conta tentativa: o cliente está fora do ar, não o evento com problema
+            await self.outbox.adiar(ids, cb.config.reset_timeout.total_seconds())
+            return
+
+        if eventos[0].lote:
+            body = [evento.payload for evento in eventos]
+        else:
+            body = eventos[0].payload
+
+        try:
+            await self.notifier.entregar(url, body)
+        except Exception as e:
+            tentativas = max(evento.tentativas for evento in eventos)
+            if self.notifier.retry_policy.is_retryable(e):
+                cb.record_failure(str(e))
+                await self.outbox.nack(ids, str(e), delay=self._intervalo(tentativas))
+                logger.warning("Falha ao entregar %s evento(s) para %s: %s", len(ids), url, e)
+            else:
+                # A URL respondeu; o evento é que foi recusado
+                cb.record_success()
+                await self.outbox.nack(ids, str(e), definitivo=True)
+                logger.error("Webhook recusado por %s; %s evento(s) na dead-letter: %s", url, len(ids), e)
+            return
+
+        cb.record_success()
+        await self.outbox.ack(ids)
+
+    def _intervalo(self, tentativas: int) -> float:
+        policy = self.notifier.retry_policy
+        delay = min(policy.initial_delay * (2 ** (tentativas - 1)), policy.max_delay)
+        if policy.jitter:
+            delay *= 0.5 + random.random() / 2
+        return delay
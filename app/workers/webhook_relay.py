@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from app.infra.nfe_lease_queue import lease_owner_padrao
+from app.services.webhook_notifier.webhook_notifier import WebhookNotifier
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_RELAY_INTERVAL = float(os.getenv("WEBHOOK_RELAY_INTERVAL", "0.5"))
+WEBHOOK_RELAY_LOTE = int(os.getenv("WEBHOOK_RELAY_LOTE", "200"))
+# Eventos reivindicados e não confirmados voltam para outro relay depois disso
+WEBHOOK_RELAY_LEASE = float(os.getenv("WEBHOOK_RELAY_LEASE", "60"))
+
+
+class WebhookRelay:
+    """Repassa os eventos de `nfe_webhook_eventos` para o outbox local de entrega.
+
+    Os eventos são gravados pelo banco na mesma transação da mudança de
+    status; aqui cada evento vira um `notificar` e só é apagado do banco
+    depois de gravado no outbox. Uma falha no meio deixa os eventos
+    restantes no banco, que voltam quando o lease vence; um evento repassado
+    duas vezes é consolidado pelo outbox (mesmo registro e URL).
+    """
+
+    def __init__(
+        self,
+        nfe_service,
+        notifier: WebhookNotifier,
+        owner: Optional[str] = None,
+        limite: int = WEBHOOK_RELAY_LOTE,
+        lease: float = WEBHOOK_RELAY_LEASE,
+        intervalo: float = WEBHOOK_RELAY_INTERVAL,
+    ):
+        self.nfe_service = nfe_service
+        self.notifier = notifier
+        self.owner = owner or lease_owner_padrao()
+        self.limite = limite
+        self.lease = lease
+        self.intervalo = intervalo
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                repassados = await self.executar_ciclo()
+            except Exception:
+                logger.exception("Falha ao repassar eventos de webhook")
+                repassados = 0
+
+            if repassados >= self.limite:
+                continue  # Há mais eventos esperando
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    async def executar_ciclo(self) -> int:
+        eventos = await self.nfe_service.claim_webhook_events(self.owner, self.limite, self.lease)
+
+        confirmados = []
+        try:
+            # Em ordem de gravação: o outbox descarta um status intermediário atrasado
+            for evento in sorted(eventos, key=lambda e: e["id"]):
+                await self.notifier.notificar(evento["registro"], evento["status"])
+                confirmados.append(evento["id"])
+        finally:
+            if confirmados:
+                await self.nfe_service.ack_webhook_events(self.owner, confirmados)
+
+        return len(confirmados)
@@ -0,0 +1,71 @@
+"""Tempo de geração do XML da NF-e por quantidade de itens.
+
+Compara `build_nfe_xml` (compacto e indentado) com o caminho anterior,
+reproduzido aqui como serialização seguida de minidom.parseString +
+toprettyxml, que dominava o custo da implementação antiga.
+
+    python -m benchmarks.bench_build_nfe_xml [--itens 1 10 100 1000 5000]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from xml.dom import minidom
+
+from app.models.nfe import NFe
+from app.utils.build_nfe_xml import build_nfe_xml
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+
+
+def nfe_com_itens(quantidade: int) -> NFe:
+    """NF-e de exemplo com o primeiro item repetido `quantidade` vezes"""
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+    item = payload["items"][0]
+    payload["items"] = [dict(item, numero_item=i + 1) for i in range(quantidade)]
+
+    valor_produtos = round(sum(i["valor_bruto"] for i in payload["items"]), 2)
+    payload["valor_produtos"] = valor_produtos
+    payload["valor_total"] = round(
+        valor_produtos + (payload.get("valor_frete") or 0) + (payload.get("valor_seguro") or 0), 2)
+    return NFe(**payload)
+
+
+def minidom_legado(nfe: NFe) -> str:
+    return minidom.parseString(build_nfe_xml(nfe).encode("utf-8")).toprettyxml(indent="  ")
+
+
+def medir(func, nfe: NFe, minimo_segundos: float = 0.5) -> float:
+    """Média em ms por chamada, repetindo até somar `minimo_segundos`"""
+    func(nfe)  # aquecimento
+    execucoes = 0
+    inicio = time.perf_counter()
+    while True:
+        func(nfe)
+        execucoes += 1
+        decorrido = time.perf_counter() - inicio
+        if decorrido >= minimo_segundos:
+            return decorrido / execucoes * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--itens", type=int, nargs="+", default=[1, 10, 100, 1000, 5000])
+    parser.add_argument("--segundos", type=float, default=0.5)
+    args = parser.parse_args()
+
+    variantes = [
+        ("minidom", minidom_legado),
+        ("lxml compact", build_nfe_xml),
+        ("lxml pretty", lambda nfe: build_nfe_xml(nfe, pretty=True)),
+    ]
+
+    print(f"{'itens':>6}" + "".join(f"{nome:>15}" for nome, _ in variantes) + "   (ms por XML)")
+    for quantidade in args.itens:
+        nfe = nfe_com_itens(quantidade)
+        tempos = [medir(func, nfe, args.segundos) for _, func in variantes]
+        print(f"{quantidade:>6}" + "".join(f"{t:>15.2f}" for t in tempos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Custo por envio de um client zeep novo contra o SoapClientRegistry.
+
+Sobe um servidor HTTP local que publica um WSDL no formato do
+NFeAutorizacao4 e responde a `nfeAutorizacaoLote` com um retEnviNFe fixo.
+A variante "client novo" reproduz o caminho anterior (baixar e parsear o
+WSDL e abrir uma session a cada envio); a variante "registry" obtém o
+client de um `SoapClientRegistry` compartilhado, como o SefazAPI faz hoje.
+
+    python -m benchmarks.bench_soap_client_registry [--envios 50] [--threads 1 8]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from app.services.sefaz.sefaz_soap_client import SEFAZSoapClient
+from app.services.sefaz.soap_client_registry import SoapClientRegistry
+
+NS_WSDL = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeAutorizacao4"
+
+WSDL = f"""<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap12="http://schemas.xmlsoap.org/wsdl/soap12/"
+    xmlns:s="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{NS_WSDL}" targetNamespace="{NS_WSDL}">
+  <wsdl:types>
+    <s:schema elementFormDefault="qualified" targetNamespace="{NS_WSDL}">
+      <s:element name="nfeDadosMsg" type="s:string"/>
+      <s:element name="nfeResultMsg">
+        <s:complexType mixed="true"><s:sequence><s:any/></s:sequence></s:complexType>
+      </s:element>
+    </s:schema>
+  </wsdl:types>
+  <wsdl:message name="nfeAutorizacaoLoteSoap12In"><wsdl:part name="nfeDadosMsg" element="tns:nfeDadosMsg"/></wsdl:message>
+  <wsdl:message name="nfeAutorizacaoLoteSoap12Out"><wsdl:part name="nfeAutorizacaoLoteResult" element="tns:nfeResultMsg"/></wsdl:message>
+  <wsdl:portType name="NFeAutorizacao4Soap12">
+    <wsdl:operation name="nfeAutorizacaoLote">
+      <wsdl:input message="tns:nfeAutorizacaoLoteSoap12In"/>
+      <wsdl:output message="tns:nfeAutorizacaoLoteSoap12Out"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="NFeAutorizacao4Soap12" type="tns:NFeAutorizacao4Soap12">
+    <soap12:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="nfeAutorizacaoLote">
+      <soap12:operation soapAction="{NS_WSDL}/nfeAutorizacaoLote" style="document"/>
+      <wsdl:input><soap12:body use="literal"/></wsdl:input>
+      <wsdl:output><soap12:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="NFeAutorizacao4">
+    <wsdl:port name="NFeAutorizacao4Soap12" binding="tns:NFeAutorizacao4Soap12">
+      <soap12:address location="{{endereco}}/NFeAutorizacao4.asmx"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+RESPOSTA = f"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">
+  <soap:Body>
+    <nfeResultMsg xmlns="{NS_WSDL}">
+      <retEnviNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+        <tpAmb>2</tpAmb><cStat>103</cStat><xMotivo>Lote recebido com sucesso</xMotivo>
+      </retEnviNFe>
+    </nfeResultMsg>
+  </soap:Body>
+</soap:Envelope>
+""".encode("utf-8")
+
+XML_LOTE = '<enviNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><idLote>1</idLote></enviNFe>'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeçalho e corpo saem em writes separados; sem isso o Nagle somaria
+    # ~40 ms a cada resposta numa conexão reaproveitada
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        corpo = WSDL.replace("{endereco}", self.server.endereco).encode("utf-8")
+        self._responder(corpo, "text/xml")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._responder(RESPOSTA, "application/soap+xml")
+
+    def _responder(self, corpo: bytes, tipo: str):
+        self.send_response(200)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor() -> ThreadingHTTPServer:
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    servidor.endereco = f"http://127.0.0.1:{servidor.server_port}"
+    Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def enviar_client_novo(wsdl_url: str) -> str:
+    client = SEFAZSoapClient(wsdl_url)
+    try:
+        return client.autorizar(XML_LOTE)
+    finally:
+        client.client.transport.session.close()
+
+
+def medir(func, envios: int, threads: int) -> float:
+    """Média em ms por envio, com `threads` envios simultâneos"""
+    func()  # aquecimento
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for futuro in [executor.submit(func) for _ in range(envios)]:
+            futuro.result()
+    return (time.perf_counter() - inicio) / envios * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--envios", type=int, default=50)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    servidor = iniciar_servidor()
+    wsdl_url = f"{servidor.endereco}/NFeAutorizacao4.asmx?wsdl"
+    registry = SoapClientRegistry()
+
+    variantes = [
+        ("client novo", lambda: enviar_client_novo(wsdl_url)),
+        ("registry", lambda: registry.get(wsdl_url).autorizar(XML_LOTE)),
+    ]
+
+    try:
+        print(f"{'threads':>8}" + "".join(f"{nome:>15}" for nome, _ in variantes) + "   (ms por envio)")
+        for threads in args.threads:
+            tempos = [medir(func, args.envios, threads) for _, func in variantes]
+            print(f"{threads:>8}" + "".join(f"{t:>15.2f}" for t in tempos))
+    finally:
+        registry.close()
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+-- Chave de idempotência das emissões: header Idempotency-Key do cliente ou,
+-- na falta dele, o hash do payload canônico. Reenvios com a mesma chave
+-- retornam o registro original em vez de criar outro.
+alter table public.nfe
+    add column if not exists idempotency_key text,
+    add column if not exists payload_hash text;
+
+-- Constraint completa (não parcial) para ser usada em ON CONFLICT pelo PostgREST;
+-- registros sem chave (NULL) não conflitam entre si
+alter table public.nfe
+    add constraint nfe_idempotency_key_key unique (idempotency_key);
@@ -0,0 +1,87 @@
+-- Outbox transacional dos webhooks: cada mudança de status notificável grava
+-- um evento na mesma transação do UPDATE da NF-e, por trigger. Qualquer
+-- caminho que mude o status (workflow, group commit, sweeper de leases)
+-- gera o evento, e um crash depois do commit não perde a notificação.
+-- O WebhookRelay dos workers reivindica os eventos, copia para o outbox
+-- local de entrega e os apaga.
+create table if not exists public.nfe_webhook_eventos (
+    id bigint generated always as identity primary key,
+    nfe_id text not null,
+    status text not null,
+    -- O necessário para montar o webhook: id, ref e payload_envio.client
+    registro jsonb not null,
+    relay_owner text,
+    lease_expira_em timestamptz,
+    criado_em timestamptz not null default now()
+);
+
+create or replace function public.nfe_registrar_evento_webhook()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into public.nfe_webhook_eventos (nfe_id, status, registro)
+    values (
+        new.id::text,
+        new.status::text,
+        jsonb_build_object(
+            'id', new.id,
+            'ref', new.ref,
+            'payload_envio', jsonb_build_object('client', new.payload_envio -> 'client')
+        )
+    );
+    return null;
+end;
+$$;
+
+drop trigger if exists nfe_webhook_eventos_trg on public.nfe;
+create trigger nfe_webhook_eventos_trg
+    after update of status on public.nfe
+    for each row
+    when (old.status is distinct from new.status
+          and new.status::text in ('PROCESSANDO', 'AUTORIZADA', 'REJEITADA', 'ERRO'))
+    execute function public.nfe_registrar_evento_webhook();
+
+-- Reivindica até p_limite eventos livres, em ordem de gravação; SKIP LOCKED
+-- faz relays concorrentes pegarem eventos diferentes e o lease devolve os
+-- eventos de um relay que caiu antes de confirmar
+create or replace function public.nfe_webhook_eventos_reivindicar(
+    p_owner text,
+    p_limite integer,
+    p_lease_segundos double precision
+)
+returns setof public.nfe_webhook_eventos
+language sql
+as $$
+    with livres as (
+        select id
+          from public.nfe_webhook_eventos
+         where lease_expira_em is null or lease_expira_em < now()
+         order by id
+         limit p_limite
+           for update skip locked
+    )
+    update public.nfe_webhook_eventos as e
+       set relay_owner = p_owner,
+           lease_expira_em = now() + make_interval(secs => p_lease_segundos)
+      from livres
+     where e.id = livres.id
+    returning e.*;
+$$;
+
+-- Apaga os eventos já copiados para o outbox local pelo relay dono do lease
+create or replace function public.nfe_webhook_eventos_confirmar(
+    p_owner text,
+    p_ids bigint[]
+)
+returns integer
+language sql
+as $$
+    with confirmados as (
+        delete from public.nfe_webhook_eventos
+         where id = any(p_ids)
+           and relay_owner = p_owner
+        returning 1
+    )
+    select count(*)::integer from confirmados;
+$$;
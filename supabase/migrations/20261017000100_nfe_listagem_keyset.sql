@@ -0,0 +1,8 @@
+-- Listagem paginada por keyset: ORDER BY criado_em DESC, id DESC com a
+-- posição (criado_em, id) da última linha, sem OFFSET
+create index if not exists nfe_criado_em_id_idx
+    on public.nfe (criado_em desc, id desc);
+
+-- Mesma ordenação filtrando por status (ex.: NF-e em ERRO)
+create index if not exists nfe_status_criado_em_id_idx
+    on public.nfe (status, criado_em desc, id desc);
@@ -0,0 +1,32 @@
+-- Aplica várias atualizações de NF-e em um único UPDATE (group commit dos
+-- workers). Cada item: {"id": ..., "payload": {coluna: valor}, "expected": [status]}.
+-- Colunas ausentes do payload mantêm o valor atual; com "expected", a linha
+-- só é atualizada se o status atual estiver na lista (compare-and-set; a
+-- comparação é feita como texto, então vale para status text ou enum).
+-- Retorna as linhas atualizadas; ids ausentes do retorno não foram alterados.
+-- Cada id deve aparecer uma única vez por chamada.
+create or replace function public.nfe_atualizar_lote(itens jsonb)
+returns setof public.nfe
+language sql
+as $$
+    with item as (
+        select
+            (jsonb_populate_record(null::public.nfe, jsonb_build_object('id', e->'id'))).id as id,
+            coalesce(e->'payload', '{}'::jsonb) as payload,
+            case
+                when jsonb_typeof(e->'expected') = 'array'
+                then array(select jsonb_array_elements_text(e->'expected'))
+            end as expected
+        from jsonb_array_elements(itens) as e
+    )
+    update public.nfe as n
+       set (status, payload_retorno, chave_nfe, numero, serie,
+            xml_url, danfe_url, autorizado_em, atualizado_em) =
+           (select r.status, r.payload_retorno, r.chave_nfe, r.numero, r.serie,
+                   r.xml_url, r.danfe_url, r.autorizado_em, r.atualizado_em
+              from jsonb_populate_record(n, item.payload) as r)
+      from item
+     where n.id = item.id
+       and (item.expected is null or n.status::text = any(item.expected))
+    returning n.*;
+$$;
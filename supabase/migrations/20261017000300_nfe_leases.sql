@@ -0,0 +1,151 @@
+-- Claim de NF-e por lease, para vários workers consumirem a tabela nfe.
+-- Um worker reivindica registros CRIADA gravando lease_owner/lease_expira_em;
+-- enquanto trabalha, renova os leases que possui. Um lease vencido em
+-- PROCESSANDO (worker caiu no meio do envio) é devolvido para CRIADA pelo
+-- sweeper, ou vai para ERRO depois de max_tentativas claims.
+-- Só registros com emissao_solicitada (gravados por /emitir-nfe e
+-- /emitir-nfe/lote) são emitidos; os de /nfe/json-para-xml ficam em CRIADA
+-- apenas como conversão.
+alter table public.nfe
+    add column if not exists lease_owner text,
+    add column if not exists lease_expira_em timestamptz,
+    add column if not exists tentativas integer not null default 0,
+    add column if not exists emissao_solicitada boolean not null default false;
+
+create index if not exists nfe_claim_idx
+    on public.nfe (criado_em)
+    where status = 'CRIADA' and emissao_solicitada;
+
+create index if not exists nfe_lease_idx
+    on public.nfe (lease_owner, lease_expira_em)
+    where status in ('CRIADA', 'PROCESSANDO');
+
+-- Reivindica até p_limite registros livres em um único statement;
+-- SKIP LOCKED faz workers concorrentes pegarem registros diferentes
+create or replace function public.nfe_reivindicar(
+    p_owner text,
+    p_limite integer,
+    p_lease_segundos double precision,
+    p_max_tentativas integer
+)
+returns setof public.nfe
+language sql
+as $$
+    with livres as (
+        select id
+          from public.nfe
+         where status = 'CRIADA'
+           and emissao_solicitada
+           and (lease_expira_em is null or lease_expira_em < now())
+           and tentativas < p_max_tentativas
+         order by criado_em
+         limit p_limite
+           for update skip locked
+    )
+    update public.nfe as n
+       set lease_owner = p_owner,
+           lease_expira_em = now() + make_interval(secs => p_lease_segundos),
+           tentativas = n.tentativas + 1
+      from livres
+     where n.id = livres.id
+    returning n.*;
+$$;
+
+-- Renova todos os leases ainda válidos do worker; nunca encurta um lease
+-- mais longo (registros aguardando recibo de lote)
+create or replace function public.nfe_renovar_leases(
+    p_owner text,
+    p_lease_segundos double precision
+)
+returns integer
+language sql
+as $$
+    with renovados as (
+        update public.nfe
+           set lease_expira_em = greatest(lease_expira_em, now() + make_interval(secs => p_lease_segundos))
+         where lease_owner = p_owner
+           and lease_expira_em > now()
+           and status in ('CRIADA', 'PROCESSANDO')
+        returning 1
+    )
+    select count(*)::integer from renovados;
+$$;
+
+-- Fim do workflow do registro no worker: status finais e CRIADA liberam o
+-- lease (CRIADA só volta a ser reivindicada após p_atraso_segundos);
+-- PROCESSANDO aguardando recibo mantém o dono com o lease de recibo. Com
+-- p_devolver (job que falhou), PROCESSANDO volta para CRIADA e é
+-- reivindicado de novo após o atraso, como retomada
+create or replace function public.nfe_liberar_lease(
+    p_id public.nfe.id%type,
+    p_owner text,
+    p_atraso_segundos double precision,
+    p_lease_recibo_segundos double precision,
+    p_devolver boolean default false
+)
+returns void
+language sql
+as $$
+    update public.nfe
+       set status = 'CRIADA',
+           atualizado_em = now()
+     where p_devolver
+       and id = p_id
+       and lease_owner = p_owner
+       and status = 'PROCESSANDO';
+
+    update public.nfe
+       set lease_owner = case when status = 'PROCESSANDO' then lease_owner end,
+           lease_expira_em = case
+               when status = 'PROCESSANDO' then now() + make_interval(secs => p_lease_recibo_segundos)
+               when status = 'CRIADA' and p_atraso_segundos > 0 then now() + make_interval(secs => p_atraso_segundos)
+           end
+     where id = p_id
+       and lease_owner = p_owner;
+$$;
+
+-- Devolve para CRIADA os registros em PROCESSANDO com lease vencido, ou
+-- marca ERRO quando já foram reivindicados p_max_tentativas vezes (inclusive
+-- os devolvidos em CRIADA na última tentativa, que não seriam mais
+-- reivindicados). Cada destino tem o próprio UPDATE com o status literal,
+-- que é convertido para o tipo da coluna (text ou enum); a mudança para ERRO
+-- grava o evento de webhook pelo trigger nfe_webhook_eventos_trg
+create or replace function public.nfe_varrer_leases(p_max_tentativas integer)
+returns integer
+language sql
+as $$
+    with vencidos as (
+        select id, tentativas >= p_max_tentativas as esgotado
+          from public.nfe
+         where (status = 'PROCESSANDO' and lease_expira_em < now())
+            or (status = 'CRIADA'
+                and emissao_solicitada
+                and tentativas >= p_max_tentativas
+                and (lease_expira_em is null or lease_expira_em < now()))
+           for update skip locked
+    ),
+    devolvidos as (
+        update public.nfe as n
+           set status = 'CRIADA',
+               lease_owner = null,
+               lease_expira_em = null,
+               atualizado_em = now()
+          from vencidos
+         where n.id = vencidos.id
+           and not vencidos.esgotado
+        returning 1
+    ),
+    esgotados as (
+        update public.nfe as n
+           set status = 'ERRO',
+               payload_retorno = jsonb_build_object('error', 'lease expirado após ' || n.tentativas || ' tentativas'),
+               lease_owner = null,
+               lease_expira_em = null,
+               atualizado_em = now()
+          from vencidos
+         where n.id = vencidos.id
+           and vencidos.esgotado
+        returning 1
+    )
+    select ((select count(*) from devolvidos) + (select count(*) from esgotados))::integer;
+$$;
@@ -0,0 +1,33 @@
+-- XML da NF-e guardado junto ao registro: `xml` é o documento gerado por
+-- /nfe/json-para-xml e `xml_assinado` o documento enviado à SEFAZ. O worker
+-- reaproveita o que já estiver gravado em vez de gerar/assinar de novo.
+alter table public.nfe
+    add column if not exists xml text,
+    add column if not exists xml_assinado text;
+
+-- nfe_atualizar_lote passa a gravar também o xml_assinado
+create or replace function public.nfe_atualizar_lote(itens jsonb)
+returns setof public.nfe
+language sql
+as $$
+    with item as (
+        select
+            (jsonb_populate_record(null::public.nfe, jsonb_build_object('id', e->'id'))).id as id,
+            coalesce(e->'payload', '{}'::jsonb) as payload,
+            case
+                when jsonb_typeof(e->'expected') = 'array'
+                then array(select jsonb_array_elements_text(e->'expected'))
+            end as expected
+        from jsonb_array_elements(itens) as e
+    )
+    update public.nfe as n
+       set (status, payload_retorno, chave_nfe, numero, serie,
+            xml_url, danfe_url, autorizado_em, atualizado_em, xml_assinado) =
+           (select r.status, r.payload_retorno, r.chave_nfe, r.numero, r.serie,
+                   r.xml_url, r.danfe_url, r.autorizado_em, r.atualizado_em, r.xml_assinado
+              from jsonb_populate_record(n, item.payload) as r)
+      from item
+     where n.id = item.id
+       and (item.expected is null or n.status::text = any(item.expected))
+    returning n.*;
+$$;
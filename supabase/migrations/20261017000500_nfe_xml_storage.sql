@@ -0,0 +1,6 @@
+-- Bucket privado do XMLStorage (XML_STORAGE_BACKEND=supabase). Objetos são
+-- XML comprimidos (gzip) endereçados pelo sha256: <2 primeiros>/<sha256>.xml.gz.
+-- Downloads usam URLs assinadas geradas pela API com a service key.
+insert into storage.buckets (id, name, public)
+values ('nfe-xml', 'nfe-xml', false)
+on conflict (id) do nothing;
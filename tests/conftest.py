@@ -0,0 +1,50 @@
+import os
+
+# O cliente Supabase é criado na importação dos módulos de serviço
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def servidor_postgres(tmp_path_factory):
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg")
+    servidor = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    yield servidor
+    servidor.cleanup()
+
+
+@pytest.fixture(scope="session")
+def modelos_postgres(servidor_postgres):
+    from tests.postgres import criar_modelo
+
+    modelos = {}
+
+    def modelo(tipo_status):
+        if tipo_status not in modelos:
+            modelos[tipo_status] = criar_modelo(servidor_postgres, tipo_status)
+        return modelos[tipo_status]
+
+    return modelo
+
+
+@pytest.fixture(params=["text", "enum"])
+def banco(request, servidor_postgres, modelos_postgres):
+    """Banco novo, com as migrations aplicadas, para `status` text e enum"""
+    from tests.postgres import BancoNFe, criar_banco
+
+    conn = criar_banco(servidor_postgres, modelos_postgres(request.param))
+    yield BancoNFe(conn, request.param)
+    conn.close()
+
+
+@pytest.fixture(autouse=True)
+def _fechar_circuit_breakers():
+    """Falhas de um teste não deixam breakers compartilhados abertos para os seguintes"""
+    yield
+    from app.common.patterns.circuit_breaker import circuit_breakers
+
+    for status in circuit_breakers.status():
+        circuit_breakers.reset(status["name"])
@@ -0,0 +1,144 @@
+"""Postgres real (pgserver) com as migrations de `supabase/migrations`.
+
+A tabela `public.nfe` e o schema `storage` são criados pelo Supabase fora
+das migrations; aqui eles são recriados com o mínimo que as migrations e o
+código usam. `status` existe como text e como enum, os dois formatos em que
+a coluna aparece nos projetos.
+"""
+import asyncio
+import itertools
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "supabase" / "migrations"
+
+STATUS_TIPOS = {
+    "text": "text",
+    "enum": "public.nfe_status",
+}
+
+_SCHEMA_BASE = """
+create schema if not exists storage;
+create table storage.buckets (id text primary key, name text, public boolean);
+create type public.nfe_status as enum ('CRIADA', 'PROCESSANDO', 'AUTORIZADA', 'REJEITADA', 'ERRO');
+create table public.nfe (
+    id uuid primary key default gen_random_uuid(),
+    ref text,
+    status {status} not null default 'CRIADA',
+    chave_nfe text,
+    numero text,
+    serie text,
+    xml_url text,
+    danfe_url text,
+    payload_envio jsonb,
+    payload_retorno jsonb,
+    ambiente text,
+    data_emissao timestamptz,
+    autorizado_em timestamptz,
+    criado_em timestamptz not null default now(),
+    atualizado_em timestamptz
+);
+"""
+
+_sequencia = itertools.count(1)
+
+
+def criar_modelo(servidor, tipo_status: str) -> str:
+    """Banco modelo com o schema base e todas as migrations aplicadas"""
+    nome = f"modelo_{tipo_status}"
+    with psycopg.connect(servidor.get_uri(), autocommit=True) as conn:
+        conn.execute(f"drop database if exists {nome}")
+        conn.execute(f"create database {nome}")
+
+    with psycopg.connect(servidor.get_uri(nome), autocommit=True) as conn:
+        conn.execute(_SCHEMA_BASE.format(status=STATUS_TIPOS[tipo_status]))
+        for migration in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            try:
+                conn.execute(migration.read_text(encoding="utf-8"))
+            except psycopg.Error as e:
+                raise AssertionError(f"{migration.name} (status {tipo_status}): {e}") from e
+    return nome
+
+
+def criar_banco(servidor, modelo: str) -> psycopg.Connection:
+    nome = f"teste_{next(_sequencia)}"
+    with psycopg.connect(servidor.get_uri(), autocommit=True) as conn:
+        conn.execute(f"create database {nome} template {modelo}")
+    return psycopg.connect(servidor.get_uri(nome), autocommit=True, row_factory=dict_row)
+
+
+class _Rpc:
+    def __init__(self, conn: psycopg.Connection, fn: str, params: Dict[str, Any]):
+        self.conn = conn
+        self.fn = fn
+        self.params = params
+
+    async def execute(self):
+        return SimpleNamespace(data=await asyncio.to_thread(self._executar), error=None)
+
+    def _executar(self):
+        # Como o PostgREST: o corpo JSON vira os argumentos com os tipos declarados
+        funcao = self.conn.execute(
+            "select p.proretset or t.typtype = 'c' as linhas, t.typname = 'void' as void, "
+            "       array(select format_type(a, null) from unnest(p.proargtypes) as a) as tipos, "
+            "       p.proargnames as nomes "
+            "from pg_proc p join pg_type t on t.oid = p.prorettype "
+            "where p.proname = %s and p.pronamespace = 'public'::regnamespace",
+            (self.fn,),
+        ).fetchone()
+        tipos = dict(zip(funcao["nomes"], funcao["tipos"]))
+        colunas = ", ".join(f"{nome} {tipos[nome]}" for nome in self.params)
+        args = ", ".join(f"{nome} => a.{nome}" for nome in self.params)
+        origem = f"jsonb_to_record(%(corpo)s::jsonb) as a({colunas})"
+        corpo = {"corpo": Jsonb(self.params)}
+
+        if funcao["linhas"]:
+            sql = (f"select coalesce(jsonb_agg(to_jsonb(r)), '[]'::jsonb) as data "
+                   f"from {origem} cross join lateral public.{self.fn}({args}) as r")
+        elif funcao["void"]:
+            self.conn.execute(f"select public.{self.fn}({args}) from {origem}", corpo)
+            return None
+        else:
+            sql = f"select to_jsonb(public.{self.fn}({args})) as data from {origem}"
+        return self.conn.execute(sql, corpo).fetchone()["data"]
+
+
+class PostgresRpcClient:
+    """O suficiente do client Supabase para `NFeService._rpc`: `rpc(fn, params).execute()`
+    devolvendo `data` como o PostgREST (linhas em JSON, escalar ou None)"""
+
+    def __init__(self, conn: psycopg.Connection):
+        self.conn = conn
+
+    def rpc(self, fn: str, params: Dict[str, Any]) -> _Rpc:
+        return _Rpc(self.conn, fn, params)
+
+
+class BancoNFe:
+    def __init__(self, conn: psycopg.Connection, tipo_status: str):
+        self.conn = conn
+        self.tipo_status = tipo_status
+        self.client = PostgresRpcClient(conn)
+
+    def inserir(self, **campos) -> str:
+        campos.setdefault("id", str(uuid.uuid4()))
+        campos.setdefault("ref", f"ref-{campos['id'][:8]}")
+        valores = {k: Jsonb(v) if isinstance(v, (dict, list)) else v for k, v in campos.items()}
+        colunas = ", ".join(valores)
+        marcadores = ", ".join(f"%({k})s" for k in valores)
+        self.conn.execute(f"insert into public.nfe ({colunas}) values ({marcadores})", valores)
+        return campos["id"]
+
+    def buscar(self, record_id: str) -> Optional[Dict[str, Any]]:
+        return self.conn.execute(
+            "select *, status::text as status from public.nfe where id = %s", (record_id,)).fetchone()
+
+    def executar(self, sql: str, params: Any = None) -> List[Dict[str, Any]]:
+        cursor = self.conn.execute(sql, params)
+        return cursor.fetchall() if cursor.description else []
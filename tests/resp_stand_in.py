@@ -0,0 +1,141 @@
+"""Servidor RESP2 mínimo, em processo, para os testes do `RespClient`.
+
+Atende só o que o projeto usa: PING, AUTH, SELECT, EVAL/EVALSHA (o Lua
+roda de verdade, via lupa) e, dentro dos scripts, TIME, HMGET, HSET e
+PEXPIRE. O relógio é injetado, então os testes controlam o tempo.
+"""
+import asyncio
+import hashlib
+from typing import Callable, Dict, List, Optional
+
+from lupa import LuaRuntime
+
+
+class RespStandIn:
+    def __init__(self, relogio: Callable[[], float], senha: Optional[str] = None):
+        self.relogio = relogio
+        self.senha = senha
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.expira_em: Dict[str, float] = {}
+        self.scripts: Dict[str, str] = {}
+        self.comandos: List[List[str]] = []
+        self.conexoes = 0
+        self._lua = LuaRuntime(unpack_returned_tuples=True)
+        self._lua.globals().redis = self._lua.table_from({"call": self._redis_call})
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        senha = f":{self.senha}@" if self.senha else ""
+        return f"redis://{senha}{host}:{port}/1"
+
+    async def __aenter__(self) -> "RespStandIn":
+        self._server = await asyncio.start_server(self._atender, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    # ==========================
+    # Protocolo
+    # ==========================
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.conexoes += 1
+        autenticado = self.senha is None
+        try:
+            while True:
+                args = await self._ler_comando(reader)
+                if args is None:
+                    break
+                self.comandos.append(args)
+                nome = args[0].upper()
+                if not autenticado and nome != "AUTH":
+                    writer.write(b"-NOAUTH Authentication required.\r\n")
+                elif nome == "AUTH":
+                    autenticado = args[1] == self.senha
+                    writer.write(b"+OK\r\n" if autenticado else b"-WRONGPASS invalid password\r\n")
+                else:
+                    writer.write(self._executar(nome, args[1:]))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _ler_comando(reader: asyncio.StreamReader) -> Optional[List[str]]:
+        linha = await reader.readline()
+        if not linha:
+            return None
+        assert linha[:1] == b"*", linha
+        args = []
+        for _ in range(int(linha[1:-2])):
+            tamanho = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(tamanho + 2))[:-2].decode())
+        return args
+
+    def _executar(self, nome: str, args: List[str]) -> bytes:
+        if nome == "PING":
+            return b"+PONG\r\n"
+        if nome == "SELECT":
+            return b"+OK\r\n"
+        if nome == "EVAL":
+            script = args[0]
+            self.scripts[hashlib.sha1(script.encode()).hexdigest()] = script
+            return self._eval(script, args[1:])
+        if nome == "EVALSHA":
+            script = self.scripts.get(args[0])
+            if script is None:
+                return b"-NOSCRIPT No matching script. Please use EVAL.\r\n"
+            return self._eval(script, args[1:])
+        return f"-ERR unknown command '{nome}'\r\n".encode()
+
+    def _eval(self, script: str, args: List[str]) -> bytes:
+        numkeys = int(args[0])
+        globais = self._lua.globals()
+        globais.KEYS = self._lua.table_from(args[1:1 + numkeys])
+        globais.ARGV = self._lua.table_from(args[1 + numkeys:])
+        return _codificar(self._lua.execute(script))
+
+    # ==========================
+    # Comandos dentro do Lua
+    # ==========================
+    def _hash(self, chave: str) -> Dict[str, str]:
+        if chave in self.expira_em and self.expira_em[chave] <= self.relogio():
+            self.hashes.pop(chave, None)
+            del self.expira_em[chave]
+        return self.hashes.setdefault(chave, {})
+
+    def _redis_call(self, nome, *args):
+        nome = nome.upper()
+        if nome == "TIME":
+            agora = self.relogio()
+            return self._lua.table_from([str(int(agora)), str(int(agora % 1 * 1_000_000))])
+        if nome == "HMGET":
+            valores = self._hash(args[0])
+            # Campo ausente chega ao Lua como false, igual ao Redis
+            return self._lua.table_from([valores.get(campo, False) for campo in args[1:]])
+        if nome == "HSET":
+            valores = self._hash(args[0])
+            for campo, valor in zip(args[1::2], args[2::2]):
+                valores[campo] = str(valor)
+            return len(args[1:]) // 2
+        if nome == "PEXPIRE":
+            self.expira_em[args[0]] = self.relogio() + int(args[1]) / 1000
+            return 1
+        raise ValueError(f"Comando não suportado no stand-in: {nome}")
+
+
+def _codificar(valor) -> bytes:
+    """Converte o retorno do Lua em RESP como o Redis faz (número -> inteiro)"""
+    if valor is None or valor is False:
+        return b"$-1\r\n"
+    if valor is True:
+        return b":1\r\n"
+    if isinstance(valor, (int, float)):
+        return b":%d\r\n" % int(valor)
+    if isinstance(valor, str):
+        dado = valor.encode()
+        return b"$%d\r\n%s\r\n" % (len(dado), dado)
+    itens = [valor[i] for i in range(1, len(valor) + 1)]
+    return b"*%d\r\n" % len(itens) + b"".join(_codificar(item) for item in itens)
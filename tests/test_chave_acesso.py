@@ -0,0 +1,74 @@
+import asyncio
+import json
+from pathlib import Path
+
+from app.core.sefaz import chave_do_xml
+from app.models.nfe import NFe
+from app.utils.build_nfe_xml import NFE_ID_PLACEHOLDER, build_nfe_xml, stream_nfe_xml
+from app.utils.chave_acesso import digito_verificador, gerar_chave_acesso
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+
+
+def _nfe(**campos) -> NFe:
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+    payload.update(campos)
+    return NFe(**payload)
+
+
+def test_digito_verificador_do_exemplo_do_manual():
+    assert digito_verificador("5206043300991100250655012000000780026730161") == 5
+
+
+def test_layout_da_chave():
+    chave = gerar_chave_acesso(_nfe(serie=2, numero_nota=1234))
+
+    assert len(chave) == 44
+    assert chave[:2] == "35"
+    assert chave[2:6] == "2512"
+    assert chave[6:20] == "11444777000161"
+    assert chave[20:22] == "55"
+    assert chave[22:25] == "002"
+    assert chave[25:34] == "000001234"
+    assert chave[34] == "1"
+    assert int(chave[43]) == digito_verificador(chave[:43])
+
+
+def test_chave_deterministica_por_emitente_serie_e_numero():
+    chave = gerar_chave_acesso(_nfe(numero_nota=10))
+
+    assert gerar_chave_acesso(_nfe(numero_nota=10)) == chave
+    assert gerar_chave_acesso(_nfe(numero_nota=11)) != chave
+    assert gerar_chave_acesso(_nfe(numero_nota=10, serie=2)) != chave
+
+
+def test_xml_sem_numero_usa_id_provisorio():
+    nfe = _nfe()
+
+    assert gerar_chave_acesso(nfe) is None
+    assert f'Id="{NFE_ID_PLACEHOLDER}"' in build_nfe_xml(nfe)
+    assert chave_do_xml(build_nfe_xml(nfe)) is None
+
+
+def test_xml_com_numero_leva_a_chave_no_id_e_no_ide():
+    nfe = _nfe(numero_nota=1234)
+    chave = gerar_chave_acesso(nfe)
+    xml = build_nfe_xml(nfe)
+
+    assert chave_do_xml(xml) == chave
+    assert f"<cNF>{chave[35:43]}</cNF>" in xml
+    assert "<nNF>1234</nNF>" in xml
+    assert f"<cDV>{chave[43]}</cDV>" in xml
+
+
+def test_stream_gera_o_mesmo_xml():
+    nfe = _nfe(numero_nota=1234)
+
+    async def itens():
+        for item in nfe.items:
+            yield item
+
+    async def gerar():
+        return b"".join([parte async for parte in stream_nfe_xml(nfe, itens())])
+
+    assert asyncio.run(gerar()).decode("utf-8") == build_nfe_xml(nfe)
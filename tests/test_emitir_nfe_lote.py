@@ -0,0 +1,205 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+import app.main as main
+from app.services.nfe.nfe import NFeService
+
+NFE_EXEMPLO = json.loads(
+    (Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json").read_text(encoding="utf-8"))
+
+
+def _nfes(quantidade):
+    """NF-e distintas (numero_nota diferente), para não serem tratadas como reenvio"""
+    return [{**NFE_EXEMPLO, "numero_nota": numero} for numero in range(1, quantidade + 1)]
+
+
+class FakeNFeService:
+    """insert_many com a semântica do upsert: chaves já gravadas são ignoradas"""
+
+    def __init__(self, falhas=(), registros=()):
+        self.falhas = set(falhas)
+        self.blocos = []
+        self.registros = {r["idempotency_key"]: dict(r) for r in registros}
+        self.atualizacoes = []
+
+    async def insert_many(self, records):
+        self.blocos.append([r["id"] for r in records])
+        if len(self.blocos) in self.falhas:
+            raise Exception("timeout")
+        for record in records:
+            self.registros.setdefault(record["idempotency_key"], dict(record))
+        return [dict(self.registros[r["idempotency_key"]]) for r in records]
+
+    async def update_if_status(self, record_id, update_payload, expected_statuses):
+        self.atualizacoes.append((record_id, update_payload))
+        return None
+
+
+class FakeQueue:
+    def __init__(self):
+        self.enfileirados = []
+
+    async def enqueue_many(self, ids):
+        self.enfileirados.extend(ids)
+
+
+def _emitir(service, nfes):
+    queue = FakeQueue()
+    resposta = asyncio.run(main.emitir_nfe_lote(nfe_service=service, work_queue=queue, nfes=nfes))
+    return resposta, queue.enfileirados
+
+
+def test_erro_inesperado_na_validacao_rejeita_so_o_item(monkeypatch):
+    validar = main.validar_nfe
+
+    def validar_nfe(nfe):
+        if nfe.natureza_operacao == "QUEBRADA":
+            raise TypeError("campo inesperado")
+        validar(nfe)
+
+    monkeypatch.setattr(main, "validar_nfe", validar_nfe)
+    quebrada = {**NFE_EXEMPLO, "natureza_operacao": "QUEBRADA"}
+
+    resposta, enfileirados = _emitir(FakeNFeService(), [NFE_EXEMPLO, quebrada, {}])
+
+    itens = resposta["data"]["itens"]
+    assert [item["success"] for item in itens] == [True, False, False]
+    assert "campo inesperado" in itens[1]["erro"]
+    assert enfileirados == [itens[0]["id"]]
+
+
+def test_cada_bloco_e_enfileirado_depois_de_gravado(monkeypatch):
+    monkeypatch.setattr(main, "INSERT_CHUNK_SIZE", 2)
+    service = FakeNFeService(falhas={2})
+
+    resposta, enfileirados = _emitir(service, _nfes(5))
+
+    gravados = service.blocos[0] + service.blocos[2]
+    assert enfileirados == gravados
+    assert resposta["data"]["aceitas"] == 3 and resposta["data"]["rejeitadas"] == 2
+    itens = resposta["data"]["itens"]
+    assert [item["success"] for item in itens] == [True, True, False, False, True]
+    assert all("timeout" in item["erro"] for item in itens[2:4])
+    assert [item["id"] for item in itens if item["success"]] == gravados
+
+
+def test_lote_sem_nenhum_bloco_gravado_falha(monkeypatch):
+    monkeypatch.setattr(main, "INSERT_CHUNK_SIZE", 2)
+
+    with pytest.raises(HTTPException) as exc:
+        _emitir(FakeNFeService(falhas={1, 2}), _nfes(3))
+    assert exc.value.status_code == 500
+
+
+def test_nfe_repetida_no_lote_e_gravada_uma_vez():
+    service = FakeNFeService()
+    outra = {**NFE_EXEMPLO, "numero_nota": 2}
+
+    resposta, enfileirados = _emitir(service, [NFE_EXEMPLO, outra, NFE_EXEMPLO])
+
+    itens = resposta["data"]["itens"]
+    assert len(service.blocos) == 1 and len(service.blocos[0]) == 2
+    assert itens[2]["id"] == itens[0]["id"] and itens[2]["ref"] == itens[0]["ref"]
+    assert [item["reenvio"] for item in itens] == [False, False, True]
+    assert enfileirados == [itens[0]["id"], itens[1]["id"]]
+    assert resposta["data"]["aceitas"] == 3 and resposta["data"]["reenvios"] == 1
+
+
+def test_reenvio_devolve_o_registro_original():
+    service = FakeNFeService()
+    primeira, _ = _emitir(service, _nfes(2))
+    originais = primeira["data"]["itens"]
+    service.registros[next(iter(service.registros))]["status"] = "AUTORIZADA"
+
+    resposta, enfileirados = _emitir(service, _nfes(3))
+
+    itens = resposta["data"]["itens"]
+    assert [(item["id"], item["ref"]) for item in itens[:2]] == [(i["id"], i["ref"]) for i in originais]
+    assert [item["status"] for item in itens] == ["AUTORIZADA", "CRIADA", "CRIADA"]
+    assert [item["reenvio"] for item in itens] == [True, True, False]
+    # O já autorizado não volta para a fila; o ainda pendente e o novo sim
+    assert enfileirados == [itens[1]["id"], itens[2]["id"]]
+    assert resposta["data"]["reenvios"] == 2
+
+
+def test_reenvio_de_registro_so_de_conversao_solicita_a_emissao():
+    service = FakeNFeService()
+    _emitir(service, _nfes(1))
+    registro = next(iter(service.registros.values()))
+    registro["emissao_solicitada"] = False
+
+    _, enfileirados = _emitir(service, _nfes(1))
+
+    assert service.atualizacoes == [(registro["id"], {"emissao_solicitada": True})]
+    assert enfileirados == [registro["id"]]
+
+
+class _Resposta:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class _Consulta:
+    def __init__(self, tabela, operacao, **kwargs):
+        self.tabela = tabela
+        self.operacao = operacao
+        self.kwargs = kwargs
+
+    def in_(self, coluna, valores):
+        self.kwargs["in_"] = (coluna, valores)
+        return self
+
+    async def execute(self):
+        tabela = self.tabela
+        if self.operacao == "upsert":
+            tabela.upserts.append(self.kwargs)
+            for linha in self.kwargs["json"]:
+                tabela.linhas.setdefault(linha["idempotency_key"], linha)
+            return _Resposta([])
+        coluna, valores = self.kwargs["in_"]
+        colunas = self.kwargs["colunas"].split(",")
+        return _Resposta([{c: l[c] for c in colunas} for l in tabela.linhas.values() if l[coluna] in valores])
+
+
+class _Tabela:
+    def __init__(self):
+        self.linhas = {}
+        self.upserts = []
+
+    def upsert(self, json, **kwargs):
+        return _Consulta(self, "upsert", json=json, **kwargs)
+
+    def select(self, colunas):
+        return _Consulta(self, "select", colunas=colunas)
+
+
+class _Cliente:
+    def __init__(self):
+        self.nfe = _Tabela()
+
+    def table(self, nome):
+        return self.nfe
+
+
+def _registro(id_, chave):
+    return {"id": id_, "ref": f"ref-{id_}", "status": "CRIADA", "criado_em": "2026-10-17T00:00:00+00:00",
+            "idempotency_key": chave, "emissao_solicitada": True, "payload_envio": {}}
+
+
+def test_insert_many_ignora_chaves_gravadas_e_devolve_as_linhas_na_ordem():
+    cliente = _Cliente()
+    service = NFeService(cliente)
+    cliente.nfe.linhas["k2"] = _registro("original", "k2")
+
+    linhas = asyncio.run(service.insert_many(
+        [_registro("a", "k1"), _registro("b", "k2"), _registro("c", "k3")], chunk_size=2))
+
+    assert [linha["id"] for linha in linhas] == ["a", "original", "c"]
+    assert "payload_envio" not in linhas[0]
+    assert len(cliente.nfe.upserts) == 2
+    assert all(u["on_conflict"] == "idempotency_key" and u["ignore_duplicates"] for u in cliente.nfe.upserts)
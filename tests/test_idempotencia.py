@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.common.patterns.lru_cache import LRUCache
+from app.services.idempotencia.idempotencia import IdempotenciaConflitoError, IdempotenciaService
+
+
+class FakeNFeService:
+    def __init__(self):
+        self.registros = {}
+        self.leituras = 0
+
+    async def insert_if_absent(self, record):
+        if any(r["idempotency_key"] == record["idempotency_key"] for r in self.registros.values()):
+            return None
+        self.registros[record["id"]] = dict(record)
+        return dict(record)
+
+    async def get_by_idempotency_key(self, chave):
+        self.leituras += 1
+        return next((dict(r) for r in self.registros.values() if r["idempotency_key"] == chave), None)
+
+    async def get_by_id(self, record_id):
+        self.leituras += 1
+        registro = self.registros.get(record_id)
+        return dict(registro) if registro else None
+
+
+def _record(id_, payload_hash="h1"):
+    return {"id": id_, "ref": f"ref-{id_}", "status": "CRIADA", "criado_em": "2026-10-17T00:00:00+00:00",
+            "idempotency_key": "key:k1", "payload_hash": payload_hash}
+
+
+def test_reenvio_devolve_o_status_atual_e_nao_o_do_cache():
+    async def cenario():
+        service = FakeNFeService()
+        idempotencia = IdempotenciaService(service, LRUCache(10))
+
+        registro, criado = await idempotencia.registrar(_record("a"))
+        assert criado and registro["status"] == "CRIADA"
+
+        service.registros["a"]["status"] = "AUTORIZADA"
+        registro, criado = await idempotencia.registrar(_record("b"))
+        assert not criado
+        assert (registro["id"], registro["status"]) == ("a", "AUTORIZADA")
+        assert set(idempotencia.cache.get("key:k1")) == {"id", "ref", "payload_hash"}
+
+    asyncio.run(cenario())
+
+
+def test_reenvio_sem_cache_usa_o_registro_lido_pela_chave():
+    async def cenario():
+        service = FakeNFeService()
+        await IdempotenciaService(service, LRUCache(10)).registrar(_record("a"))
+        service.registros["a"]["status"] = "PROCESSANDO"
+
+        registro, criado = await IdempotenciaService(service, LRUCache(10)).registrar(_record("b"))
+        assert not criado and registro["status"] == "PROCESSANDO"
+        assert service.leituras == 1
+
+    asyncio.run(cenario())
+
+
+def test_payload_diferente_com_a_mesma_chave_conflita_sem_ler_o_registro():
+    async def cenario():
+        service = FakeNFeService()
+        idempotencia = IdempotenciaService(service, LRUCache(10))
+        await idempotencia.registrar(_record("a"))
+
+        with pytest.raises(IdempotenciaConflitoError):
+            await idempotencia.registrar(_record("b", payload_hash="h2"))
+        assert service.leituras == 0
+
+    asyncio.run(cenario())
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from app.services.nfe.nfe import NFeService
+from app.services.nfe.nfe_write_batcher import NFeWriteBatcher
+
+
+def _atualizar_lote(banco, itens):
+    return banco.executar(
+        "select id::text, status::text, payload_retorno from public.nfe_atualizar_lote(%s::jsonb)",
+        (json.dumps(itens),),
+    )
+
+
+def test_rpc_aplica_o_cas_por_item(banco):
+    criada = banco.inserir(status="CRIADA")
+    autorizada = banco.inserir(status="AUTORIZADA", chave_nfe="35" + "1" * 42)
+
+    linhas = _atualizar_lote(banco, [
+        {"id": criada, "payload": {"status": "PROCESSANDO"}, "expected": ["CRIADA"]},
+        {"id": autorizada, "payload": {"status": "ERRO"}, "expected": ["CRIADA", "PROCESSANDO"]},
+    ])
+
+    assert [(l["id"], l["status"]) for l in linhas] == [(criada, "PROCESSANDO")]
+    assert banco.buscar(autorizada)["status"] == "AUTORIZADA"
+    assert banco.buscar(autorizada)["chave_nfe"] == "35" + "1" * 42
+
+
+def test_rpc_sem_expected_atualiza_e_mantem_colunas_ausentes(banco):
+    record_id = banco.inserir(status="PROCESSANDO", chave_nfe="35" + "2" * 42)
+
+    linhas = _atualizar_lote(banco, [
+        {"id": record_id, "payload": {"status": "AUTORIZADA", "payload_retorno": {"protocolo": "1"}}},
+        {"id": str(uuid.uuid4()), "payload": {"status": "ERRO"}},
+    ])
+
+    assert [(l["status"], l["payload_retorno"]) for l in linhas] == [("AUTORIZADA", {"protocolo": "1"})]
+    assert banco.buscar(record_id)["chave_nfe"] == "35" + "2" * 42
+
+
+def test_gravar_devolve_a_linha_do_cas_e_none_sem_correspondencia(banco):
+    criada = banco.inserir(status="CRIADA")
+    autorizada = banco.inserir(status="AUTORIZADA")
+    inexistente = str(uuid.uuid4())
+
+    async def cenario():
+        batcher = NFeWriteBatcher(NFeService(banco.client), janela=0.01)
+        resultados = await asyncio.gather(
+            batcher.update_if_status(criada, {"status": "PROCESSANDO"}, ["CRIADA"]),
+            batcher.update_if_status(autorizada, {"status": "PROCESSANDO"}, ["CRIADA"]),
+            batcher.update_if_status(inexistente, {"status": "PROCESSANDO"}, ["CRIADA"]),
+        )
+        assert batcher.lotes == 1
+        return resultados
+
+    linha, sem_cas, sem_registro = asyncio.run(cenario())
+
+    assert (linha["id"], linha["status"]) == (criada, "PROCESSANDO")
+    assert sem_cas is None and sem_registro is None
+    assert banco.buscar(autorizada)["status"] == "AUTORIZADA"
+
+
+def test_update_sem_registro_falha(banco):
+    async def cenario():
+        batcher = NFeWriteBatcher(NFeService(banco.client), janela=0.001)
+        await batcher.update(str(uuid.uuid4()), {"status": "ERRO"})
+
+    with pytest.raises(Exception, match="não encontrado"):
+        asyncio.run(cenario())
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.infra.nfe_lease_queue import SupabaseLeaseQueue
+from app.services.nfe.nfe import NFeService
+
+
+def _daqui(segundos):
+    return datetime.now(timezone.utc) + timedelta(seconds=segundos)
+
+
+def _fila(banco, owner="w1"):
+    return SupabaseLeaseQueue(NFeService(banco.client), owner=owner, max_tentativas=3, lease_recibo=3600)
+
+
+def _reivindicar(banco, owner="w1", limite=10, max_tentativas=3):
+    return asyncio.run(NFeService(banco.client).claim_batch(owner, limite, 30, max_tentativas))
+
+
+def test_reivindica_so_registros_de_emissao(banco):
+    emissao = banco.inserir(status="CRIADA", emissao_solicitada=True)
+    banco.inserir(status="CRIADA")  # Gravado por /nfe/json-para-xml
+
+    linhas = _reivindicar(banco)
+
+    assert [l["id"] for l in linhas] == [emissao]
+    assert banco.buscar(emissao)["lease_owner"] == "w1"
+    assert banco.buscar(emissao)["tentativas"] == 1
+
+
+def test_reivindica_so_livres_e_com_tentativas_restantes(banco):
+    livre = banco.inserir(status="CRIADA", emissao_solicitada=True)
+    banco.inserir(status="CRIADA", emissao_solicitada=True, lease_owner="w2",
+                  lease_expira_em=_daqui(60))
+    banco.inserir(status="CRIADA", emissao_solicitada=True, tentativas=3)
+
+    assert [l["id"] for l in _reivindicar(banco)] == [livre]
+
+
+def test_ack_mantem_processando_com_o_lease_de_recibo(banco):
+    record_id = banco.inserir(status="PROCESSANDO", emissao_solicitada=True,
+                              lease_owner="w1", lease_expira_em=_daqui(30))
+
+    asyncio.run(_fila(banco).ack(record_id))
+
+    registro = banco.buscar(record_id)
+    assert (registro["status"], registro["lease_owner"]) == ("PROCESSANDO", "w1")
+    assert registro["lease_expira_em"] > _daqui(3000)
+
+
+def test_nack_devolve_processando_para_criada_com_atraso(banco):
+    record_id = banco.inserir(status="PROCESSANDO", emissao_solicitada=True,
+                              lease_owner="w1", lease_expira_em=_daqui(30), tentativas=1)
+
+    asyncio.run(_fila(banco).nack(record_id, "falha", delay=60))
+
+    registro = banco.buscar(record_id)
+    assert (registro["status"], registro["lease_owner"]) == ("CRIADA", None)
+    assert _reivindicar(banco) == []
+
+    banco.executar("update public.nfe set lease_expira_em = now() - interval '1 second'")
+    reivindicado, = _reivindicar(banco, owner="w2")
+    assert (reivindicado["id"], reivindicado["tentativas"]) == (record_id, 2)
+
+
+def test_varredura_devolve_lease_vencido_e_esgota_com_evento_de_webhook(banco):
+    vencido = banco.inserir(status="PROCESSANDO", emissao_solicitada=True,
+                            lease_owner="w1", lease_expira_em=_daqui(-1), tentativas=1)
+    esgotado = banco.inserir(status="PROCESSANDO", emissao_solicitada=True,
+                             lease_owner="w1", lease_expira_em=_daqui(-1), tentativas=3)
+    devolvido_na_ultima = banco.inserir(status="CRIADA", emissao_solicitada=True, tentativas=3)
+    em_dia = banco.inserir(status="PROCESSANDO", emissao_solicitada=True,
+                           lease_owner="w1", lease_expira_em=_daqui(60), tentativas=3)
+
+    varridos = asyncio.run(NFeService(banco.client).sweep_leases(3))
+
+    assert varridos == 3
+    assert banco.buscar(vencido)["status"] == "CRIADA"
+    assert banco.buscar(esgotado)["status"] == "ERRO"
+    assert banco.buscar(devolvido_na_ultima)["status"] == "ERRO"
+    assert banco.buscar(em_dia)["status"] == "PROCESSANDO"
+    eventos = banco.executar("select nfe_id, status from public.nfe_webhook_eventos order by id")
+    assert sorted((e["nfe_id"], e["status"]) for e in eventos) == sorted(
+        [(esgotado, "ERRO"), (devolvido_na_ultima, "ERRO")])
@@ -0,0 +1,159 @@
+import asyncio
+import json
+from pathlib import Path
+
+from app.models.nfe import NFe
+from app.utils.build_nfe_xml import build_nfe_xml
+from app.utils.chave_acesso import gerar_chave_acesso
+from app.workers.nfe_workflow_orchestrator import DuplicidadeSemProtocoloError, NFeWorkflowOrchestrator
+from app.workers.sefaz_sender import SefazSender
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+AUTORIZADA = {"status": "AUTORIZADA", "protocolo": "135000000000001", "chave_nfe": "35" + "1" * 42}
+DUPLICIDADE = {"status": "REJEITADA", "codigo": "204", "mensagem": "Duplicidade de NF-e"}
+
+
+class FakeStateManager:
+    def __init__(self, payload=None, xml_assinado="<NFe/>"):
+        self.payload = payload or json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+        self.xml_assinado = xml_assinado
+        self.erros = []
+
+    async def preparar_processamento(self, record_id, retomada=False):
+        return {"id": record_id, "payload_envio": self.payload, "xml_assinado": self.xml_assinado}
+
+    async def marcar_erro(self, record_id, erro, contexto=None):
+        self.erros.append(erro)
+
+
+class FakeSender:
+    def __init__(self, envio, protocolo=None):
+        self.envio = envio
+        self.protocolo = protocolo
+        self.chamadas = []
+
+    async def assinar(self, contexto):
+        return contexto.xml_assinado
+
+    async def enviar(self, contexto):
+        self.chamadas.append("enviar")
+        return self.envio
+
+    async def consultar_protocolo(self, contexto):
+        self.chamadas.append("consultar")
+        return self.protocolo
+
+
+class FakeResultProcessor:
+    def __init__(self):
+        self.resultados = []
+
+    async def processar(self, record_id, result, contexto=None):
+        self.resultados.append(result)
+
+
+def _processar(sender, retomada, state_manager=None):
+    state_manager = state_manager or FakeStateManager()
+    result_processor = FakeResultProcessor()
+    orchestrator = NFeWorkflowOrchestrator(
+        None, state_manager, None, sender, None, result_processor)
+    asyncio.run(orchestrator.processar("nfe-1", retomada=retomada))
+    return result_processor.resultados, state_manager.erros
+
+
+def test_retomada_ja_autorizada_nao_e_reenviada():
+    sender = FakeSender(envio=DUPLICIDADE, protocolo=AUTORIZADA)
+
+    resultados, erros = _processar(sender, retomada=True)
+
+    assert sender.chamadas == ["consultar"]
+    assert resultados == [AUTORIZADA] and erros == []
+
+
+def test_retomada_sem_protocolo_e_reenviada():
+    sender = FakeSender(envio=AUTORIZADA)
+
+    resultados, _ = _processar(sender, retomada=True)
+
+    assert sender.chamadas == ["consultar", "enviar"]
+    assert resultados == [AUTORIZADA]
+
+
+def test_primeira_tentativa_envia_sem_consultar():
+    sender = FakeSender(envio=AUTORIZADA, protocolo=AUTORIZADA)
+
+    _processar(sender, retomada=False)
+
+    assert sender.chamadas == ["enviar"]
+
+
+def test_duplicidade_usa_o_protocolo_da_chave():
+    sender = FakeSender(envio=DUPLICIDADE, protocolo=AUTORIZADA)
+
+    resultados, erros = _processar(sender, retomada=False)
+
+    assert sender.chamadas == ["enviar", "consultar"]
+    assert resultados == [AUTORIZADA] and erros == []
+
+
+def test_duplicidade_sem_protocolo_vai_para_erro_e_nao_rejeitada():
+    sender = FakeSender(envio=DUPLICIDADE)
+
+    resultados, erros = _processar(sender, retomada=False)
+
+    assert resultados == []
+    assert [type(e) for e in erros] == [DuplicidadeSemProtocoloError]
+
+
+class FakeSefazAPI:
+    """Autorizador que já tem protocolo para as chaves em `autorizadas`"""
+
+    def __init__(self, autorizadas):
+        self.autorizadas = autorizadas
+        self.consultas = []
+
+    async def consultar_protocolo_async(self, chave, uf, cnpj=None):
+        self.consultas.append(chave)
+        if chave in self.autorizadas:
+            return {"status": "AUTORIZADA", "protocolo": "135000000000001", "chave_nfe": chave}
+        return None
+
+
+class FakeAggregator:
+    def __init__(self, sefaz_api):
+        self.sefaz_api = sefaz_api
+        self.enviados = []
+
+    async def enviar(self, xml, uf, cnpj=None, assinado=False):
+        self.enviados.append(xml)
+        return AUTORIZADA
+
+
+def _retomada_com_sender_real(payload, autorizadas):
+    xml = build_nfe_xml(NFe(**payload))
+    api = FakeSefazAPI(autorizadas)
+    aggregator = FakeAggregator(api)
+    resultados, erros = _processar(
+        SefazSender(aggregator), retomada=True,
+        state_manager=FakeStateManager(payload, xml_assinado=xml))
+    return resultados, erros, api.consultas, aggregator.enviados
+
+
+def test_retomada_de_nfe_numerada_ja_autorizada_termina_autorizada_sem_reenvio():
+    payload = {**json.loads(NFE_EXEMPLO.read_text(encoding="utf-8")), "numero_nota": 42}
+    chave = gerar_chave_acesso(NFe(**payload))
+
+    resultados, erros, consultas, enviados = _retomada_com_sender_real(payload, {chave})
+
+    assert consultas == [chave]
+    assert enviados == []
+    assert [r["status"] for r in resultados] == ["AUTORIZADA"] and erros == []
+    assert resultados[0]["chave_nfe"] == chave
+
+
+def test_retomada_de_nfe_sem_numero_nao_consulta_e_reenvia():
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+
+    _, _, consultas, enviados = _retomada_com_sender_real(payload, set())
+
+    assert consultas == [] and len(enviados) == 1
@@ -0,0 +1,137 @@
+import asyncio
+
+from app.infra.work_queue import SQLiteWorkQueue
+from app.workers.nfe_workflow_orchestrator import NFeWorkflowOrchestrator
+from app.workers.queue_worker import NFeQueueWorker
+
+
+class FakeStateManager:
+    def __init__(self):
+        self.status = "CRIADA"
+        self.erros = []
+
+    async def preparar_processamento(self, record_id, retomada=False):
+        de = ("CRIADA", "PROCESSANDO") if retomada else ("CRIADA",)
+        if self.status not in de:
+            return None
+        self.status = "PROCESSANDO"
+        return {"id": record_id, "xml_assinado": "<NFe/>"}
+
+    async def marcar_erro(self, record_id, erro, contexto=None):
+        self.status = "ERRO"
+        self.erros.append(erro)
+
+
+class FakeSender:
+    def __init__(self, falhas):
+        self.falhas = list(falhas)
+
+    async def enviar(self, contexto):
+        if self.falhas:
+            raise self.falhas.pop(0)
+        return {"status": "AUTORIZADA"}
+
+    async def consultar_protocolo(self, contexto):
+        return None  # A SEFAZ não recebeu a NF-e antes da falha
+
+
+class FakeResultProcessor:
+    def __init__(self, state_manager):
+        self.state_manager = state_manager
+
+    async def processar(self, record_id, result, contexto=None):
+        self.state_manager.status = result["status"]
+
+
+def _worker(tmp_path, falhas, max_tentativas=5):
+    queue = SQLiteWorkQueue(str(tmp_path / "fila.db"), max_tentativas=max_tentativas)
+    state_manager = FakeStateManager()
+    orchestrator = NFeWorkflowOrchestrator(
+        None, state_manager, None, FakeSender(falhas), None, FakeResultProcessor(state_manager))
+    return NFeQueueWorker(queue, orchestrator, concurrency=1), queue, state_manager
+
+
+async def _executar_proximo(worker, queue):
+    # Ignora o atraso do nack para reentregar o job na hora
+    queue._conn.execute("UPDATE jobs SET disponivel_em = 0")
+    jobs = await queue.claim(1, 60)
+    assert len(jobs) == 1
+    await worker._executar(jobs[0])
+    return jobs[0]
+
+
+def _status_job(queue):
+    row = queue._conn.execute("SELECT status FROM jobs").fetchone()
+    return row[0] if row else None
+
+
+def test_erro_transitorio_reentrega_e_retoma_registro_em_processamento(tmp_path):
+    async def cenario():
+        worker, queue, state_manager = _worker(tmp_path, [ConnectionError("timeout na SEFAZ")])
+        await queue.enqueue("nfe-1")
+
+        await _executar_proximo(worker, queue)
+        assert state_manager.status == "PROCESSANDO"
+        assert _status_job(queue) == "PENDENTE"
+
+        await _executar_proximo(worker, queue)
+        assert state_manager.status == "AUTORIZADA"
+        assert _status_job(queue) is None
+        queue.close()
+
+    asyncio.run(cenario())
+
+
+def test_erro_definitivo_marca_erro_e_confirma_job(tmp_path):
+    async def cenario():
+        worker, queue, state_manager = _worker(tmp_path, [ValueError("payload inválido")])
+        await queue.enqueue("nfe-1")
+
+        await _executar_proximo(worker, queue)
+        assert state_manager.status == "ERRO"
+        assert _status_job(queue) is None
+        queue.close()
+
+    asyncio.run(cenario())
+
+
+def test_erro_transitorio_na_ultima_tentativa_marca_erro(tmp_path):
+    async def cenario():
+        worker, queue, state_manager = _worker(
+            tmp_path, [ConnectionError("a"), ConnectionError("b")], max_tentativas=2)
+        await queue.enqueue("nfe-1")
+
+        await _executar_proximo(worker, queue)
+        await _executar_proximo(worker, queue)
+        assert state_manager.status == "ERRO"
+        assert _status_job(queue) is None
+        queue.close()
+
+    asyncio.run(cenario())
+
+
+def test_drenar_aguarda_jobs_cancelados_antes_do_nack(tmp_path):
+    async def cenario():
+        queue = SQLiteWorkQueue(str(tmp_path / "fila.db"))
+        finalizados = []
+
+        class Lento:
+            async def processar(self, record_id, **kwargs):
+                try:
+                    await asyncio.sleep(60)
+                finally:
+                    finalizados.append(record_id)
+
+        worker = NFeQueueWorker(queue, Lento(), concurrency=1, poll_interval=0.01, drain_timeout=0.05)
+        await queue.enqueue("nfe-1")
+        execucao = asyncio.create_task(worker.run())
+        while not worker._in_flight:
+            await asyncio.sleep(0.01)
+
+        worker.stop()
+        await execucao
+        assert finalizados == ["nfe-1"]
+        assert _status_job(queue) == "PENDENTE"
+        queue.close()
+
+    asyncio.run(cenario())
@@ -0,0 +1,129 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.common.patterns import rate_limit
+from app.common.patterns.rate_limit import (
+    InMemoryRateLimitBackend, RateLimit, RedisRateLimitBackend, _TOKEN_BUCKET_SHA,
+)
+from app.infra.resp_client import RespClient, RespError
+
+pytest.importorskip("lupa")
+from tests.resp_stand_in import RespStandIn  # noqa: E402
+
+
+class Relogio:
+    def __init__(self, agora: float = 1_000_000.0):
+        self.agora = agora
+
+    def __call__(self) -> float:
+        return self.agora
+
+    def monotonic(self) -> float:
+        return self.agora
+
+    def avancar(self, segundos: float) -> None:
+        self.agora += segundos
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    # Só o relógio do rate limit; o event loop segue com o tempo real
+    monkeypatch.setattr(rate_limit, "time", relogio)
+    return relogio
+
+
+@asynccontextmanager
+async def _backend(tipo, relogio):
+    if tipo == "memoria":
+        yield InMemoryRateLimitBackend()
+        return
+    async with RespStandIn(relogio) as servidor:
+        backend = RedisRateLimitBackend(RespClient(servidor.url))
+        try:
+            yield backend
+        finally:
+            await backend.aclose()
+
+
+BACKENDS = ["memoria", "redis"]
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_capacidade_consumida_e_reposta_pela_taxa(tipo, relogio):
+    limite = RateLimit.parse("3/3")
+
+    async def cenario():
+        async with _backend(tipo, relogio) as backend:
+            resultados = [await backend.consumir("c", limite) for _ in range(4)]
+            assert [r.permitido for r in resultados] == [True, True, True, False]
+            assert [r.restantes for r in resultados[:3]] == [2, 1, 0]
+            assert resultados[3].retry_after == pytest.approx(1.0)
+
+            relogio.avancar(0.5)
+            assert not (await backend.consumir("c", limite)).permitido
+
+            relogio.avancar(0.5)
+            assert (await backend.consumir("c", limite)).permitido
+
+    asyncio.run(cenario())
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_reposicao_limitada_a_capacidade(tipo, relogio):
+    limite = RateLimit.parse("2/1")
+
+    async def cenario():
+        async with _backend(tipo, relogio) as backend:
+            for _ in range(2):
+                await backend.consumir("c", limite)
+            relogio.avancar(60)
+            resultados = [await backend.consumir("c", limite) for _ in range(3)]
+            assert [r.permitido for r in resultados] == [True, True, False]
+
+    asyncio.run(cenario())
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_buckets_independentes_por_chave(tipo, relogio):
+    limite = RateLimit.parse("1/10")
+
+    async def cenario():
+        async with _backend(tipo, relogio) as backend:
+            assert (await backend.consumir("a", limite)).permitido
+            assert not (await backend.consumir("a", limite)).permitido
+            assert (await backend.consumir("b", limite)).permitido
+
+    asyncio.run(cenario())
+
+
+def test_redis_carrega_o_script_uma_vez_e_expira_a_chave(relogio):
+    limite = RateLimit.parse("2/2")
+
+    async def cenario():
+        async with RespStandIn(relogio, senha="s3nha") as servidor:
+            backend = RedisRateLimitBackend(RespClient(servidor.url), prefixo="rl:")
+            await backend.consumir("c", limite)
+            await backend.consumir("c", limite)
+            await backend.aclose()
+
+            nomes = [comando[0] for comando in servidor.comandos]
+            assert nomes == ["AUTH", "SELECT", "EVALSHA", "EVAL", "EVALSHA"]
+            assert servidor.comandos[2][1] == _TOKEN_BUCKET_SHA
+            assert servidor.expira_em["rl:c"] == pytest.approx(relogio() + 2)
+
+    asyncio.run(cenario())
+
+
+def test_redis_propaga_erros_que_nao_sao_noscript(relogio):
+    async def cenario():
+        async with RespStandIn(relogio, senha="certa") as servidor:
+            url = servidor.url.replace("certa", "errada")
+            backend = RedisRateLimitBackend(RespClient(url))
+            with pytest.raises(RespError):
+                await backend.consumir("c", RateLimit.parse("1/1"))
+            await backend.aclose()
+
+    asyncio.run(cenario())
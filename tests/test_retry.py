@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from app.common.patterns import retry
+from app.common.patterns.circuit_breaker import (
+    CircuitBreaker, CircuitBreakerConfig, CircuitBreakerStatus, retry_with_circuit_breaker,
+)
+from app.common.patterns.retry import RetryBudget, RetryPolicy, is_retryable
+from app.core.sefaz import NFE_NS, SefazAPI, SefazIndisponivelError
+
+
+def _status(codigo: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://sefaz/NFeAutorizacao4.asmx")
+    return httpx.HTTPStatusError(
+        f"HTTP {codigo}", request=request, response=httpx.Response(codigo, request=request))
+
+
+def _postgres(codigo: str) -> APIError:
+    return APIError({"code": codigo, "message": "erro", "details": None, "hint": None})
+
+
+def _ret_envi_nfe(cstat: str) -> str:
+    return (f'<retEnviNFe xmlns="{NFE_NS}" versao="4.00">'
+            f'<cStat>{cstat}</cStat><xMotivo>motivo {cstat}</xMotivo></retEnviNFe>')
+
+
+@pytest.mark.parametrize("cstat", ["108", "109"])
+def test_servico_paralisado_e_transitorio(cstat):
+    api = SefazAPI(signer=None, wsdl_provider=None, client_registry=object())
+
+    with pytest.raises(SefazIndisponivelError) as erro:
+        api._parse_lote(_ret_envi_nfe(cstat))
+
+    assert is_retryable(erro.value)
+    assert api._parse_lote(_ret_envi_nfe("103"))["codigo"] == "103"
+
+
+@pytest.mark.parametrize("codigo", [500, 502, 503, 504, 408, 425, 429])
+def test_5xx_e_429_sao_transitorios(codigo):
+    assert is_retryable(_status(codigo))
+
+
+@pytest.mark.parametrize("codigo", [400, 401, 403, 404, 409, 422])
+def test_demais_4xx_nao_sao_repetidos(codigo):
+    assert not is_retryable(_status(codigo))
+    assert not is_retryable(HTTPException(status_code=codigo))
+
+
+@pytest.mark.parametrize("codigo", ["22P02", "23505", "42703"])
+def test_erros_de_dados_do_postgres_nao_sao_repetidos(codigo):
+    assert not is_retryable(_postgres(codigo))
+
+
+@pytest.mark.parametrize("codigo", ["40001", "53300", "57014", "08006"])
+def test_demais_erros_do_postgres_sao_transitorios(codigo):
+    assert is_retryable(_postgres(codigo))
+
+
+def _breaker(nome: str) -> CircuitBreaker:
+    # Limite alto: o teste mede o orçamento de retries, não o breaker
+    return CircuitBreaker(CircuitBreakerConfig(failure_threshold=10_000), name=nome)
+
+
+def _politica(**kwargs) -> RetryPolicy:
+    return RetryPolicy(initial_delay=0, max_delay=0, jitter=False, **kwargs)
+
+
+def test_erro_nao_transitorio_nao_e_repetido_nem_conta_como_falha():
+    breaker = _breaker("teste-nao-transitorio")
+    tentativas = []
+
+    async def operacao():
+        tentativas.append(1)
+        raise _postgres("23505")
+
+    with pytest.raises(APIError):
+        asyncio.run(retry_with_circuit_breaker(operacao, breaker, _politica(max_attempts=3, use_budget=False)))
+
+    assert len(tentativas) == 1
+    assert breaker.failure_count == 0
+    assert breaker.state == CircuitBreakerStatus.CLOSED
+
+
+def test_orcamento_limita_retries_de_chamadas_concorrentes(monkeypatch):
+    nome = "teste-orcamento"
+    # 20% das chamadas, sem o mínimo por segundo: 100 chamadas liberam 20 retries
+    monkeypatch.setitem(retry._retry_budgets, nome, RetryBudget(ratio=0.2, min_per_second=0))
+    breaker = _breaker(nome)
+    tentativas = []
+
+    async def operacao():
+        tentativas.append(1)
+        await asyncio.sleep(0)
+        raise _status(503)
+
+    async def cenario(politica):
+        return await asyncio.gather(
+            *(retry_with_circuit_breaker(operacao, breaker, politica) for _ in range(100)),
+            return_exceptions=True,
+        )
+
+    resultados = asyncio.run(cenario(_politica(max_attempts=3)))
+    assert all(isinstance(r, httpx.HTTPStatusError) for r in resultados)
+    assert len(tentativas) == 120
+
+    # Sem orçamento, cada chamada faz as 3 novas tentativas
+    tentativas.clear()
+    asyncio.run(cenario(_politica(max_attempts=3, use_budget=False)))
+    assert len(tentativas) == 400
@@ -0,0 +1,74 @@
+import asyncio
+import json
+from pathlib import Path
+
+from app.core.sefaz import ProtocoloAusenteError
+from app.models.nfe import NFe
+from app.utils.build_nfe_xml import build_nfe_xml
+from app.workers.sefaz_lote_aggregator import SefazLoteAggregator
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+
+# Id gerado por build_nfe_xml, sem chave de acesso
+NFE_ID_PLACEHOLDER = "NFe" + "0" * 44
+CHAVE_A = "35" + "1" * 42
+CHAVE_B = "35" + "2" * 42
+
+
+def _xml(id_):
+    return f'<NFe><infNFe versao="4.00" Id="{id_}"></infNFe></NFe>'
+
+
+class FakeSefazAPI:
+    def __init__(self, resultados=None):
+        self.lotes = []
+        self.resultados = resultados
+
+    async def send_lote_async(self, xmls, uf, id_lote, cnpj=None, assinados=False):
+        self.lotes.append(xmls)
+        if self.resultados is not None:
+            return self.resultados
+        return [{"status": "AUTORIZADA"} for _ in xmls]
+
+
+def test_nfe_sem_chave_vai_em_lote_proprio():
+    async def cenario():
+        api = FakeSefazAPI()
+        aggregator = SefazLoteAggregator(api, max_wait=0.01)
+        await asyncio.gather(
+            aggregator.enviar(_xml(NFE_ID_PLACEHOLDER), "SP"),
+            aggregator.enviar(_xml(NFE_ID_PLACEHOLDER), "SP"),
+            aggregator.enviar(_xml(f"NFe{CHAVE_A}"), "SP"),
+            aggregator.enviar(_xml(f"NFe{CHAVE_B}"), "SP"),
+        )
+        return sorted(len(lote) for lote in api.lotes)
+
+    assert asyncio.run(cenario()) == [1, 1, 2]
+
+
+def test_nfe_numeradas_por_build_nfe_xml_vao_no_mesmo_lote():
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+    xmls = [build_nfe_xml(NFe(**payload, numero_nota=numero)) for numero in (1, 2, 3)]
+
+    async def cenario():
+        api = FakeSefazAPI()
+        aggregator = SefazLoteAggregator(api, max_wait=0.01)
+        await asyncio.gather(*(aggregator.enviar(xml, "SP") for xml in xmls))
+        return api.lotes
+
+    assert asyncio.run(cenario()) == [xmls]
+
+
+def test_nfe_sem_protocolo_no_retorno_falha_com_erro_transitorio():
+    async def cenario():
+        api = FakeSefazAPI(resultados=[None, {"status": "AUTORIZADA"}])
+        aggregator = SefazLoteAggregator(api, max_wait=0.01)
+        return await asyncio.gather(
+            aggregator.enviar(_xml(f"NFe{CHAVE_A}"), "SP"),
+            aggregator.enviar(_xml(f"NFe{CHAVE_B}"), "SP"),
+            return_exceptions=True,
+        )
+
+    sem_protocolo, autorizada = asyncio.run(cenario())
+    assert isinstance(sem_protocolo, ProtocoloAusenteError)
+    assert autorizada == {"status": "AUTORIZADA"}
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app.core.sefaz import SefazAPI, SefazIndisponivelError, chave_do_xml
+
+# Id gerado por build_nfe_xml, sem chave de acesso
+NFE_ID_PLACEHOLDER = "NFe" + "0" * 44
+CHAVE_A = "35" + "1" * 42
+CHAVE_B = "35" + "2" * 42
+
+
+def _api():
+    return SefazAPI(signer=None, wsdl_provider=None, client_registry=object())
+
+
+def _prot(chave, status="AUTORIZADA"):
+    return {"status": status, "chave_nfe": chave}
+
+
+def test_protocolos_associados_pela_chave_fora_de_ordem():
+    protocolos = [_prot(CHAVE_B, "REJEITADA"), _prot(CHAVE_A)]
+
+    assert _api().mapear_protocolos([CHAVE_A, CHAVE_B], protocolos) == [
+        _prot(CHAVE_A), _prot(CHAVE_B, "REJEITADA")]
+
+
+def test_chave_sem_protocolo_recebe_none_em_vez_da_ordem_do_lote():
+    protocolos = [_prot(CHAVE_B)]
+
+    assert _api().mapear_protocolos([CHAVE_A, CHAVE_B], protocolos) == [None, _prot(CHAVE_B)]
+
+
+def test_chaves_ausentes_ou_repetidas_nao_sao_associadas():
+    protocolos = [_prot(CHAVE_A), _prot(CHAVE_B)]
+
+    assert _api().mapear_protocolos([None, None], protocolos) == [None, None]
+    assert _api().mapear_protocolos([CHAVE_A, CHAVE_A], protocolos) == [None, None]
+
+
+def test_lote_de_uma_nfe_com_um_protocolo():
+    assert _api().mapear_protocolos([None], [_prot(CHAVE_A)]) == [_prot(CHAVE_A)]
+    assert _api().mapear_protocolos([CHAVE_A], [_prot(CHAVE_A)]) == [_prot(CHAVE_A)]
+    assert _api().mapear_protocolos([CHAVE_A], [_prot(CHAVE_B)]) == [None]
+
+
+def test_lote_processado_sem_o_protocolo_da_nfe():
+    lote = {"codigo": "104", "mensagem": "Lote processado", "protocolos": [_prot(CHAVE_B)]}
+
+    assert _api()._resultados_lote(lote, [CHAVE_A, CHAVE_B]) == [None, _prot(CHAVE_B)]
+
+
+def test_chave_provisoria_nao_identifica_a_nfe():
+    assert chave_do_xml(f'<infNFe versao="4.00" Id="{NFE_ID_PLACEHOLDER}">') is None
+    assert chave_do_xml(f'<infNFe versao="4.00" Id="NFe{CHAVE_A}">') == CHAVE_A
+
+
+class _FakeWSDL:
+    def get_consulta_protocolo(self, uf):
+        return "http://sefaz/NFeConsultaProtocolo4.asmx?wsdl"
+
+
+class _FakeRegistry:
+    def __init__(self, resposta):
+        self.resposta = resposta
+        self.enviados = []
+
+    async def get_async(self, wsdl, cert=None):
+        return self
+
+    async def consultar_protocolo(self, xml):
+        self.enviados.append(xml)
+        return self.resposta
+
+
+def _consultar(resposta):
+    registry = _FakeRegistry(resposta)
+    api = SefazAPI(signer=None, wsdl_provider=_FakeWSDL(), client_registry=registry)
+    return asyncio.run(api.consultar_protocolo_async(CHAVE_A, "SP")), registry.enviados
+
+
+def _ret_cons_sit(cstat, motivo, prot=""):
+    return (
+        f'<retConsSitNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        f'<tpAmb>2</tpAmb><cStat>{cstat}</cStat><xMotivo>{motivo}</xMotivo>{prot}</retConsSitNFe>'
+    )
+
+
+def test_consulta_protocolo_de_nfe_autorizada():
+    prot = (
+        '<protNFe versao="4.00"><infProt><chNFe>' + CHAVE_A + '</chNFe>'
+        '<dhRecbto>2026-10-17T10:00:00-03:00</dhRecbto><nProt>135000000000001</nProt>'
+        '<cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo></infProt></protNFe>'
+    )
+
+    resultado, enviados = _consultar(_ret_cons_sit("100", "Autorizado o uso da NF-e", prot))
+
+    assert (resultado["status"], resultado["protocolo"], resultado["chave_nfe"]) == (
+        "AUTORIZADA", "135000000000001", CHAVE_A)
+    assert f"<chNFe>{CHAVE_A}</chNFe>" in enviados[0]
+
+
+def test_consulta_protocolo_de_nfe_desconhecida():
+    resultado, _ = _consultar(_ret_cons_sit("217", "NF-e não consta na base de dados da SEFAZ"))
+
+    assert resultado is None
+
+
+def test_consulta_protocolo_com_servico_paralisado():
+    with pytest.raises(SefazIndisponivelError):
+        _consultar(_ret_cons_sit("108", "Serviço Paralisado Momentaneamente"))
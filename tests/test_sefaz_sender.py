@@ -0,0 +1,49 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from app.common.patterns.circuit_breaker import CircuitBreakerOpenError
+from app.workers.nfe_contexto import NFeContexto
+from app.workers.sefaz_sender import SefazSender
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+
+
+class FakeAggregator:
+    sefaz_api = None
+
+    def __init__(self):
+        self.enviados = []
+
+    async def enviar(self, xml, uf, cnpj=None, assinado=False):
+        self.enviados.append((uf, assinado))
+        return {"status": "AUTORIZADA"}
+
+
+def _contexto(uf):
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+    payload["uf_emitente"] = uf
+    return NFeContexto(record_id="nfe-1", record={"payload_envio": payload}, xml_assinado="<NFe/>")
+
+
+def test_enviar_usa_o_breaker_da_uf_do_emitente():
+    aggregator = FakeAggregator()
+    sender = SefazSender(aggregator)
+    sender.circuit_breaker("SP").reset()
+    sender.circuit_breaker("RJ").reset()
+    for _ in range(sender.circuit_breaker_config.failure_threshold):
+        sender.circuit_breaker("RJ").record_failure("fora do ar")
+
+    async def cenario():
+        assert await sender.enviar(_contexto("SP")) == {"status": "AUTORIZADA"}
+        with pytest.raises(CircuitBreakerOpenError):
+            await sender.enviar(_contexto("RJ"))
+
+    try:
+        asyncio.run(cenario())
+    finally:
+        sender.circuit_breaker("RJ").reset()
+
+    assert aggregator.enviados == [("SP", True)]
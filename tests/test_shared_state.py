@@ -0,0 +1,112 @@
+import asyncio
+import multiprocessing
+import time
+
+from app.common.patterns.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitBreakerStatus
+from app.common.patterns.rate_limit import RateLimit, SharedMemoryRateLimitBackend
+from app.common.patterns.shared_state import SLOT_VALUES, SharedState, _PROBE
+
+PROCESSOS = 4
+SLOTS = 64
+# Reposição desprezível durante o teste: o total liberado é a capacidade
+LIMITE = "100/86400"
+BREAKER = CircuitBreakerConfig(failure_threshold=3, reset_timeout=2, half_open_max_calls=1)
+
+
+def _em_processos(alvo, *args):
+    """Roda `alvo(path, barreira, *args)` em PROCESSOS processos e devolve os retornos"""
+    contexto = multiprocessing.get_context("spawn")
+    barreira = contexto.Barrier(PROCESSOS)
+    fila = contexto.Queue()
+    processos = [
+        contexto.Process(target=_executar, args=(fila, alvo, barreira) + args)
+        for _ in range(PROCESSOS)
+    ]
+    for processo in processos:
+        processo.start()
+    resultados = [fila.get(timeout=60) for _ in processos]
+    for processo in processos:
+        processo.join(timeout=60)
+        assert processo.exitcode == 0
+    return resultados
+
+
+def _executar(fila, alvo, barreira, *args):
+    fila.put(alvo(barreira, *args))
+
+
+def _consumir(barreira, path: str, requisicoes: int) -> int:
+    backend = SharedMemoryRateLimitBackend(SharedState(path, slots=SLOTS))
+    limite = RateLimit.parse(LIMITE)
+
+    async def consumir():
+        return [await backend.consumir("cliente", limite) for _ in range(requisicoes)]
+
+    barreira.wait()
+    return sum(resultado.permitido for resultado in asyncio.run(consumir()))
+
+
+def _abrir_breaker(barreira, path: str) -> str:
+    breaker = CircuitBreaker(BREAKER, name="sefaz-SP", shared_state=SharedState(path, slots=SLOTS))
+    barreira.wait()
+    breaker.record_failure("timeout")
+    return breaker.state.value
+
+
+def _testar_half_open(barreira, path: str) -> bool:
+    breaker = CircuitBreaker(BREAKER, name="sefaz-SP", shared_state=SharedState(path, slots=SLOTS))
+    barreira.wait()
+    return breaker.can_retry()
+
+
+def test_rate_limit_dividido_entre_processos(tmp_path):
+    path = str(tmp_path / "estado")
+
+    liberadas = _em_processos(_consumir, path, 60)
+
+    assert sum(liberadas) == 100
+
+
+def test_slot_mais_antigo_da_faixa_e_reaproveitado(tmp_path):
+    path = str(tmp_path / "estado")
+    # Com um slot, toda chave começa na mesma posição e a faixa tem _PROBE slots
+    escrita, leitura = SharedState(path, slots=1), SharedState(path, slots=1)
+    chaves = [f"k{i}" for i in range(_PROBE)]
+
+    for valor, chave in enumerate(chaves, start=1):
+        with escrita.slot(chave) as valores:
+            valores[0] = valor
+    # Usar k0 de novo deixa k1 como o menos recente
+    with escrita.slot("k0") as valores:
+        assert valores[0] == 1
+
+    with escrita.slot("nova") as valores:
+        assert valores == [0.0] * SLOT_VALUES
+        valores[0] = 99
+
+    # Ler uma chave ausente também ocupa um slot, então k1 é conferida por último
+    for valor, chave in enumerate(chaves, start=1):
+        if chave != "k1":
+            with leitura.slot(chave) as valores:
+                assert valores[0] == valor
+    with leitura.slot("nova") as valores:
+        assert valores[0] == 99
+    with leitura.slot("k1") as valores:
+        assert valores[0] == 0
+
+
+def test_estado_do_breaker_compartilhado_entre_processos(tmp_path):
+    path = str(tmp_path / "estado")
+    breaker = CircuitBreaker(BREAKER, name="sefaz-SP", shared_state=SharedState(path, slots=SLOTS))
+
+    # Cada processo registra uma falha; juntas passam do failure_threshold
+    _em_processos(_abrir_breaker, path)
+
+    assert breaker.state == CircuitBreakerStatus.OPEN
+    assert breaker.failure_count == PROCESSOS
+    assert not breaker.can_retry()
+
+    # Depois do reset_timeout, só um processo faz a chamada de teste
+    time.sleep(2.1)
+    assert sorted(_em_processos(_testar_half_open, path)) == [False] * (PROCESSOS - 1) + [True]
+    assert breaker.state == CircuitBreakerStatus.HALF_OPEN
@@ -0,0 +1,118 @@
+import asyncio
+
+import psycopg
+import pytest
+
+from app.infra.webhook_outbox import SQLiteWebhookOutbox
+from app.services.nfe.nfe import NFeService
+from app.services.webhook_notifier.webhook_notifier import WebhookNotifier
+from app.workers.webhook_relay import WebhookRelay
+
+WEBHOOK_URL = "http://cliente.test/webhook"
+
+
+def _eventos(banco):
+    return [(e["nfe_id"], e["status"]) for e in banco.executar(
+        "select nfe_id, status from public.nfe_webhook_eventos order by id")]
+
+
+def _inserir(banco, **campos):
+    return banco.inserir(payload_envio={"client": {"webhook_url": WEBHOOK_URL}}, **campos)
+
+
+def test_trigger_grava_evento_na_mudanca_de_status(banco):
+    record_id = _inserir(banco, status="CRIADA")
+
+    banco.executar("update public.nfe set status = 'PROCESSANDO' where id = %s", (record_id,))
+    banco.executar("update public.nfe set status = 'PROCESSANDO', payload_retorno = '{}' where id = %s",
+                   (record_id,))
+    banco.executar("update public.nfe set chave_nfe = '1' where id = %s", (record_id,))
+    banco.executar("update public.nfe set status = 'AUTORIZADA' where id = %s", (record_id,))
+
+    assert _eventos(banco) == [(record_id, "PROCESSANDO"), (record_id, "AUTORIZADA")]
+    registro = banco.executar("select registro from public.nfe_webhook_eventos limit 1")[0]["registro"]
+    assert registro == {"id": record_id, "ref": banco.buscar(record_id)["ref"],
+                        "payload_envio": {"client": {"webhook_url": WEBHOOK_URL}}}
+
+
+def test_evento_some_com_o_rollback_do_update(banco):
+    record_id = _inserir(banco, status="CRIADA")
+
+    with pytest.raises(psycopg.errors.RaiseException):
+        banco.executar("""
+            do $$ begin
+                update public.nfe set status = 'PROCESSANDO' where id = '%s';
+                raise exception 'falha depois do update';
+            end $$""" % record_id)
+
+    assert banco.buscar(record_id)["status"] == "CRIADA"
+    assert _eventos(banco) == []
+
+
+def test_rpc_de_lote_e_sweeper_tambem_gravam_eventos(banco):
+    processando = _inserir(banco, status="PROCESSANDO", lease_owner="w",
+                           lease_expira_em="2000-01-01", tentativas=5)
+    criada = _inserir(banco, status="CRIADA")
+
+    banco.executar("select public.nfe_varrer_leases(5)")
+    banco.executar("select * from public.nfe_atualizar_lote(%s::jsonb)",
+                   ('[{"id": "%s", "payload": {"status": "PROCESSANDO"}, "expected": ["CRIADA"]}]' % criada,))
+
+    assert _eventos(banco) == [(processando, "ERRO"), (criada, "PROCESSANDO")]
+
+
+def test_eventos_reivindicados_por_um_relay_e_confirmados_so_pelo_dono(banco):
+    for _ in range(3):
+        banco.executar("update public.nfe set status = 'PROCESSANDO' where id = %s",
+                       (_inserir(banco, status="CRIADA"),))
+
+    async def cenario():
+        service = NFeService(banco.client)
+        a = await service.claim_webhook_events("a", 2, 60)
+        b = await service.claim_webhook_events("b", 2, 60)
+        assert len(a) == 2 and len(b) == 1
+        assert not {e["id"] for e in a} & {e["id"] for e in b}
+
+        assert await service.ack_webhook_events("b", [e["id"] for e in a]) == 0
+        assert await service.ack_webhook_events("a", [e["id"] for e in a]) == 2
+        assert await service.claim_webhook_events("c", 10, 60) == []
+
+    asyncio.run(cenario())
+    assert len(_eventos(banco)) == 1
+
+
+def test_relay_repassa_eventos_ao_outbox_e_apaga_do_banco(banco, tmp_path):
+    record_id = _inserir(banco, status="CRIADA")
+    banco.executar("update public.nfe set status = 'PROCESSANDO' where id = %s", (record_id,))
+    banco.executar("update public.nfe set status = 'AUTORIZADA' where id = %s", (record_id,))
+
+    outbox = SQLiteWebhookOutbox(str(tmp_path / "outbox.db"))
+    relay = WebhookRelay(NFeService(banco.client), WebhookNotifier(outbox=outbox), owner="w")
+
+    assert asyncio.run(relay.executar_ciclo()) == 2
+    assert _eventos(banco) == []
+    pendentes = outbox._conn.execute("select record_id, url, status from eventos").fetchall()
+    assert pendentes == [(record_id, WEBHOOK_URL, "AUTORIZADA")]
+    outbox.close()
+
+
+def test_falha_no_outbox_mantem_os_eventos_restantes_no_banco(banco, tmp_path):
+    for _ in range(2):
+        banco.executar("update public.nfe set status = 'PROCESSANDO' where id = %s",
+                       (_inserir(banco, status="CRIADA"),))
+
+    class OutboxFalho:
+        def __init__(self):
+            self.chamadas = 0
+
+        async def adicionar(self, *args, **kwargs):
+            self.chamadas += 1
+            if self.chamadas > 1:
+                raise OSError("disco cheio")
+            return True
+
+    relay = WebhookRelay(NFeService(banco.client), WebhookNotifier(outbox=OutboxFalho()), owner="w")
+
+    with pytest.raises(Exception, match="Falha ao registrar webhook no outbox"):
+        asyncio.run(relay.executar_ciclo())
+    assert len(_eventos(banco)) == 1
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+from lxml import etree
+from signxml import DigestAlgorithm, SignatureConfiguration, SignatureMethod, XMLSigner, XMLVerifier, methods
+from signxml.exceptions import InvalidInput, InvalidSignature
+
+from app.core.sefaz import chave_do_xml
+from app.models.nfe import NFe
+from app.services.xml_signer import xml_signer_real
+from app.services.xml_signer.xml_signer_real import C14N_2001, ProcessPoolXMLSigner, XMLSignerReal, _NFeSigner
+from app.utils.build_nfe_xml import build_nfe_xml
+
+NFE_EXEMPLO = Path(__file__).resolve().parent.parent / "app" / "nfes" / "nfe.json"
+SENHA = "teste"
+# O leiaute da NF-e assina com RSA-SHA1, fora dos algoritmos aceitos por padrão
+CONFIG_NFE = SignatureConfiguration(
+    signature_methods=frozenset({SignatureMethod.RSA_SHA1}),
+    digest_algorithms=frozenset({DigestAlgorithm.SHA1}),
+)
+
+
+def _certificado(nome: str):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    sujeito = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nome)])
+    agora = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(sujeito)
+        .issuer_name(sujeito)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora - timedelta(days=1))
+        .not_valid_after(agora + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return key, cert
+
+
+def _gravar_pfx(path: Path, nome: str):
+    key, cert = _certificado(nome)
+    path.write_bytes(pkcs12.serialize_key_and_certificates(
+        nome.encode(), key, cert, None, serialization.BestAvailableEncryption(SENHA.encode())))
+    return cert
+
+
+@pytest.fixture
+def pfx(tmp_path):
+    path = tmp_path / "certificado.pfx"
+    return path, _gravar_pfx(path, "Empresa Exemplo LTDA")
+
+
+def _xml(numero_nota: int = 1) -> str:
+    payload = json.loads(NFE_EXEMPLO.read_text(encoding="utf-8"))
+    return build_nfe_xml(NFe(**payload, numero_nota=numero_nota))
+
+
+def _verificar(xml_assinado: str, cert) -> None:
+    root = etree.fromstring(xml_assinado.encode("utf-8"))
+    inf_nfe = root.find("{http://www.portalfiscal.inf.br/nfe}infNFe")
+    referencia = root.find(".//{http://www.w3.org/2000/09/xmldsig#}Reference")
+    assert referencia.get("URI") == f"#{inf_nfe.get('Id')}"
+
+    resultado = XMLVerifier().verify(
+        root,
+        x509_cert=cert.public_bytes(serialization.Encoding.PEM).decode(),
+        id_attribute="Id",
+        expect_config=CONFIG_NFE,
+    )
+    assert resultado.signed_xml.get("Id") == inf_nfe.get("Id")
+
+
+def test_assina_a_nfe_de_exemplo(pfx):
+    path, cert = pfx
+
+    _verificar(XMLSignerReal(str(path), SENHA).sign(_xml()), cert)
+
+
+def test_xml_alterado_depois_de_assinado_nao_verifica(pfx):
+    path, cert = pfx
+    assinado = XMLSignerReal(str(path), SENHA).sign(_xml())
+
+    with pytest.raises(InvalidSignature):
+        _verificar(assinado.replace("Venda de mercadoria", "Venda de mercadoria alterada"), cert)
+
+
+def test_signxml_padrao_recusa_sha1_e_o_signer_da_nfe_aceita(pfx):
+    path, _ = pfx
+    key, cert = XMLSignerReal(str(path), SENHA).load_key_and_certificate()
+    parametros = dict(method=methods.enveloped, signature_algorithm="rsa-sha1",
+                      digest_algorithm="sha1", c14n_algorithm=C14N_2001)
+
+    with pytest.raises(InvalidInput):
+        XMLSigner(**parametros).sign(etree.fromstring(_xml().encode()), key=key, cert=[cert])
+
+    _NFeSigner(**parametros).sign(etree.fromstring(_xml().encode()), key=key, cert=[cert])
+
+
+def test_certificado_carregado_uma_vez_e_recarregado_quando_o_arquivo_muda(pfx, monkeypatch):
+    path, _ = pfx
+    cargas = []
+    carregar = pkcs12.load_key_and_certificates
+
+    def contar(*args, **kwargs):
+        cargas.append(1)
+        return carregar(*args, **kwargs)
+
+    monkeypatch.setattr(xml_signer_real.pkcs12, "load_key_and_certificates", contar)
+    signer = XMLSignerReal(str(path), SENHA)
+
+    signer.sign(_xml(1))
+    signer.sign(_xml(2))
+    assert len(cargas) == 1
+
+    novo_cert = _gravar_pfx(path, "Empresa Renovada LTDA")
+    stat = path.stat()
+    # Garante mtime diferente mesmo em sistemas de arquivos com resolução baixa
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    _verificar(signer.sign(_xml(3)), novo_cert)
+    assert len(cargas) == 2
+
+
+def test_process_pool_assina_e_verifica(pfx):
+    path, cert = pfx
+    signer = ProcessPoolXMLSigner(str(path), SENHA, max_workers=2)
+    try:
+        xmls = [_xml(numero) for numero in range(1, 6)]
+
+        chaves = [chave_do_xml(xml) for xml in xmls]
+
+        _verificar(signer.sign(xmls[0]), cert)
+        for assinados in (signer.sign_many(xmls), asyncio.run(signer.sign_many_async(xmls))):
+            assert [chave_do_xml(assinado) for assinado in assinados] == chaves
+            for assinado in assinados:
+                _verificar(assinado, cert)
+    finally:
+        signer.shutdown()
@@ -0,0 +1,212 @@
+import asyncio
+import gzip
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.infra.recibo_store import ReciboItem, SQLiteReciboStore
+from app.infra.xml_storage import (
+    LocalBlobStore, SupabaseBlobStore, XMLStorage, chave_da_url, chave_do_conteudo, get_xml_storage,
+)
+from app.workers.result_processor import ResultProcessor
+
+XML = '<?xml version="1.0" encoding="utf-8"?>\n<NFe xmlns="http://www.portalfiscal.inf.br/nfe">' \
+      + "<det/>" * 200 + "</NFe>"
+CHAVE = chave_do_conteudo(XML.encode("utf-8"))
+
+
+class _ErroStorage(Exception):
+    def __init__(self, status):
+        super().__init__(f"status {status}")
+        self.status = status
+
+
+class FakeBucket:
+    """Supabase Storage: upload recusa (409) objeto existente"""
+
+    def __init__(self):
+        self.objetos = {}
+        self.uploads = 0
+
+    async def upload(self, chave, dados, opcoes):
+        self.uploads += 1
+        if chave in self.objetos:
+            raise _ErroStorage(409)
+        self.objetos[chave] = dados
+
+    async def download(self, chave):
+        if chave not in self.objetos:
+            raise _ErroStorage(404)
+        return self.objetos[chave]
+
+    async def get_public_url(self, chave):
+        return f"https://projeto.supabase.co/storage/v1/object/public/nfe-xml/{chave}"
+
+    async def create_signed_url(self, chave, ttl):
+        return {"signedURL": f"https://projeto.supabase.co/storage/v1/object/sign/nfe-xml/{chave}?token=t"}
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.bucket = FakeBucket()
+        self.storage = self
+
+    def from_(self, nome):
+        return self.bucket
+
+
+def test_chave_e_o_sha256_do_xml_nao_comprimido():
+    digest = hashlib.sha256(XML.encode("utf-8")).hexdigest()
+    assert CHAVE == f"{digest[:2]}/{digest}.xml.gz"
+    assert chave_do_conteudo(XML.replace("<det/>", "<det />", 1).encode()) != CHAVE
+
+
+def test_salvar_local_e_idempotente(tmp_path):
+    storage = XMLStorage(LocalBlobStore(str(tmp_path)))
+
+    url = asyncio.run(storage.salvar(XML))
+    arquivo = tmp_path / CHAVE
+    antes = arquivo.stat()
+    assert asyncio.run(storage.salvar(XML)) == url
+
+    depois = arquivo.stat()
+    assert (depois.st_ino, depois.st_mtime_ns) == (antes.st_ino, antes.st_mtime_ns)
+    assert gzip.decompress(arquivo.read_bytes()).decode("utf-8") == XML
+    assert [p.name for p in arquivo.parent.iterdir()] == [arquivo.name]
+
+
+def test_salvar_supabase_ignora_objeto_existente():
+    cliente = FakeSupabase()
+    storage = XMLStorage(SupabaseBlobStore(cliente))
+
+    urls = {asyncio.run(storage.salvar(XML)) for _ in range(2)}
+
+    assert cliente.bucket.uploads == 2 and list(cliente.bucket.objetos) == [CHAVE]
+    assert gzip.decompress(asyncio.run(storage.ler(urls.pop()))).decode("utf-8") == XML
+
+
+def test_mesmo_xml_gera_os_mesmos_bytes_comprimidos(tmp_path):
+    cliente = FakeSupabase()
+    asyncio.run(XMLStorage(SupabaseBlobStore(cliente)).salvar(XML))
+    asyncio.run(XMLStorage(LocalBlobStore(str(tmp_path))).salvar(XML))
+
+    assert cliente.bucket.objetos[CHAVE] == (tmp_path / CHAVE).read_bytes()
+
+
+def test_chave_da_url_de_qualquer_backend(tmp_path):
+    local = asyncio.run(XMLStorage(LocalBlobStore(str(tmp_path))).salvar(XML))
+    supabase = asyncio.run(XMLStorage(SupabaseBlobStore(FakeSupabase())).salvar(XML))
+
+    assert local.startswith("file://") and supabase.startswith("https://")
+    assert chave_da_url(local) == chave_da_url(supabase) == CHAVE
+    with pytest.raises(ValueError):
+        chave_da_url("https://exemplo/qualquer.xml")
+
+
+class FakeNFeService:
+    def __init__(self, registro):
+        self.registro = registro
+
+    async def get_by_id(self, record_id):
+        return self.registro if record_id == self.registro["id"] else None
+
+
+@pytest.fixture
+def cliente_http(tmp_path):
+    storage = XMLStorage(LocalBlobStore(str(tmp_path)))
+    url = asyncio.run(storage.salvar(XML))
+    registro = {"id": "nfe-1", "status": "AUTORIZADA", "chave_nfe": "35" + "1" * 42, "xml_url": url}
+
+    main.app.dependency_overrides[main.get_nfe_service] = lambda: FakeNFeService(registro)
+    main.app.dependency_overrides[get_xml_storage] = lambda: storage
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_download_gzip_envia_o_arquivo_comprimido(cliente_http):
+    with cliente_http.stream("GET", "/nfe/nfe-1/xml", headers={"Accept-Encoding": "gzip"}) as resposta:
+        bruto = b"".join(resposta.iter_raw())
+
+    assert resposta.status_code == 200
+    assert resposta.headers["content-encoding"] == "gzip"
+    assert f"{'35' + '1' * 42}-procNFe.xml" in resposta.headers["content-disposition"]
+    assert gzip.decompress(bruto).decode("utf-8") == XML
+
+
+def test_download_identity_descomprime(cliente_http):
+    resposta = cliente_http.get("/nfe/nfe-1/xml", headers={"Accept-Encoding": "identity"})
+
+    assert resposta.status_code == 200
+    assert "content-encoding" not in resposta.headers
+    assert resposta.text == XML
+
+
+def test_download_com_range_devolve_parte_do_arquivo_comprimido(cliente_http, tmp_path):
+    comprimido = (tmp_path / CHAVE).read_bytes()
+
+    with cliente_http.stream("GET", "/nfe/nfe-1/xml",
+                             headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"}) as resposta:
+        bruto = b"".join(resposta.iter_raw())
+
+    assert resposta.status_code == 206
+    assert bruto == comprimido[:10]
+    assert resposta.headers["content-range"] == f"bytes 0-9/{len(comprimido)}"
+
+
+def test_download_sem_xml_url_e_404(cliente_http):
+    assert cliente_http.get("/nfe/outra/xml").status_code == 404
+
+
+class _ReciboStoreMemoria:
+    def __init__(self):
+        self.itens = []
+
+    async def adicionar(self, recibo, uf, item, tempo_medio, proxima_consulta, cnpj=None):
+        self.itens.append(item)
+
+
+class _StateMachine:
+    def __init__(self):
+        self.finalizados = []
+
+    async def registrar_retorno(self, record_id, sefaz_result, campos):
+        pass
+
+    async def finalizar(self, record_id, status, campos):
+        self.finalizados.append((record_id, status, campos))
+        return {"id": record_id}
+
+
+class _SemLeitura:
+    async def get_by_id(self, record_id):
+        raise AssertionError("o XML assinado deveria vir do recibo")
+
+
+def test_recibo_guarda_o_xml_assinado_e_dispensa_a_leitura_do_registro(tmp_path):
+    store = SQLiteReciboStore(str(tmp_path / "recibos.db"))
+    storage = XMLStorage(LocalBlobStore(str(tmp_path / "xml")))
+    state_machine = _StateMachine()
+    processor = ResultProcessor(_SemLeitura(), store, state_machine, storage)
+    protocolo = '<protNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"/>'
+
+    async def cenario():
+        await store.adicionar("r1", "SP", ReciboItem("nfe-1", 0, None, XML), None, 0)
+        (pendente,) = await store.vencidos(10)
+        item = pendente.itens[0]
+        await processor.processar(item.record_id, {"status": "AUTORIZADA", "prot_nfe": protocolo},
+                                  xml_assinado=item.xml_assinado)
+
+    try:
+        asyncio.run(cenario())
+    finally:
+        store.close()
+
+    (_, status, campos), = state_machine.finalizados
+    assert status == "AUTORIZADA"
+    proc = gzip.decompress(asyncio.run(storage.ler(campos["xml_url"]))).decode("utf-8")
+    assert proc.startswith('<?xml version="1.0" encoding="utf-8"?>\n<nfeProc')
+    assert "<det/>" in proc and proc.endswith(f"{protocolo}</nfeProc>")